@@ -1,5 +1,6 @@
 import os
 import logging
+import click
 from logging.handlers import RotatingFileHandler
 from flask import Flask, render_template
 from werkzeug.security import generate_password_hash
@@ -9,6 +10,17 @@ from config import Config
 from extensions import db, login_manager, csrf, migrate, limiter
 from models import User
 from utils import ensure_local_resources, cleanup_pending_deletions
+from services.search_service import SearchService
+from services.tag_count_service import TagCountService
+from services.image_count_service import ImageCountService
+from services.listing_service import ListingService
+from services.image_service import ImageService
+from services.trending_service import TrendingService
+from services.change_service import ChangeService
+from services.snapshot_service import SnapshotService
+from services.related_service import RelatedService
+from services.prompt_token_service import PromptTokenService
+from services.maintenance_service import MaintenanceService
 
 
 def create_app(config_class=Config):
@@ -35,9 +47,18 @@ def create_app(config_class=Config):
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp)
 
+    # 趋势排行 / 相关作品的后台维护线程（每个进程处理首个请求时启动）
+    MaintenanceService.init_app(app)
+
     # 检查静态资源
     with app.app_context():
+        ensure_schema_columns(app)
         ensure_query_indexes(app)
+        ensure_search_index(app)
+        ensure_random_keys(app)
+        ensure_heat_scores(app)
+        ensure_sensitive_flags(app)
+        ensure_change_log(app)
         apply_dynamic_config(app)
         cleanup_pending_deletions(app)
         ensure_local_resources(app)
@@ -101,7 +122,26 @@ def register_commands(app):
     def init_db_command():
         """初始化数据库和管理员账户"""
         db.create_all()
+        ensure_schema_columns(app)
         ensure_query_indexes(app)
+        ensure_search_index(app)
+        backfilled = SearchService.reindex(only_missing=True)
+        if backfilled:
+            print(f"[OK] Search index backfilled: {backfilled} images")
+        backfilled = PromptTokenService.reindex(only_missing=True)
+        if backfilled:
+            print(f"[OK] Prompt token index backfilled: {backfilled} images")
+        fixed = TagCountService.rebuild()
+        if fixed:
+            print(f"[OK] Tag counts rebuilt: {fixed} rows corrected")
+        ensure_random_keys(app)
+        ensure_heat_scores(app)
+        ensure_sensitive_flags(app)
+        ensure_change_log(app)
+        fixed = ImageCountService.rebuild()
+        if fixed:
+            print(f"[OK] Image counts rebuilt: {fixed} rows corrected")
+        TrendingService.rebuild()
         admin_user = app.config['ADMIN_USERNAME']
         admin_pass = app.config['ADMIN_PASSWORD']
 
@@ -113,6 +153,159 @@ def register_commands(app):
         else:
             print(f"[INFO] Admin user already exists: {admin_user}")
 
+    @app.cli.command("search-reindex")
+    @click.option('--missing', is_flag=True, help='仅回填尚未建立索引的作品')
+    def search_reindex_command(missing):
+        """重建全文检索索引 (search_text / tsvector / FTS5)"""
+        ensure_search_index(app)
+        count = SearchService.reindex(only_missing=missing)
+        print(f"[OK] Reindexed {count} images (backend: {app.config['SEARCH_BACKEND']})")
+
+    @app.cli.command("reindex-prompt-tokens")
+    @click.option('--missing', is_flag=True, help='仅回填尚未建立词元索引的作品')
+    def reindex_prompt_tokens_command(missing):
+        """重建 Prompt 词元索引（token= 过滤与词元频次 / 共现统计）"""
+        count = PromptTokenService.reindex(only_missing=missing)
+        print(f"[OK] Prompt tokens indexed for {count} images")
+
+    @app.cli.command("rebuild-tag-counts")
+    def rebuild_tag_counts_command():
+        """标签计数一致性重建（与明细表比对并修正）"""
+        fixed = TagCountService.rebuild()
+        print(f"[OK] Tag counts checked, {fixed} rows corrected")
+
+    @app.cli.command("rebuild-image-counts")
+    def rebuild_image_counts_command():
+        """作品计数一致性重建（列表总数使用的计数表）"""
+        fixed = ImageCountService.rebuild()
+        print(f"[OK] Image counts checked, {fixed} rows corrected")
+
+    @app.cli.command("rebuild-trending")
+    def rebuild_trending_command():
+        """重建趋势排行 (sort=trending)"""
+        count = TrendingService.rebuild()
+        print(f"[OK] Trending ranking rebuilt: {count} images ranked")
+
+    @app.cli.command("rebuild-related")
+    @click.option('--full', is_flag=True, help='全量重建（默认只处理上次之后变化的作品）')
+    def rebuild_related_command(full):
+        """刷新相关作品表 (/api/images/<id>/related)"""
+        result = RelatedService.refresh(full=full)
+        print(f"[OK] Related images refreshed: {result['recomputed']} recomputed, "
+              f"{result['merged']} merged, {result['removed']} removed")
+
+    @app.cli.command("rebuild-sensitive-flags")
+    def rebuild_sensitive_flags_command():
+        """按标签重算作品的敏感标记 (image.is_sensitive)"""
+        changed = ImageService.refresh_sensitive()
+        db.session.commit()
+        if changed:
+            ImageCountService.rebuild()
+        print(f"[OK] Sensitive flags checked, {changed} images corrected")
+
+    @app.cli.command("build-snapshot")
+    @click.option('--force', is_flag=True, help='忽略上一次的清单，全部分片重新生成')
+    @click.option('--watch', is_flag=True, help='常驻运行，作品变更后自动增量重建')
+    @click.option('--interval', type=int, default=None, help='--watch 模式的检查间隔（秒）')
+    def build_snapshot_command(force, watch, interval):
+        """生成公开目录的静态 JSON 分片快照（static/snapshot，只重写内容变化的分片）"""
+        result = SnapshotService.build(force=force)
+        print(f"[OK] Snapshot built in {SnapshotService.output_dir()}: {result['shards']} shards "
+              f"({result['written']} written, {result['removed']} files removed), {result['total']} images")
+        if watch:
+            SnapshotService.watch(interval or app.config['SNAPSHOT_WATCH_INTERVAL'])
+
+
+def ensure_schema_columns(app):
+    """为已有数据库补齐新增的列（db.create_all 不会修改已存在的表）。"""
+    from sqlalchemy import text, inspect as sa_inspect
+
+    columns = [
+        ('image', 'search_text', 'TEXT'),
+        ('image', 'random_key', 'FLOAT'),
+        ('image', 'is_sensitive', 'BOOLEAN'),
+        ('image', 'updated_at', 'TIMESTAMP'),
+    ]
+
+    try:
+        inspector = sa_inspect(db.engine)
+        for table, column, ddl in columns:
+            if not inspector.has_table(table):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column in existing:
+                continue
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            app.logger.info(f"Added column {table}.{column}")
+    except Exception as e:
+        app.logger.warning(f"Ensure columns skipped: {e}")
+
+
+def ensure_random_keys(app):
+    """为历史作品补齐 random_key（random 排序依赖该列）。"""
+    try:
+        from sqlalchemy import inspect as sa_inspect
+        if not sa_inspect(db.engine).has_table('image'):
+            return
+        count = ListingService.backfill_random_keys()
+        if count:
+            app.logger.info(f"Backfilled random_key for {count} images")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Random key backfill skipped: {e}")
+
+
+def ensure_heat_scores(app):
+    """为历史作品补齐 heat_score（hot 排序的游标分页要求该列非空）。"""
+    try:
+        from sqlalchemy import inspect as sa_inspect
+        if not sa_inspect(db.engine).has_table('image'):
+            return
+        count = ListingService.backfill_heat_scores()
+        if count:
+            app.logger.info(f"Backfilled heat_score for {count} images")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Heat score backfill skipped: {e}")
+
+
+def ensure_sensitive_flags(app):
+    """为历史作品回填 is_sensitive（访客列表依赖该列过滤敏感内容）。"""
+    try:
+        from sqlalchemy import inspect as sa_inspect
+        if not sa_inspect(db.engine).has_table('image'):
+            return
+        count = ImageService.refresh_sensitive(only_missing=True)
+        db.session.commit()
+        if count:
+            # 敏感标记变化会改变计数表的分组
+            ImageCountService.rebuild()
+            app.logger.info(f"Backfilled is_sensitive for {count} images")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Sensitive flag backfill skipped: {e}")
+
+
+def ensure_change_log(app):
+    """为历史作品回填 updated_at 与初始变更记录（/api/changes 增量同步依赖）。"""
+    try:
+        from sqlalchemy import inspect as sa_inspect
+        inspector = sa_inspect(db.engine)
+        if not inspector.has_table('image') or not inspector.has_table('image_change'):
+            return
+        count = ChangeService.backfill()
+        if count:
+            app.logger.info(f"Backfilled change log for {count} images")
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Change log backfill skipped: {e}")
+
+
+def ensure_search_index(app):
+    """创建全文检索结构（PostgreSQL tsvector + GIN / SQLite FTS5）。"""
+    SearchService.ensure_search_index(app)
+
 
 def ensure_query_indexes(app):
     """Ensure query-critical indexes exist for both SQLite and PostgreSQL."""
@@ -123,6 +316,11 @@ def ensure_query_indexes(app):
         "CREATE INDEX IF NOT EXISTS ix_image_status_category_created_at ON image (status, category, created_at)",
         "CREATE INDEX IF NOT EXISTS ix_image_status_category_heat_created_at ON image (status, category, heat_score, created_at)",
         "CREATE INDEX IF NOT EXISTS ix_image_status_category_type_created_at ON image (status, category, type, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_image_random_key ON image (random_key)",
+        "CREATE INDEX IF NOT EXISTS ix_image_status_category_random_key ON image (status, category, random_key)",
+        "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_created_at ON image (status, category, is_sensitive, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_heat_created_at ON image (status, category, is_sensitive, heat_score, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_random_key ON image (status, category, is_sensitive, random_key)",
         "CREATE INDEX IF NOT EXISTS ix_image_tags_image_id ON image_tags (image_id)",
         "CREATE INDEX IF NOT EXISTS ix_image_tags_tag_id ON image_tags (tag_id)",
         "CREATE INDEX IF NOT EXISTS ix_image_tags_tag_image ON image_tags (tag_id, image_id)",
@@ -2,10 +2,20 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
     stream_with_context, send_file, jsonify
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, Image, Tag, ReferenceImage, SystemSetting, User
+from sqlalchemy.orm import selectinload
+from models import db, Image, Tag, ReferenceImage, SystemSetting, User, image_tags, get_url_root
 from services.image_service import ImageService
 from services.data_service import DataService
 from services.config_service import ConfigService
+from services.search_service import SearchService
+from services.tag_count_service import TagCountService
+from services.image_count_service import ImageCountService
+from services.change_service import ChangeService
+from services.listing_service import ListingService
+from services.catalog_version_service import CatalogVersionService
+from services.stats_service import StatsService
+from services.view_dedupe_service import ViewDedupeService
+from services.prompt_token_service import PromptTokenService
 import json
 import time
 import zipfile
@@ -62,11 +72,7 @@ def dashboard():
     # 已发布列表（含搜索和分页）
     approved_query = Image.query.filter_by(status='approved')
     if search_query:
-        approved_query = approved_query.filter(
-            Image.title.contains(search_query) |
-            Image.author.contains(search_query) |
-            Image.prompt.contains(search_query)
-        )
+        approved_query = SearchService.apply(approved_query, search_query)
 
     page = request.args.get('page', 1, type=int)
     # 支持动态 per_page 参数，否则使用默认配置
@@ -76,12 +82,17 @@ def dashboard():
     # 限制 per_page 在合理范围内 (6-100)
     per_page = max(6, min(100, per_page))
 
-    approved_pagination = approved_query.order_by(Image.created_at.desc()).paginate(page=page, per_page=per_page)
+    # 总数：无搜索时读计数表，搜索时走缓存 / 估算的 COUNT
+    counter = ImageCountService.counter(show_sensitive=True, filtered=bool(search_query))
+    approved_pagination = ListingService.paginate(approved_query, 'date', page, per_page, counter=counter)
+
+    # 两个列表一起批量序列化，避免逐卡片懒加载标签 / 参考图
+    img_dicts = {d['id']: d for d in Image.bulk_to_dict(pending_images + list(approved_pagination.items))}
 
     all_tags = Tag.query.order_by(Tag.name).all()
 
     stats = {
-        'total_images': Image.query.count(),
+        'total_images': ImageCountService.total(),
         'total_tags': Tag.query.count()
     }
 
@@ -104,6 +115,7 @@ def dashboard():
     return render_template('admin.html',
                            pending_images=pending_images,
                            approved_pagination=approved_pagination,
+                           img_dicts=img_dicts,
                            active_tab=active_tab,
                            search_query=search_query,
                            all_tags=all_tags,
@@ -123,7 +135,10 @@ def approve(img_id):
     """审核通过单个作品"""
     img = db.session.get(Image, img_id)
     if img:
-        img.status = 'approved'
+        with TagCountService.track([img.id]), ImageCountService.track([img.id]):
+            img.status = 'approved'
+        ChangeService.record([img.id])
+        CatalogVersionService.bump(img.category)
         db.session.commit()
         flash('作品已发布')
     return redirect(url_for('admin.dashboard', tab='pending'))
@@ -135,7 +150,12 @@ def approve_all():
     """一键通过所有待审核作品"""
     try:
         # 批量更新效率更高
-        updated_count = Image.query.filter_by(status='pending').update({'status': 'approved'})
+        pending_ids = [i for (i,) in db.session.query(Image.id).filter_by(status='pending')]
+        with TagCountService.track(pending_ids), ImageCountService.track(pending_ids):
+            updated_count = Image.query.filter_by(status='pending').update({'status': 'approved'})
+        if updated_count:
+            ChangeService.record(pending_ids)
+            CatalogVersionService.bump()
         db.session.commit()
         if updated_count > 0:
             flash(f'🎉 已一键通过 {updated_count} 个作品！')
@@ -215,50 +235,61 @@ def import_zip():
 @login_required
 def export_zip():
     """导出全量数据包 (含图片和元数据)"""
-    images = Image.query.all()
-    if not images:
+    if not db.session.query(Image.id).first():
         flash('没有数据可导出')
         return redirect(url_for('admin.dashboard', tab='data-mgmt'))
 
     memory_file = io.BytesIO()
+    url_root = get_url_root()
 
     # 构建 ZIP
     with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
         json_data = []
         upload_root = os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
 
-        for img in images:
-            # 准备元数据
-            item_data = img.to_dict()
-
-            img_filename = os.path.basename(img.file_path)
-            item_data['zip_image_path'] = f"images/{img_filename}"
-
-            if img.thumbnail_path:
-                thumb_name = os.path.basename(img.thumbnail_path)
-                item_data['zip_thumb_path'] = f"images/{thumb_name}"
-
-            # 写入主图
-            abs_img_path = os.path.join(upload_root, img_filename)
-            if os.path.exists(abs_img_path):
-                zf.write(abs_img_path, f"images/{img_filename}")
-
-            # 写入缩略图
-            if img.thumbnail_path:
-                abs_thumb = os.path.join(upload_root, os.path.basename(img.thumbnail_path))
-                if os.path.exists(abs_thumb):
-                    zf.write(abs_thumb, f"images/{os.path.basename(img.thumbnail_path)}")
-
-            # 写入参考图
-            item_data['refs'] = []
-            for ref in img.refs:
-                ref_fname = os.path.basename(ref.file_path)
-                abs_ref_path = os.path.join(upload_root, ref_fname)
-                if os.path.exists(abs_ref_path):
-                    zf.write(abs_ref_path, f"images/{ref_fname}")
-                    item_data['refs'].append(f"images/{ref_fname}")
-
-            json_data.append(item_data)
+        # 按 id 分批读取，标签和参考图随批次 selectinload，不再逐条懒加载
+        last_id = 0
+        while True:
+            images = Image.query.options(selectinload(Image.tags), selectinload(Image.refs)) \
+                .filter(Image.id > last_id).order_by(Image.id).limit(500).all()
+            if not images:
+                break
+            last_id = images[-1].id
+
+            for img in images:
+                # 准备元数据
+                item_data = img.to_dict(url_root=url_root)
+
+                img_filename = os.path.basename(img.file_path)
+                item_data['zip_image_path'] = f"images/{img_filename}"
+
+                if img.thumbnail_path:
+                    thumb_name = os.path.basename(img.thumbnail_path)
+                    item_data['zip_thumb_path'] = f"images/{thumb_name}"
+
+                # 写入主图
+                abs_img_path = os.path.join(upload_root, img_filename)
+                if os.path.exists(abs_img_path):
+                    zf.write(abs_img_path, f"images/{img_filename}")
+
+                # 写入缩略图
+                if img.thumbnail_path:
+                    abs_thumb = os.path.join(upload_root, os.path.basename(img.thumbnail_path))
+                    if os.path.exists(abs_thumb):
+                        zf.write(abs_thumb, f"images/{os.path.basename(img.thumbnail_path)}")
+
+                # 写入参考图
+                item_data['refs'] = []
+                for ref in img.refs:
+                    if ref.is_placeholder or not ref.file_path:
+                        continue
+                    ref_fname = os.path.basename(ref.file_path)
+                    abs_ref_path = os.path.join(upload_root, ref_fname)
+                    if os.path.exists(abs_ref_path):
+                        zf.write(abs_ref_path, f"images/{ref_fname}")
+                        item_data['refs'].append(f"images/{ref_fname}")
+
+                json_data.append(item_data)
 
         # 写入 JSON 索引
         zf.writestr("data.json", json.dumps({"images": json_data}, ensure_ascii=False, indent=2))
@@ -306,24 +337,43 @@ def update_tag():
     if not tag:
         return (jsonify({'status': 'error'}), 404) if is_json else redirect(url_for('admin.dashboard'))
 
+    counts_dirty = False
+    affected_ids = [i for (i,) in db.session.query(image_tags.c.image_id).filter(image_tags.c.tag_id == tag.id)]
+
     # 更新状态
     if tag.is_sensitive != is_sensitive:
-        tag.is_sensitive = is_sensitive
+        with ImageCountService.track(affected_ids):
+            tag.is_sensitive = is_sensitive
+            ImageService.refresh_sensitive(affected_ids)
+        ChangeService.record(affected_ids)
+        CatalogVersionService.bump()
         db.session.commit()
+        counts_dirty = True
 
     # 更新名称（合并逻辑）
     if new_name and new_name != tag.name:
         existing = Tag.query.filter_by(name=new_name).first()
         if existing:
-            for img in tag.images:
-                if img not in existing.images:
-                    existing.images.append(img)
-            db.session.delete(tag)
+            with ImageCountService.track(affected_ids):
+                for img in tag.images:
+                    if img not in existing.images:
+                        existing.images.append(img)
+                db.session.delete(tag)
+                # 并入的标签可能敏感性不同
+                ImageService.refresh_sensitive(affected_ids)
             flash(f'标签已合并至: {new_name}')
+            counts_dirty = True
         else:
             tag.name = new_name
+        # 标签名出现在作品数据中，重命名 / 合并都算关联作品的变更
+        ChangeService.record(affected_ids)
+        CatalogVersionService.bump()
         db.session.commit()
 
+    # 敏感性变化会改变关联作品的可见性，合并会迁移计数，直接做一致性重建
+    if counts_dirty:
+        TagCountService.rebuild()
+
     _clean_orphaned_tags()
 
     if is_json: return jsonify({'status': 'ok'})
@@ -544,6 +594,42 @@ def check_update():
         })
 
 
+@bp.route('/stats/metrics', methods=['GET'])
+@login_required
+def stats_metrics():
+    """浏览 / 复制计数聚合器的刷写指标（当前 worker），以及浏览去重的命中率与内存占用"""
+    data = StatsService.metrics()
+    data['view_dedupe'] = ViewDedupeService.metrics()
+    return jsonify({'status': 'ok', 'data': data})
+
+
+@bp.route('/stats/prompt-tokens', methods=['GET'])
+@login_required
+def stats_prompt_tokens():
+    """
+    Prompt 词元统计（已发布作品）：默认返回使用最多的词元；
+    传 token= 时返回与该词元共同出现的词元及比例。可选 category=gallery/template、limit（最多 500）
+    """
+    category = request.args.get('category', '').strip()
+    if category not in ('gallery', 'template'):
+        category = None
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    token = request.args.get('token', '').strip()
+    if token:
+        data = PromptTokenService.cooccurrence(token, limit=limit, category=category)
+    else:
+        data = PromptTokenService.frequency(limit=limit, category=category)
+    return jsonify({'status': 'ok', 'data': data})
+
+
+@bp.route('/stats/flush', methods=['POST'])
+@login_required
+def stats_flush():
+    """立即刷写当前 worker 缓冲的计数"""
+    flushed = StatsService.flush()
+    return jsonify({'status': 'ok', 'flushed': flushed, 'data': StatsService.metrics()})
+
+
 @bp.route('/batch/delete', methods=['POST'])
 @login_required
 def batch_delete():
@@ -592,24 +678,30 @@ def batch_modify_tags():
 
         # 批量修改
         modified_count = 0
-        for img_id in img_ids:
-            img = db.session.get(Image, img_id)
-            if not img:
-                continue
-
-            if action == 'add':
-                # 添加标签（避免重复）
-                for tag in tags:
-                    if tag not in img.tags:
-                        img.tags.append(tag)
-                        modified_count += 1
-            elif action == 'remove':
-                # 删除标签
-                for tag in tags:
-                    if tag in img.tags:
-                        img.tags.remove(tag)
-                        modified_count += 1
-
+        with TagCountService.track(img_ids), ImageCountService.track(img_ids):
+            for img_id in img_ids:
+                img = db.session.get(Image, img_id)
+                if not img:
+                    continue
+
+                if action == 'add':
+                    # 添加标签（避免重复）
+                    for tag in tags:
+                        if tag not in img.tags:
+                            img.tags.append(tag)
+                            modified_count += 1
+                elif action == 'remove':
+                    # 删除标签
+                    for tag in tags:
+                        if tag in img.tags:
+                            img.tags.remove(tag)
+                            modified_count += 1
+
+                ImageService.sync_sensitive(img)
+
+        if modified_count:
+            ChangeService.record(img_ids)
+            CatalogVersionService.bump()
         db.session.commit()
 
         action_text = '添加' if action == 'add' else '删除'
@@ -637,7 +729,10 @@ def toggle_category(img_id, category):
 
     try:
         old_category = img.category
-        img.category = category
+        with TagCountService.track([img.id]), ImageCountService.track([img.id]):
+            img.category = category
+        ChangeService.record([img.id], old_categories=[old_category])
+        CatalogVersionService.bump(old_category, category)
         db.session.commit()
         category_text = '画廊' if category == 'gallery' else '模板'
 
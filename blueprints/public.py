@@ -1,25 +1,60 @@
 import hashlib
 import json
 import time
-from flask import Blueprint, render_template, request, current_app, url_for, jsonify, make_response
+from flask import Blueprint, render_template, request, current_app, url_for, jsonify, make_response, \
+    Response, stream_with_context
 from flask_login import current_user
-from sqlalchemy.sql.expression import func
-from models import db, Image, Tag, SystemSetting
+from models import Image, SystemSetting, get_url_root
 from extensions import limiter, csrf
 from services.image_service import ImageService
+from services.listing_service import ListingService, CursorError, PageSnapshot
+from services.tag_count_service import TagCountService
+from services.tag_suggest_service import TagSuggestService
+from services.catalog_version_service import CatalogVersionService
+from services.response_cache import ResponseCache
+from services.stats_service import StatsService
+from services.view_dedupe_service import ViewDedupeService
+from services.change_service import ChangeService
+from services.event_stream_service import EventStreamService
+from services.compression_service import CompressionService
+from services.image_lookup_service import ImageLookupService
+from services.related_service import RelatedService
+from services.prompt_token_service import PromptTokenService
+from services.config_service import ConfigService
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 bp = Blueprint('public', __name__)
 
+# 流式输出时每批读取 / 序列化的记录数
+STREAM_BATCH_SIZE = 500
+
+# 列表 API 的输出格式 -> Content-Type
+API_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/x-msgpack',
+}
+
+
+@bp.after_request
+def compress_response(response):
+    """页面与 API 响应按 Accept-Encoding 压缩（流式响应除外）"""
+    return CompressionService.apply(response)
+
 
 def can_see_sensitive():
     """判断当前用户是否有权查看敏感内容"""
     if current_user.is_authenticated: return True
 
-    # 修改点：从数据库读取开关 (持久化)
-    allow_toggle = SystemSetting.get_bool('allow_sensitive_toggle', default=True)
+    # 未开启显示的访客无需读取开关（省去一次查询）
+    if request.cookies.get('pm_show_sensitive') != '1': return False
 
-    if not allow_toggle: return False
-    return request.cookies.get('pm_show_sensitive') == '1'
+    # 修改点：从数据库读取开关 (持久化)
+    return SystemSetting.get_bool('allow_sensitive_toggle', default=True)
 
 
 def _get_common_data(category_filter=None):
@@ -27,76 +62,85 @@ def _get_common_data(category_filter=None):
     提取画廊和模板页通用的查询逻辑
     :param category_filter: None(所有) 或 'template'(仅模板)
     """
+    data = _get_listing(category_filter)
+    data.pop('cache_key')
+
+    # 标签筛选列表：读取物化计数表（带短时缓存），不再每次 GROUP BY 全表
+    data['all_tags'] = TagCountService.facet_list(category=category_filter, show_sensitive=can_see_sensitive())
+    return data
+
+
+def _get_listing(category_filter=None):
+    """
+    画廊卡片列表（整页与无限滚动片段共用）
+
+    传入 cursor 参数时使用游标分页（不做 COUNT），否则保持页码分页。
+    卡片只加载 Image.GRID_FIELDS 对应的列（prompt 只取前缀），完整详情在弹窗打开时通过 /api/images/<id> 获取。
+    查询结果（序列化后的作品 + 分页快照）经 ResponseCache 跨 worker 共享；
+    返回的 cache_key 为 None 表示结果不可复用（未指定 seed 的随机排序）
+    """
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '').strip()
     tag_filter = request.args.get('tag', '').strip()
     search_query = request.args.get('q', '').strip()
     sort_by = request.args.get('sort', 'date')
-    type_filter = request.args.get('type', '').strip()  # 图片类型过滤: text2img, img2img
+    type_filter = ListingService.normalize_type(request.args.get('type', '').strip())  # 图片类型过滤: text2img, img2img
+    seed = ListingService.resolve_seed(sort_by, request.args.get('seed'))  # random 排序的翻页种子
     show_sensitive = can_see_sensitive()
-
-    # 构建图片查询
-    query = Image.query.filter_by(status='approved')
-
-    if category_filter:
-        query = query.filter_by(category=category_filter)
-
-    if not show_sensitive:
-        query = query.filter(~Image.tags.any(Tag.is_sensitive == True))
-
-    if tag_filter:
-        query = query.filter(Image.tags.any(name=tag_filter))
-
-    # 支持两种写法: txt2img 和 text2img（规范化为 txt2img）
-    if type_filter:
-        # 规范化type_filter
-        if type_filter == 'text2img':
-            type_filter = 'txt2img'
-
-        if type_filter in ['txt2img', 'img2img']:
-            query = query.filter_by(type=type_filter)
-
-    if search_query:
-        query = query.filter(
-            Image.title.contains(search_query) |
-            Image.prompt.contains(search_query) |
-            Image.author.contains(search_query)
-        )
-
-    # 排序
-    if sort_by == 'hot':
-        query = query.order_by(Image.heat_score.desc(), Image.created_at.desc())
-    elif sort_by == 'random':
-        query = query.order_by(func.random())
+    per_page = current_app.config['ITEMS_PER_PAGE']
+
+    def compute():
+        # 构建图片查询
+        query = ListingService.build_query(
+            category=category_filter,
+            tag=tag_filter,
+            q=search_query,
+            type_filter=type_filter,
+            show_sensitive=show_sensitive
+        ).options(*Image.grid_options())
+
+        pagination = None
+        if cursor and ListingService.supports_cursor(sort_by):
+            try:
+                pagination = ListingService.paginate_cursor(query, sort_by, cursor, per_page, seed=seed)
+            except CursorError:
+                # 游标失效时回到第一页
+                pagination = None
+
+        if pagination is None:
+            counter = ListingService.counter(category_filter, tag_filter, search_query, type_filter,
+                                             show_sensitive, sort_by)
+            pagination = ListingService.paginate(query, sort_by, page, per_page, q=search_query, seed=seed,
+                                                 counter=counter)
+
+        # 整页批量序列化（标签 / 参考图各一次查询）
+        return {
+            'images': Image.bulk_to_dict(pagination.items, fields=Image.GRID_FIELDS),
+            'pagination': PageSnapshot.from_pagination(pagination).to_dict()
+        }
+
+    # 未显式传 seed 的 random 请求每次种子都不同，缓存不会被复用，直接计算
+    cache_key = None
+    if sort_by == 'random' and not request.args.get('seed'):
+        result = compute()
     else:
-        query = query.order_by(Image.created_at.desc())
-
-    pagination = query.paginate(page=page, per_page=current_app.config['ITEMS_PER_PAGE'])
-
-    # 构建标签筛选列表，并统计每个标签的图片数量
-    tags_query = db.session.query(
-        Tag,
-        func.count(Image.id).label('image_count')
-    ).join(Tag.images).filter(Image.status == 'approved')
-
-    if category_filter:
-        tags_query = tags_query.filter(Image.category == category_filter)
-
-    if not show_sensitive:
-        tags_query = tags_query.filter(Tag.is_sensitive == False)
-
-    tags_with_counts = tags_query.group_by(Tag.id).order_by(Tag.name).all()
-
-    # 将结果转换为更易用的格式
-    all_tags = [{'tag': tag, 'count': count} for tag, count in tags_with_counts]
+        cache_key = 'page:{}:{}'.format(CatalogVersionService.scope(category_filter), CatalogVersionService.etag(
+            category_filter, {
+                'page': page, 'per_page': per_page, 'cursor': cursor, 'q': search_query, 'tag': tag_filter,
+                'sort': sort_by, 'type': type_filter, 'seed': seed, 'sensitive': show_sensitive,
+                'root': get_url_root(), 'fields': Image.GRID_FIELDS
+            }))
+        result = ResponseCache.get_or_fill_json(cache_key, compute)
 
     return {
-        'images': pagination.items,
-        'pagination': pagination,
+        'images': result['images'],
+        'pagination': PageSnapshot(**result['pagination']),
         'active_tag': tag_filter,
         'active_search': search_query,
         'active_type': type_filter,
-        'all_tags': all_tags,
-        'current_sort': sort_by
+        'current_sort': sort_by,
+        'current_seed': seed,
+        'cache_key': cache_key
     }
 
 
@@ -114,6 +158,58 @@ def templates_index():
     return render_template('index.html', **data)
 
 
+@bp.route('/fragments/gallery')
+def gallery_fragment():
+    """画廊无限滚动片段"""
+    return _cards_fragment(category_filter=None)
+
+
+@bp.route('/fragments/templates')
+def templates_fragment():
+    """模板库无限滚动片段"""
+    return _cards_fragment(category_filter='template')
+
+
+def _cards_fragment(category_filter):
+    """
+    无限滚动：只返回下一页的卡片 HTML 片段（参数与画廊页相同，page 或 cursor 翻页）
+    - 渲染结果按（查询参数, 页, 敏感可见性）缓存在 ResponseCache，作品变更时随分类作用域失效
+    - 下一页片段地址在 X-Next-URL 头中给出，没有下一页时不返回该头
+    """
+    data = _get_listing(category_filter)
+    cache_key = data.pop('cache_key')
+    pagination = data['pagination']
+
+    # 片段的缓存 key 已包含目录版本号，直接作为 ETag
+    fragment_key = f'frag:{cache_key}' if cache_key else None
+    etag_value = hashlib.md5(fragment_key.encode('utf-8')).hexdigest() if fragment_key else None
+    if etag_value and CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
+
+    def render():
+        return render_template('components/_gallery_cards.html', **data)
+
+    html = ResponseCache.get_or_fill(fragment_key, render) if fragment_key else render()
+
+    next_args = None
+    if pagination.has_next:
+        next_args = {'cursor': pagination.next_cursor} if pagination.cursor else {'page': pagination.next_num}
+
+    response = make_response(html)
+    if next_args:
+        response.headers['X-Next-URL'] = url_for(
+            request.endpoint, tag=data['active_tag'], q=data['active_search'], sort=data['current_sort'],
+            type=data['active_type'], seed=data['current_seed'], **next_args
+        )
+    if etag_value:
+        response.set_etag(etag_value)
+        response.headers['Cache-Control'] = 'no-cache'
+        CompressionService.set_cache_key(fragment_key)
+    else:
+        CompressionService.set_cache_key(None)
+    return response
+
+
 @bp.route('/upload', methods=['GET', 'POST'])
 @limiter.limit(lambda: current_app.config['UPLOAD_RATE_LIMIT'])
 def upload():
@@ -167,17 +263,41 @@ def _get_api_data(category_filter):
     1) 默认分页：未传 per_page 时默认 500 条
     2) per_page=-1: 放宽到硬上限 10000
     3) 返回 code/message/meta/data，并保留 legacy 字段兼容旧客户端
-    4) 支持 ETag + 304
+    4) ETag 由目录版本号 + 规范化参数生成，命中 If-None-Match 时不执行查询直接 304
+    5) 支持 cursor 游标分页（sort=date/hot/random/trending），meta.next_cursor 给出下一页游标
+    6) q 走全文索引，sort=relevance 按相关度排序；token= 按 Prompt 词元索引过滤（忽略权重 / 括号写法与大小写）
+    7) sort=random 按 seed 稳定随机，翻页与游标均不重复不遗漏
+    8) per_page 超过 API_STREAM_THRESHOLD 或 stream=1 时流式输出（data 在前，meta 在末尾）
+    9) 非流式响应体经 ResponseCache 跨 worker 缓存，写入后随目录版本号失效
+    10) 总数来自计数表 / 缓存 / 规划器估算（meta.total_exact 标明是否精确）；count=none 时不计算总数，只返回 has_next
+    11) fields=id,title,... 只输出指定字段，SQL 也只读取对应的列
+    12) format=ndjson 每行一条作品、最后一行为 meta（始终流式）；format=msgpack 为与 JSON 相同结构的 MessagePack
+    13) meta.server_timestamp 是响应体生成（写入缓存）的时间，命中缓存时可能早于请求时间，不能作为同步断点；
+        meta.change_seq 是读取列表之前的变更序号，客户端以它作为 /api/changes 的 since 即可补齐之后的变更
     """
     # 参数解析
     page = max(1, request.args.get('page', 1, type=int))
     raw_per_page = request.args.get('per_page', type=int)
+    cursor = request.args.get('cursor', '').strip()
     search_query = request.args.get('q', '').strip()
     tag_filter = request.args.get('tag', '').strip()
+    token_filter = PromptTokenService.lookup_names(request.args.get('token', ''))
     sort_by = request.args.get('sort', 'date')
-    type_filter = request.args.get('type', '').strip()
+    type_filter = ListingService.normalize_type(request.args.get('type', '').strip())
+    seed = ListingService.resolve_seed(sort_by, request.args.get('seed'))
+    count_mode = 'none' if request.args.get('count') == 'none' else 'auto'
+    output_format = request.args.get('format', '').strip().lower() or 'json'
     show_sensitive = can_see_sensitive()
 
+    try:
+        fields = Image.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+    if output_format not in API_FORMATS:
+        return jsonify({'code': 400, 'message': f'不支持的 format: {output_format}', 'data': None}), 400
+    if output_format == 'msgpack' and msgpack is None:
+        return jsonify({'code': 406, 'message': '服务器未安装 msgpack，无法输出该格式', 'data': None}), 406
+
     HARD_LIMIT = 10000
     DEFAULT_LIMIT = 500
 
@@ -188,87 +308,206 @@ def _get_api_data(category_filter):
     else:
         per_page = min(max(raw_per_page, 1), HARD_LIMIT)
 
-    # 基础查询
-    query = Image.query.filter_by(status='approved')
+    if cursor and not ListingService.supports_cursor(sort_by):
+        return jsonify({'code': 400, 'message': f'sort={sort_by} 不支持 cursor 分页', 'data': None}), 400
 
-    if category_filter:
-        query = query.filter_by(category=category_filter)
+    # NDJSON 始终流式；MessagePack 需整体编码，不走流式
+    if output_format == 'ndjson':
+        streaming = True
+    elif output_format == 'msgpack':
+        streaming = False
+    else:
+        streaming = request.args.get('stream') == '1' or per_page > current_app.config['API_STREAM_THRESHOLD']
 
-    if not show_sensitive:
-        query = query.filter(~Image.tags.any(Tag.is_sensitive == True))
+    params = {
+        'page': None if cursor else page, 'per_page': per_page, 'cursor': cursor, 'q': search_query,
+        'tag': tag_filter, 'token': token_filter, 'sort': sort_by, 'type': type_filter, 'seed': seed,
+        'sensitive': show_sensitive, 'stream': streaming, 'count': count_mode, 'fields': fields,
+        'format': output_format
+    }
 
-    if type_filter == 'text2img':
-        type_filter = 'txt2img'
+    # 条件请求：只查一次版本号，不跑列表查询 / COUNT / 序列化
+    etag_value = _api_etag(category_filter, params)
+    if CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
 
-    if type_filter in ['txt2img', 'img2img']:
-        query = query.filter_by(type=type_filter)
+    if streaming:
+        query, counter, link_args = _api_listing(category_filter, params)
+        try:
+            pagination = ListingService.stream(query, sort_by, per_page, page=page, cursor=cursor or None,
+                                               q=search_query, seed=seed, batch_size=STREAM_BATCH_SIZE,
+                                               counter=counter)
+        except CursorError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+        response = _stream_api_response(pagination, link_args, seed, fields, output_format)
+        response.set_etag(etag_value)
+        # after_request 中的 apply() 不处理流式响应，这里逐块压缩
+        return CompressionService.apply_stream(response)
+
+    # 未显式传 seed 的 random 请求每次结果都不同，不缓存
+    cacheable = not (sort_by == 'random' and not request.args.get('seed'))
+    try:
+        body = _api_page_body(category_filter, params, etag_value, cache=cacheable)
+    except CursorError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
 
-    if search_query:
-        query = query.filter(
-            Image.title.contains(search_query) |
-            Image.prompt.contains(search_query) |
-            Image.author.contains(search_query)
-        )
+    response = make_response(body)
+    response.headers['Content-Type'] = API_FORMATS[output_format]
+    response.set_etag(etag_value)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
 
-    if tag_filter:
-        query = query.filter(Image.tags.any(name=tag_filter))
 
-    if sort_by == 'hot':
-        query = query.order_by(Image.heat_score.desc(), Image.created_at.desc())
-    elif sort_by == 'random':
-        query = query.order_by(func.random())
+def _api_etag(category_filter, params):
+    """列表 API 的 ETag：目录版本号 + 规范化参数（含 URL 根），也是响应体缓存 key 的一部分"""
+    return CatalogVersionService.etag(category_filter, dict(params, root=get_url_root()))
+
+
+def _api_listing(category_filter, params):
+    """按规范化参数构建列表查询，返回 (query, counter, link_args)"""
+    fields = params['fields']
+    query = ListingService.build_query(
+        category=category_filter,
+        tag=params['tag'],
+        q=params['q'],
+        type_filter=params['type'],
+        show_sensitive=params['sensitive'],
+        token=params['token']
+    )
+    if fields:
+        query = query.options(Image.load_only_fields(fields))
+
+    counter = ListingService.counter(category_filter, params['tag'], params['q'], params['type'],
+                                     params['sensitive'], params['sort'], mode=params['count'], token=params['token'])
+    link_args = dict(per_page=params['per_page'], q=params['q'], tag=params['tag'],
+                     token=params['token'][0] if params['token'] else None, sort=params['sort'],
+                     type=params['type'], seed=params['seed'],
+                     count='none' if params['count'] == 'none' else None,
+                     fields=','.join(fields) if fields else None,
+                     format=params['format'] if params['format'] != 'json' else None)
+    return query, counter, link_args
+
+
+def _api_page_body(category_filter, params, etag_value, cache=True, endpoint=None):
+    """
+    非流式列表响应体（JSON 字符串，format=msgpack 时为字节），cursor 无效时抛出 CursorError。
+    响应体跨 worker 缓存，key 与 ETag 同源（含目录版本号），/api/bootstrap 与同参数的列表请求共用条目；
+    压缩后的响应体存放在同一 key 旁边（见 CompressionService）
+    """
+    query, counter, link_args = _api_listing(category_filter, params)
+    sort_by, seed, fields = params['sort'], params['seed'], params['fields']
+
+    def compute_body():
+        # 先取序号再读列表：期间的变更序号都大于它，客户端从该序号同步不会遗漏
+        change_seq = ChangeService.latest_seq()
+        if params['cursor']:
+            # 游标模式：WHERE 排序键 < 游标，不做 COUNT
+            pagination = ListingService.paginate_cursor(query, sort_by, params['cursor'], params['per_page'],
+                                                        seed=seed)
+        else:
+            pagination = ListingService.paginate(query, sort_by, params['page'], params['per_page'],
+                                                 q=params['q'], seed=seed, error_out=False, counter=counter)
+
+        data = Image.bulk_to_dict(pagination.items, fields=fields)
+        if params['format'] == 'msgpack':
+            body = _api_envelope(pagination, link_args, seed, endpoint, change_seq)
+            body['data'] = data
+            return msgpack.packb(body, use_bin_type=True)
+
+        # data 只序列化一次，直接拼接进响应体
+        data_json = json.dumps(data, ensure_ascii=False)
+        envelope_json = json.dumps(_api_envelope(pagination, link_args, seed, endpoint, change_seq), sort_keys=True,
+                                   ensure_ascii=False)
+        return f'{envelope_json[:-1]}, "data": {data_json}}}'
+
+    if not cache:
+        CompressionService.set_cache_key(None)
+        return compute_body()
+    cache_key = f'api:{CatalogVersionService.scope(category_filter)}:{etag_value}'
+    CompressionService.set_cache_key(cache_key)
+    return ResponseCache.get_or_fill(cache_key, compute_body)
+
+
+def _api_envelope(pagination, link_args, seed, endpoint=None, change_seq=None):
+    """
+    列表 API 的外层结构（不含 data）；endpoint 为翻页链接指向的视图，默认当前请求。
+    整体随响应体缓存：server_timestamp 为生成时间（不是响应时间），同步断点请用读取列表前取得的 change_seq
+    """
+    endpoint = endpoint or request.endpoint
+    if pagination.has_next and pagination.page is None:
+        next_url = url_for(endpoint, cursor=pagination.next_cursor, _external=True, **link_args)
+    elif pagination.has_next:
+        next_url = url_for(endpoint, page=pagination.next_num, _external=True, **link_args)
     else:
-        query = query.order_by(Image.created_at.desc())
+        next_url = None
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    items_data = [img.to_dict() for img in pagination.items]
-
-    response_payload = {
+    return {
         'code': 200,
         'message': 'success',
         'meta': {
-            'page': page,
-            'per_page': per_page,
+            'page': pagination.page,
+            'per_page': pagination.per_page,
             'total_items': pagination.total,
-            'total_pages': pagination.pages,
+            'total_pages': pagination.pages if pagination.total is not None else None,
+            'total_exact': pagination.total_exact if pagination.total is not None else None,
             'has_next': pagination.has_next,
-            'next_url': url_for(
-                request.endpoint,
-                page=pagination.next_num,
-                per_page=per_page,
-                q=search_query,
-                tag=tag_filter,
-                sort=sort_by,
-                type=type_filter,
-                _external=True
-            ) if pagination.has_next else None,
+            'next_url': next_url,
+            'next_cursor': pagination.next_cursor,
+            'seed': seed,
+            'change_seq': change_seq,
             'server_timestamp': int(time.time())
         },
         # legacy 兼容字段
-        'current_page': page,
+        'current_page': pagination.page,
         'pages': pagination.pages,
-        'total': pagination.total,
-        'data': items_data
+        'total': pagination.total
     }
 
-    json_str = json.dumps(response_payload, sort_keys=True, ensure_ascii=False)
-    etag_payload = dict(response_payload)
-    etag_meta = dict(response_payload.get('meta', {}))
-    etag_meta.pop('server_timestamp', None)
-    etag_payload['meta'] = etag_meta
-    etag_source = json.dumps(etag_payload, sort_keys=True, ensure_ascii=False)
-    etag_value = hashlib.md5(etag_source.encode('utf-8')).hexdigest()
 
-    if request.if_none_match and request.if_none_match.contains(etag_value):
-        return make_response('', 304)
-
-    response = make_response(json_str)
-    response.headers['Content-Type'] = 'application/json'
-    response.set_etag(etag_value)
+def _stream_api_response(pagination, link_args, seed, fields=None, output_format='json'):
+    """
+    流式响应：先输出 data 数组（按批序列化），分页信息在读完后追加到末尾。
+    整页不再驻留内存，首字节在第一批查询完成后即可发出。
+    NDJSON 格式每行一条作品，最后一行为 {"code", "message", "meta"}。
+    """
+    ndjson = output_format == 'ndjson'
+
+    def generate():
+        change_seq = ChangeService.latest_seq()
+        if not ndjson:
+            yield '{"data": ['
+        batch = []
+        first = True
+        for img in pagination.iter_items():
+            batch.append(img)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield _stream_chunk(batch, first, fields, ndjson)
+                batch, first = [], False
+        if batch:
+            yield _stream_chunk(batch, first, fields, ndjson)
+
+        envelope = _api_envelope(pagination, link_args, seed, change_seq=change_seq)
+        if ndjson:
+            meta = {k: envelope[k] for k in ('code', 'message', 'meta')}
+            yield json.dumps(meta, sort_keys=True, ensure_ascii=False) + '\n'
+            return
+        envelope_json = json.dumps(envelope, sort_keys=True, ensure_ascii=False)
+        yield '], ' + envelope_json[1:]
+
+    response = Response(stream_with_context(generate()), mimetype=API_FORMATS[output_format])
     response.headers['Cache-Control'] = 'public, max-age=60'
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
 
+def _stream_chunk(images, first, fields=None, ndjson=False):
+    items = [json.dumps(d, ensure_ascii=False) for d in Image.bulk_to_dict(images, fields=fields)]
+    if ndjson:
+        return ''.join(item + '\n' for item in items)
+    chunk = ', '.join(items)
+    return chunk if first else ', ' + chunk
+
+
 @bp.route('/api/gallery')
 def api_gallery_list():
     """获取画廊数据 (JSON)"""
@@ -281,25 +520,286 @@ def api_templates_list():
     return _get_api_data('template')
 
 
+@bp.route('/api/bootstrap')
+def api_bootstrap():
+    """
+    首屏数据一次返回：画廊第一页、模板第一页、标签筛选列表与展示设置。
+    - per_page 默认为后台设置的每页条数（上限 100），支持 fields= 投影
+    - 两个列表与同参数的 /api/gallery、/api/templates 请求共用缓存条目，结构也与其响应相同
+    - 整体 ETag 由全部分类的目录版本号 + 参数 + 展示设置生成，命中时直接 304
+    """
+    try:
+        fields = Image.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+
+    show_sensitive = can_see_sensitive()
+    settings = {
+        'items_per_page': ConfigService.get_items_per_page(),
+        'use_thumbnail_in_preview': ConfigService.get_use_thumbnail_in_preview(),
+        'allow_sensitive_toggle': SystemSetting.get_bool('allow_sensitive_toggle', default=True),
+        'show_sensitive': show_sensitive,
+    }
+    per_page = min(max(request.args.get('per_page', settings['items_per_page'], type=int), 1), 100)
+    params = {
+        'page': 1, 'per_page': per_page, 'cursor': '', 'q': '', 'tag': '', 'token': [], 'sort': 'date', 'type': '',
+        'seed': None, 'sensitive': show_sensitive, 'stream': False, 'count': 'auto', 'fields': fields,
+        'format': 'json'
+    }
+
+    etag_value = CatalogVersionService.etag(None, {'bootstrap': params, 'settings': settings,
+                                                   'root': get_url_root()})
+    if CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
+
+    pieces = {}
+    for key, category, endpoint in (('gallery', 'gallery', 'public.api_gallery_list'),
+                                    ('templates', 'template', 'public.api_templates_list')):
+        pieces[key] = _api_page_body(category, params, _api_etag(category, params), endpoint=endpoint)
+    tags = TagCountService.facet_list(category=None, show_sensitive=show_sensitive)
+
+    # 各部分已是序列化好的 JSON，直接拼接
+    body = '{{"code": 200, "message": "success", "data": {{"gallery": {}, "templates": {}, "tags": {}, ' \
+           '"settings": {}}}}}'.format(pieces['gallery'], pieces['templates'],
+                                     json.dumps(tags, ensure_ascii=False), json.dumps(settings, sort_keys=True))
+
+    CompressionService.set_cache_key(f'boot:all:{etag_value}')
+    response = make_response(body)
+    response.headers['Content-Type'] = 'application/json'
+    response.set_etag(etag_value)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@bp.route('/api/images/<int:img_id>')
+def api_image_detail(img_id):
+    """
+    按 id 获取单个作品（已发布且当前用户可见），支持 fields= 投影。
+    ETag 只依赖作品版本，条件请求只需一次版本查询即可返回 304
+    """
+    try:
+        fields = Image.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+
+    result = ImageLookupService.lookup([img_id], show_sensitive=can_see_sensitive(), fields=fields,
+                                       is_known=lambda i, etag: CompressionService.etag_matches(etag))
+    if img_id in result['not_modified']:
+        return make_response('', 304)
+    if img_id not in result['items']:
+        return jsonify({'code': 404, 'message': '作品不存在', 'data': None}), 404
+
+    response = jsonify({'code': 200, 'message': 'success', 'data': result['items'][img_id]})
+    response.set_etag(result['etags'][img_id])
+    # 响应体只取决于作品 ETag，压缩结果与缓存的作品数据放在一起
+    CompressionService.set_cache_key(f"item:{result['etags'][img_id]}:body")
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@bp.route('/api/images/<int:img_id>/related')
+def api_image_related(img_id):
+    """
+    相关作品：/api/images/<id>/related?limit=8，读取预先计算的 image_neighbor（按主键一次查询），
+    返回卡片字段与相似度 score，不可见的作品被过滤
+    """
+    top_k = current_app.config.get('RELATED_TOP_K', 12)
+    limit = min(max(request.args.get('limit', top_k, type=int), 1), top_k)
+    items = RelatedService.related(img_id, limit, show_sensitive=can_see_sensitive())
+
+    json_str = json.dumps({'code': 200, 'message': 'success', 'data': items}, ensure_ascii=False)
+    etag_value = hashlib.md5(json_str.encode('utf-8')).hexdigest()
+    if CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
+
+    response = make_response(json_str)
+    response.headers['Content-Type'] = 'application/json'
+    response.set_etag(etag_value)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
+@bp.route('/api/images')
+def api_image_batch():
+    """
+    按 id 批量获取作品：/api/images?ids=1,2,3（上限 IMAGE_LOOKUP_MAX_IDS），支持 fields= 投影
+    - data 按请求顺序返回可见作品，meta.etags 给出每个作品的 ETag，不可见 / 不存在的 id 在 meta.missing 中
+    - 刷新已知集合时传 etags=e1,e2,e3（与 ids 一一对应），未变化的作品只在 meta.not_modified 中列出 id
+    """
+    try:
+        ids = ImageLookupService.parse_ids(request.args.get('ids'), current_app.config['IMAGE_LOOKUP_MAX_IDS'])
+        fields = Image.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+
+    raw_etags = [e.strip() for e in request.args.get('etags', '').split(',')]
+    known = {i: e for i, e in zip(ids, raw_etags) if e}
+
+    result = ImageLookupService.lookup(ids, show_sensitive=can_see_sensitive(), fields=fields,
+                                       is_known=lambda i, etag: known.get(i) == etag)
+    etags = {str(i): e for i, e in result['etags'].items()}
+    # 整体 ETag：集合内任一作品变化或可见性变化都会改变
+    etag_value = hashlib.md5(json.dumps([etags, result['missing'], fields, known], sort_keys=True)
+                             .encode('utf-8')).hexdigest()
+    if CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
+
+    response = jsonify({
+        'code': 200,
+        'message': 'success',
+        'meta': {
+            'etags': etags,
+            'missing': result['missing'],
+            'not_modified': result['not_modified'],
+        },
+        'data': list(result['items'].values())
+    })
+    response.set_etag(etag_value)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@bp.route('/api/changes')
+def api_changes():
+    """
+    增量同步：返回 since 之后新增 / 修改 / 移除的作品，按单调递增的变更序号分页
+    - since: 上次响应的 meta.next_since，首次传 0 获取全部
+    - category: gallery / template，不传为全部分类
+    - limit: 每页变更条数，默认 500，上限 5000；meta.has_more 为 true 时继续用 next_since 拉取
+    不再可见的作品（删除、撤回审核、变为敏感、移出该分类）在 data.deleted 中给出 id；
+    从未公开过的作品（待审核上传等）不会出现，since=0 时 deleted 为空
+    """
+    raw_since = request.args.get('since', '0').strip() or '0'
+    try:
+        since = int(raw_since)
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'code': 400, 'message': 'since 参数无效', 'data': None}), 400
+
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    category = request.args.get('category', '').strip()
+    if category not in ('gallery', 'template'):
+        category = None
+
+    result = ChangeService.changes(since, limit, category=category, show_sensitive=can_see_sensitive())
+    next_url = None
+    if result['has_more']:
+        next_url = url_for('public.api_changes', since=result['next_since'], limit=limit, category=category,
+                           _external=True)
+
+    response = jsonify({
+        'code': 200,
+        'message': 'success',
+        'meta': {
+            'since': since,
+            'next_since': result['next_since'],
+            'has_more': result['has_more'],
+            'next_url': next_url,
+            'limit': limit,
+            'server_timestamp': int(time.time())
+        },
+        'data': {
+            'upserted': Image.bulk_to_dict(result['upserted']),
+            'deleted': result['deleted']
+        }
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/api/stream')
+def api_stream():
+    """
+    Server-Sent Events：推送作品变更（审核通过、免审上传、编辑、删除）
+    - event: upsert，data 为 {id, category, title, thumbnail_path, updated_at}；event: delete，data 为 {id}
+    - 事件 id 为变更序号，断线重连时浏览器自动带 Last-Event-ID 补发其后的事件（也可用 ?last_event_id= 指定）；
+      不带断点时只推送连接之后的新变更
+    - category: gallery / template，不传为全部分类
+    单个连接最长保持 SSE_MAX_DURATION 秒，之后由 EventSource 按 retry 间隔自动重连续传
+    """
+    raw_last_id = (request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')).strip()
+    since = None
+    if raw_last_id:
+        try:
+            since = int(raw_last_id)
+            if since < 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({'code': 400, 'message': 'Last-Event-ID 无效', 'data': None}), 400
+
+    category = request.args.get('category', '').strip()
+    if category not in ('gallery', 'template'):
+        category = None
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    release = EventStreamService.acquire()
+    if release is None:
+        # 订阅数已满：不返回错误码（EventSource 收到非 200 会停止重连），只让客户端稍后重试
+        return Response(EventStreamService.format_event(retry=EventStreamService.BUSY_RETRY_MS, comment='busy'),
+                        mimetype='text/event-stream', headers=headers)
+
+    try:
+        show_sensitive = can_see_sensitive()
+        response = Response(stream_with_context(EventStreamService.stream(since, category, show_sensitive)),
+                            mimetype='text/event-stream', headers=headers)
+    except Exception:
+        release()
+        raise
+    # WSGI 服务器在响应结束、客户端断开或 HEAD 请求时都会关闭响应，名额在此归还
+    response.call_on_close(release)
+    return response
+
+
+@bp.route('/api/tags')
+def api_tags_list():
+    """获取标签及作品数量 (JSON)，读取物化计数表"""
+    category = request.args.get('category', '').strip()
+    if category not in ('gallery', 'template'):
+        category = None
+
+    tags = TagCountService.facet_list(category=category, show_sensitive=can_see_sensitive())
+    json_str = json.dumps({'code': 200, 'message': 'success', 'data': tags}, sort_keys=True, ensure_ascii=False)
+    etag_value = hashlib.md5(json_str.encode('utf-8')).hexdigest()
+
+    if CompressionService.etag_matches(etag_value):
+        return make_response('', 304)
+
+    response = make_response(json_str)
+    response.headers['Content-Type'] = 'application/json'
+    response.set_etag(etag_value)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@bp.route('/api/tags/suggest')
+def api_tags_suggest():
+    """
+    标签自动补全：/api/tags/suggest?prefix=fen&limit=10
+    前缀匹配标签名（或其中任一词、拼音全拼 / 首字母），按作品数降序；prefix 为空时返回最常用的标签。
+    由进程内前缀索引应答，不查询数据库
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    data = TagSuggestService.suggest(request.args.get('prefix', ''), limit=limit,
+                                     show_sensitive=can_see_sensitive())
+    response = jsonify({'code': 200, 'message': 'success', 'data': data})
+    response.headers['Cache-Control'] = 'public, max-age=30'
+    return response
+
+
 @bp.route('/api/stats/view/<int:img_id>', methods=['POST'])
 def stat_view(img_id):
-    """增加浏览计数"""
-    img = db.session.get(Image, img_id)
-    if img:
-        img.views_count += 1
-        img.heat_score = img.views_count * 1 + img.copies_count * 10
-        db.session.commit()
+    """增加浏览计数（内存聚合，定时批量写入）；同一客户端在去重窗口内重复浏览同一作品不计数"""
+    if ViewDedupeService.seen(img_id):
+        return {'status': 'duplicate'}
+    StatsService.record_view(img_id)
     return {'status': 'ok'}
 
 
 @bp.route('/api/stats/copy/<int:img_id>', methods=['POST'])
 def stat_copy(img_id):
-    """增加复制计数"""
-    img = db.session.get(Image, img_id)
-    if img:
-        img.copies_count += 1
-        img.heat_score = img.views_count * 1 + img.copies_count * 10
-        db.session.commit()
+    """增加复制计数（内存聚合，定时批量写入）"""
+    StatsService.record_copy(img_id)
     return {'status': 'ok'}
 
 
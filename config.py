@@ -32,6 +32,47 @@ class Config:
     # Pagination
     ITEMS_PER_PAGE = int(os.environ.get('ITEMS_PER_PAGE') or 24)
     ADMIN_PER_PAGE = int(os.environ.get('ADMIN_PER_PAGE') or 12)
+    # API pages larger than this are streamed
+    API_STREAM_THRESHOLD = int(os.environ.get('API_STREAM_THRESHOLD') or 1000)
+    # Totals for tag / search filtered listings: cache TTL (seconds), and on PostgreSQL
+    # the planner estimate is used instead of COUNT(*) once it reaches this many rows
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL') or 60)
+    COUNT_ESTIMATE_THRESHOLD = int(os.environ.get('COUNT_ESTIMATE_THRESHOLD') or 10000)
+    # Maximum number of ids per /api/images?ids= request
+    IMAGE_LOOKUP_MAX_IDS = int(os.environ.get('IMAGE_LOOKUP_MAX_IDS') or 300)
+
+    # /api/stream (SSE): change-log poll interval, max connection lifetime and heartbeat in seconds,
+    # concurrent subscribers per worker process (each holds one gthread thread; defaults to the thread
+    # pool size minus SSE_RESERVED_THREADS kept free for ordinary requests), client reconnect delay
+    SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL') or 1)
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION') or 55)
+    SSE_HEARTBEAT_INTERVAL = int(os.environ.get('SSE_HEARTBEAT_INTERVAL') or 15)
+    SSE_RESERVED_THREADS = int(os.environ.get('SSE_RESERVED_THREADS') or 8)
+    SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS') or
+                          max(int(os.environ.get('GUNICORN_THREADS') or 32) - SSE_RESERVED_THREADS, 1))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS') or 3000)
+
+    # Static JSON snapshot of the public catalogue (flask build-snapshot): output directory
+    # (relative to the app root), ids per shard, optional absolute URL root for image paths,
+    # and the change check interval of --watch mode in seconds
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or 'static/snapshot'
+    SNAPSHOT_SHARD_SIZE = int(os.environ.get('SNAPSHOT_SHARD_SIZE') or 1000)
+    SNAPSHOT_URL_ROOT = os.environ.get('SNAPSHOT_URL_ROOT') or ''
+    SNAPSHOT_WATCH_INTERVAL = int(os.environ.get('SNAPSHOT_WATCH_INTERVAL') or 30)
+
+    # View / copy counters are buffered in memory and flushed every N seconds
+    STATS_FLUSH_INTERVAL = int(os.environ.get('STATS_FLUSH_INTERVAL') or 5)
+
+    # Trending ranking (sort=trending): decayed score over hourly view/copy buckets
+    TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS') or 72)
+    TRENDING_WINDOW_DAYS = int(os.environ.get('TRENDING_WINDOW_DAYS') or 14)
+    TRENDING_REBUILD_INTERVAL = int(os.environ.get('TRENDING_REBUILD_INTERVAL') or 600)
+
+    # Related images: top-K neighbours by tag Jaccard + prompt-token TF-IDF cosine, refreshed incrementally
+    RELATED_TOP_K = int(os.environ.get('RELATED_TOP_K') or 12)
+    RELATED_TAG_WEIGHT = float(os.environ.get('RELATED_TAG_WEIGHT') or 0.5)
+    RELATED_MAX_DF = float(os.environ.get('RELATED_MAX_DF') or 0.3)
+    RELATED_REFRESH_INTERVAL = int(os.environ.get('RELATED_REFRESH_INTERVAL') or 300)
 
     # Image processing
     IMG_MAX_DIMENSION = int(os.environ.get('IMG_MAX_DIMENSION') or 1600)
@@ -47,6 +88,27 @@ class Config:
     # Static resources mode
     USE_LOCAL_RESOURCES = _str_to_bool(os.environ.get('USE_LOCAL_RESOURCES', 'True'))
 
+    # Cross-worker response cache (local SQLite file, defaults to instance/response_cache.sqlite)
+    RESPONSE_CACHE_ENABLED = _str_to_bool(os.environ.get('RESPONSE_CACHE_ENABLED', 'True'))
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL') or 60)
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES') or 2000)
+
+    # View dedupe: repeated views of an image by the same client (IP + User-Agent) within the
+    # window (seconds) are not counted. Shared across workers through a memory-mapped rotating
+    # Bloom filter file (defaults to instance/view_dedupe.bin) of SLICES x SLICE_KB bytes
+    VIEW_DEDUPE_ENABLED = _str_to_bool(os.environ.get('VIEW_DEDUPE_ENABLED', 'True'))
+    VIEW_DEDUPE_WINDOW = int(os.environ.get('VIEW_DEDUPE_WINDOW') or 1800)
+    VIEW_DEDUPE_SLICES = int(os.environ.get('VIEW_DEDUPE_SLICES') or 4)
+    VIEW_DEDUPE_SLICE_KB = int(os.environ.get('VIEW_DEDUPE_SLICE_KB') or 1024)
+    VIEW_DEDUPE_PATH = os.environ.get('VIEW_DEDUPE_PATH')
+
+    # Content-Encoding negotiation for pages and API responses (br requires the brotli package)
+    COMPRESS_ENABLED = _str_to_bool(os.environ.get('COMPRESS_ENABLED', 'True'))
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 1024)
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL') or 6)
+    COMPRESS_BR_QUALITY = int(os.environ.get('COMPRESS_BR_QUALITY') or 5)
+
     # Visitor toggle control
     ALLOW_PUBLIC_SENSITIVE_TOGGLE = True
 
@@ -1,7 +1,12 @@
+import random
+import time
 from flask_login import UserMixin
 from datetime import datetime
 from extensions import db
-from flask import request
+from sqlalchemy import func, cast, Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, query_expression, with_expression
+from flask import request, g, has_request_context
 
 image_tags = db.Table(
     'image_tags',
@@ -12,6 +17,14 @@ image_tags = db.Table(
     db.Index('ix_image_tags_tag_image', 'tag_id', 'image_id'),
 )
 
+# 作品 Prompt 中出现的词元（去掉权重 / 括号后的规范化形式），由 PromptTokenService 在写入时维护
+image_prompt_tokens = db.Table(
+    'image_prompt_tokens',
+    db.Column('image_id', db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('token_id', db.Integer, db.ForeignKey('prompt_token.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_image_prompt_tokens_token_image', 'token_id', 'image_id'),
+)
+
 
 class User(UserMixin, db.Model):
     """用户模型"""
@@ -83,6 +96,30 @@ class SystemSetting(db.Model):
         setting.value = str(value)
         db.session.commit()
 
+    @staticmethod
+    def claim(key, interval, now=None):
+        """
+        定时任务抢占：key 中记录的时间戳距今超过 interval 秒时更新为当前时间并返回 True。
+        通过条件 UPDATE 实现，多个 worker 同一时间只有一个抢占成功（成功时已提交）
+        """
+        now = int(now or time.time())
+        claimed = SystemSetting.query.filter(
+            SystemSetting.key == key,
+            cast(SystemSetting.value, Integer) <= now - interval
+        ).update({SystemSetting.value: str(now)}, synchronize_session=False)
+        if not claimed:
+            if db.session.get(SystemSetting, key) is not None:
+                db.session.rollback()
+                return False
+            try:
+                with db.session.begin_nested():
+                    db.session.add(SystemSetting(key=key, value=str(now)))
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        db.session.commit()
+        return True
+
 
 class Image(db.Model):
     """核心作品模型"""
@@ -90,6 +127,12 @@ class Image(db.Model):
         db.Index('ix_image_status_category_created_at', 'status', 'category', 'created_at'),
         db.Index('ix_image_status_category_heat_created_at', 'status', 'category', 'heat_score', 'created_at'),
         db.Index('ix_image_status_category_type_created_at', 'status', 'category', 'type', 'created_at'),
+        db.Index('ix_image_status_category_random_key', 'status', 'category', 'random_key'),
+        # 访客列表（过滤敏感作品）使用的索引
+        db.Index('ix_image_status_category_sensitive_created_at', 'status', 'category', 'is_sensitive', 'created_at'),
+        db.Index('ix_image_status_category_sensitive_heat_created_at',
+                 'status', 'category', 'is_sensitive', 'heat_score', 'created_at'),
+        db.Index('ix_image_status_category_sensitive_random_key', 'status', 'category', 'is_sensitive', 'random_key'),
     )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -103,6 +146,8 @@ class Image(db.Model):
     type = db.Column(db.String(50))  # txt2img / img2img
     status = db.Column(db.String(20), default='pending', index=True)
     created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+    # 最近一次内容变更时间（由 ChangeService.record 维护；浏览 / 复制计数不算变更）
+    updated_at = db.Column(db.DateTime, default=datetime.now)
 
     # 作品分类: gallery / template
     category = db.Column(db.String(20), default='gallery', index=True)
@@ -110,49 +155,120 @@ class Image(db.Model):
     # 统计数据
     views_count = db.Column(db.Integer, default=0)
     copies_count = db.Column(db.Integer, default=0)
-    heat_score = db.Column(db.Integer, default=0, index=True)
+    heat_score = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    # 随机排序键：写入时生成，seed 随机排序在其索引上做环形范围扫描
+    random_key = db.Column(db.Float, default=random.random, index=True)
+
+    # 是否带有敏感标签（冗余字段，由 ImageService.sync_sensitive / refresh_sensitive 维护）
+    is_sensitive = db.Column(db.Boolean, default=False)
+
+    # 全文检索文档（分词后的标题 | 作者+Prompt），由 SearchService 维护
+    search_text = db.Column(db.Text)
+
+    # Prompt 前缀（仅在 grid_options() 查询中由 SQL 截取，其余查询为 None）
+    prompt_preview = query_expression()
 
     # 关联
     tags = db.relationship('Tag', secondary=image_tags, backref='images')
+    prompt_tokens = db.relationship('PromptToken', secondary=image_prompt_tokens)
     refs = db.relationship('ReferenceImage', backref='image', cascade="all, delete-orphan",
                            order_by="ReferenceImage.position")
 
-    def to_dict(self):
-        """序列化为字典，用于 API 或导出"""
-
-        def _get_full_url(path):
-            """辅助函数：确保返回的是带域名的完整 URL"""
-            if not path:
-                return None
-            if path.startswith(('http://', 'https://')):
-                return path
-            # 本地路径，拼接当前请求的域名
-            # 确保路径以 / 开头
-            if not path.startswith('/'):
-                path = '/' + path
-
-            # 从请求中获取正确的URL根
-            # 处理反向代理场景：优先使用 X-Forwarded-Proto 和 Host 头
-            if request.headers.get('X-Forwarded-Proto'):
-                # 反向代理场景（Nginx、Cloudflare等）
-                scheme = request.headers.get('X-Forwarded-Proto', 'https')
-                host = request.headers.get('X-Forwarded-Host') or request.host
-            else:
-                # 直接连接
-                scheme = request.scheme
-                host = request.host
+    # API 输出字段（顺序即 JSON 字段顺序）及其依赖的列；tags / refs 来自关联表
+    API_FIELDS = ('id', 'title', 'author', 'prompt', 'description', 'type', 'category',
+                  'file_path', 'thumbnail_path', 'lqip_data', 'tags', 'refs',
+                  'heat_score', 'created_at', 'updated_at')
+    FIELD_COLUMNS = {
+        'updated_at': ('updated_at', 'created_at'),
+        'tags': (),
+        'refs': (),
+    }
+    # 排序 / 游标 / 过滤需要的列，投影时始终加载
+    KEY_COLUMNS = ('id', 'status', 'category', 'created_at', 'heat_score', 'random_key')
+    # HTML 画廊卡片使用的字段：不含完整 prompt / description / refs（弹窗打开时再从 /api/images/<id> 获取）
+    GRID_FIELDS = ('id', 'title', 'author', 'type', 'category', 'file_path', 'thumbnail_path', 'lqip_data',
+                   'tags', 'heat_score', 'prompt_preview')
+    PROMPT_PREVIEW_LENGTH = 120
 
-            url_root = f"{scheme}://{host}/"
-            return url_root.rstrip('/') + path
+    @staticmethod
+    def parse_fields(raw):
+        """
+        解析 fields=a,b,c 投影参数，按 API_FIELDS 顺序返回元组；为空返回 None（全部字段）
+        含未知字段时抛出 ValueError
+        """
+        names = {f.strip() for f in (raw or '').split(',') if f.strip()}
+        if not names:
+            return None
+        unknown = names - set(Image.API_FIELDS)
+        if unknown:
+            raise ValueError('未知字段: ' + ', '.join(sorted(unknown)))
+        return tuple(f for f in Image.API_FIELDS if f in names)
+
+    @staticmethod
+    def load_only_fields(fields):
+        """投影字段对应的 load_only 选项，SQL 只读取需要的列（未投影时返回 None）"""
+        if not fields:
+            return None
+        columns = set(Image.KEY_COLUMNS)
+        for name in fields:
+            columns.update(Image.FIELD_COLUMNS.get(name, (name,)))
+        return load_only(*[getattr(Image, c) for c in sorted(columns)])
+
+    @staticmethod
+    def grid_options():
+        """画廊卡片的加载选项：只读取 GRID_FIELDS 对应的列，prompt 只取前缀（多取一个字符用于判断是否截断）"""
+        columns = [f for f in Image.GRID_FIELDS if f not in ('tags', 'prompt_preview')]
+        return (
+            Image.load_only_fields(columns),
+            with_expression(Image.prompt_preview, func.substr(Image.prompt, 1, Image.PROMPT_PREVIEW_LENGTH + 1)),
+        )
+
+    def to_dict(self, url_root=None, tags=None, refs=None, fields=None):
+        """
+        序列化为字典，用于 API 或导出
+        :param url_root: 预先计算好的 URL 根（批量序列化时复用）
+        :param tags / refs: 预先批量查询的标签名列表 / 参考图对象列表，为空则走关系懒加载
+        :param fields: 只输出这些字段（Image.parse_fields 的结果），不会访问其余列
+        """
+        if url_root is None:
+            url_root = get_url_root()
+
+        data = {}
+        for name in fields or Image.API_FIELDS:
+            if name == 'tags':
+                data['tags'] = list(tags) if tags is not None else [t.name for t in self.tags]
+            elif name == 'refs':
+                # 参考图列表
+                data['refs'] = self._refs_data(url_root, refs if refs is not None else self.refs)
+            elif name in ('file_path', 'thumbnail_path'):
+                # 主图和缩略图都处理成绝对路径
+                data[name] = _full_url(url_root, getattr(self, name))
+            elif name == 'prompt_preview':
+                preview = self.prompt_preview or ''
+                if len(preview) > Image.PROMPT_PREVIEW_LENGTH:
+                    preview = preview[:Image.PROMPT_PREVIEW_LENGTH] + '…'
+                data[name] = preview
+            elif name == 'lqip_data':
+                data[name] = self.lqip_data or ""  # LQIP 数据 URL
+            elif name == 'created_at':
+                data[name] = self.created_at.isoformat()
+            elif name == 'updated_at':
+                data[name] = (self.updated_at or self.created_at).isoformat()
+            else:
+                data[name] = getattr(self, name)
+        return data
 
-        # 构造参考图列表
+    @staticmethod
+    def _refs_data(url_root, refs):
+        """构造参考图列表"""
         refs_data = []
-        for r in self.refs:
+        for r in refs:
             # 处理占位符逻辑，如果是占位符，返回特定标记 {{userText}}
             if r.is_placeholder:
                 final_path = "{{userText}}"
             else:
-                final_path = _get_full_url(r.file_path) if r.file_path else ""
+                final_path = _full_url(url_root, r.file_path) if r.file_path else ""
 
             refs_data.append({
                 "id": r.id,
@@ -160,29 +276,82 @@ class Image(db.Model):
                 "is_placeholder": r.is_placeholder,
                 "position": r.position
             })
+        return refs_data
 
-        return {
-            "id": self.id,
-            "title": self.title,
-            "author": self.author,
-            "prompt": self.prompt,
-            "description": self.description,
-            "type": self.type,
-            "category": self.category,
-
-            # 主图和缩略图都处理成绝对路径
-            "file_path": _get_full_url(self.file_path),
-            "thumbnail_path": _get_full_url(self.thumbnail_path),
-            "lqip_data": self.lqip_data or "",  # LQIP 数据 URL
-
-            "tags": [t.name for t in self.tags],
-
-            # 参考图列表
-            "refs": refs_data,
-
-            "heat_score": self.heat_score,
-            "created_at": self.created_at.isoformat()
-        }
+    @staticmethod
+    def bulk_to_dict(images, fields=None, url_root=None):
+        """
+        批量序列化：标签和参考图各用一次 IN 查询取回（未投影的不查询），URL 根只计算一次，
+        输出与逐条 to_dict() 相同。
+        :param url_root: 不在请求上下文中时（如生成静态快照）指定 URL 根
+        """
+        images = list(images)
+        if not images:
+            return []
+
+        fields = fields or Image.API_FIELDS
+        ids = [img.id for img in images]
+        tags_map = {}
+        refs_map = {}
+        for start in range(0, len(ids), 900):
+            chunk = ids[start:start + 900]
+            if 'tags' in fields:
+                tag_rows = db.session.query(image_tags.c.image_id, Tag.name) \
+                    .join(Tag, Tag.id == image_tags.c.tag_id) \
+                    .filter(image_tags.c.image_id.in_(chunk)) \
+                    .all()
+                for image_id, name in tag_rows:
+                    tags_map.setdefault(image_id, []).append(name)
+
+            if 'refs' in fields:
+                ref_rows = ReferenceImage.query.filter(ReferenceImage.image_id.in_(chunk)) \
+                    .order_by(ReferenceImage.image_id, ReferenceImage.position).all()
+                for ref in ref_rows:
+                    refs_map.setdefault(ref.image_id, []).append(ref)
+
+        if url_root is None:
+            url_root = get_url_root()
+        return [
+            img.to_dict(url_root=url_root, tags=tags_map.get(img.id, []), refs=refs_map.get(img.id, []),
+                        fields=fields)
+            for img in images
+        ]
+
+
+def get_url_root():
+    """
+    当前请求的 URL 根（如 https://example.com），同一请求内只计算一次。
+    处理反向代理场景：优先使用 X-Forwarded-Proto 和 Host 头
+    """
+    if not has_request_context():
+        return ''
+    cached = getattr(g, '_pm_url_root', None)
+    if cached is not None:
+        return cached
+
+    if request.headers.get('X-Forwarded-Proto'):
+        # 反向代理场景（Nginx、Cloudflare等）
+        scheme = request.headers.get('X-Forwarded-Proto', 'https')
+        host = request.headers.get('X-Forwarded-Host') or request.host
+    else:
+        # 直接连接
+        scheme = request.scheme
+        host = request.host
+
+    g._pm_url_root = f"{scheme}://{host}"
+    return g._pm_url_root
+
+
+def _full_url(url_root, path):
+    """确保返回的是带域名的完整 URL"""
+    if not path:
+        return None
+    if path.startswith(('http://', 'https://')):
+        return path
+    # 本地路径，确保路径以 / 开头
+    if not path.startswith('/'):
+        path = '/' + path
+    return url_root + path
 
 
 class ReferenceImage(db.Model):
@@ -203,3 +372,74 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     is_sensitive = db.Column(db.Boolean, default=False)
+
+
+class PromptToken(db.Model):
+    """Prompt 词元：image_count 为引用该词元的作品数（不区分状态），由 PromptTokenService 增量维护"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    image_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class TagFacetCount(db.Model):
+    """标签计数物化表：按 (标签, 分类, 作品是否敏感) 统计已发布作品数，由 TagCountService 增量维护"""
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True)
+    category = db.Column(db.String(20), primary_key=True)
+    is_sensitive = db.Column(db.Boolean, primary_key=True, default=False)
+    image_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CatalogVersion(db.Model):
+    """作品目录版本号：按分类记录，作品 / 标签变更时递增，用于列表 API 的条件请求"""
+    category = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ImageStatBucket(db.Model):
+    """浏览 / 复制计数的时间分桶（按小时累加），用于计算时间衰减的趋势分"""
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, index=True)  # 桶起始时间（Unix 时间 // 桶长度）
+    views = db.Column(db.Integer, nullable=False, default=0)
+    copies = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TrendingRank(db.Model):
+    """趋势排行物化表：由 TrendingService 定期整表重建，列表按 rank 顺序直接读取"""
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+
+class ImageNeighbor(db.Model):
+    """相关作品物化表：每个已发布作品的前 K 个相似作品（同分类），由 RelatedService 增量维护，按 rank 顺序读取"""
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+
+class ImageCount(db.Model):
+    """作品计数物化表：按 (状态, 分类, 类型, 是否敏感) 统计作品数，由 ImageCountService 增量维护"""
+    status = db.Column(db.String(20), primary_key=True)
+    category = db.Column(db.String(20), primary_key=True)
+    type = db.Column(db.String(50), primary_key=True, default='')  # 未设置类型记为 ''
+    is_sensitive = db.Column(db.Boolean, primary_key=True, default=False)
+    image_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ImageChange(db.Model):
+    """
+    作品变更日志（增量同步用）：seq 单调递增，每个 (作品, 分类) 只保留最近一次变更；
+    不再公开的作品（删除、撤回审核、移出分类）保留为移除行 (deleted=True)，由 ChangeService 维护
+    """
+    __table_args__ = (
+        db.Index('ix_image_change_category_seq', 'category', 'seq'),
+        # SQLite 不复用已删除的最大 rowid，保证 seq 严格递增
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, nullable=False, index=True)
+    category = db.Column(db.String(20), nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -37,6 +37,8 @@ INSERT_ORDER = [
     "image",
     "image_tags",
     "reference_image",
+    "catalog_version",
+    "image_stat_bucket",
 ]
 
 DELETE_ORDER = list(reversed(INSERT_ORDER))
@@ -46,6 +48,11 @@ INDEX_SQL = [
     "CREATE INDEX IF NOT EXISTS ix_image_status_category_created_at ON image (status, category, created_at)",
     "CREATE INDEX IF NOT EXISTS ix_image_status_category_heat_created_at ON image (status, category, heat_score, created_at)",
     "CREATE INDEX IF NOT EXISTS ix_image_status_category_type_created_at ON image (status, category, type, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_image_random_key ON image (random_key)",
+    "CREATE INDEX IF NOT EXISTS ix_image_status_category_random_key ON image (status, category, random_key)",
+    "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_created_at ON image (status, category, is_sensitive, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_heat_created_at ON image (status, category, is_sensitive, heat_score, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_image_status_category_sensitive_random_key ON image (status, category, is_sensitive, random_key)",
     "CREATE INDEX IF NOT EXISTS ix_image_tags_image_id ON image_tags (image_id)",
     "CREATE INDEX IF NOT EXISTS ix_image_tags_tag_id ON image_tags (tag_id)",
     "CREATE INDEX IF NOT EXISTS ix_image_tags_tag_image ON image_tags (tag_id, image_id)",
@@ -92,13 +99,14 @@ def normalize_rows(table_name: str, rows: List[Dict[str, Any]]) -> List[Dict[str
         return rows
 
     for row in rows:
-        created_at = row.get("created_at")
-        if isinstance(created_at, str) and created_at:
-            try:
-                row["created_at"] = datetime.fromisoformat(created_at)
-            except ValueError:
-                # Keep original value if parsing fails.
-                pass
+        for column in ("created_at", "updated_at"):
+            value = row.get(column)
+            if isinstance(value, str) and value:
+                try:
+                    row[column] = datetime.fromisoformat(value)
+                except ValueError:
+                    # Keep original value if parsing fails.
+                    pass
     return rows
 
 
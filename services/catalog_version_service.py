@@ -0,0 +1,95 @@
+import hashlib
+import json
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from extensions import db
+from models import CatalogVersion
+from services.response_cache import ResponseCache
+
+
+class CatalogVersionService:
+    """
+    目录版本号：
+    每个写入路径在提交前调用 bump()，版本号随业务事务一起提交；
+    列表 API 用 (版本号 + 规范化参数) 生成 ETag，条件请求只需一次主键查询即可返回 304。
+    事务提交后同时清理 ResponseCache 中受影响分类的条目。
+    """
+
+    CATEGORIES = ('gallery', 'template')
+
+    # 浏览 / 复制计数只影响 heat_score，按时间窗口合并递增，避免每次访问都让缓存失效
+    STATS_BUMP_INTERVAL = 60  # 秒
+    _stats_bumped = {}
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def bump(*categories):
+        """递增给定分类的版本号（不传则全部分类），随调用方事务提交"""
+        targets = {c or 'gallery' for c in categories} or set(CatalogVersionService.CATEGORIES)
+        db.session.info.setdefault('catalog_bumped', set()).update(targets)
+        for category in sorted(targets):
+            updated = CatalogVersion.query.filter_by(category=category).update(
+                {CatalogVersion.version: CatalogVersion.version + 1},
+                synchronize_session=False
+            )
+            if updated:
+                continue
+            try:
+                with db.session.begin_nested():
+                    db.session.add(CatalogVersion(category=category, version=1))
+            except IntegrityError:
+                # 其他 worker 抢先插入了同一行，改为累加
+                CatalogVersion.query.filter_by(category=category).update(
+                    {CatalogVersion.version: CatalogVersion.version + 1},
+                    synchronize_session=False
+                )
+
+    @staticmethod
+    def bump_stats(category):
+        """计数变更：同一分类在 STATS_BUMP_INTERVAL 内最多递增一次（每个进程）"""
+        category = category or 'gallery'
+        now = time.monotonic()
+        with CatalogVersionService._stats_lock:
+            last = CatalogVersionService._stats_bumped.get(category)
+            if last is not None and now - last < CatalogVersionService.STATS_BUMP_INTERVAL:
+                return
+            CatalogVersionService._stats_bumped[category] = now
+        CatalogVersionService.bump(category)
+
+    @staticmethod
+    def current(category=None):
+        """读取版本号；category 为空时返回所有分类版本的组合字符串"""
+        categories = [category] if category else list(CatalogVersionService.CATEGORIES)
+        rows = dict(db.session.query(CatalogVersion.category, CatalogVersion.version)
+                    .filter(CatalogVersion.category.in_(categories)).all())
+        return '.'.join(str(rows.get(c, 0)) for c in categories)
+
+    @staticmethod
+    def scope(category):
+        """缓存 key 的作用域：分类名，或 'all' 表示不限分类"""
+        return category or 'all'
+
+    @staticmethod
+    def etag(category, params):
+        """由版本号与规范化后的请求参数生成 ETag，不依赖响应内容"""
+        source = json.dumps({'v': CatalogVersionService.current(category), 'c': category, 'p': params},
+                            sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.md5(source.encode('utf-8')).hexdigest()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_response_cache(session):
+    """版本号随事务提交后，清理对应分类以及“全部”视图的缓存结果"""
+    categories = session.info.pop('catalog_bumped', None)
+    if categories:
+        ResponseCache.invalidate(set(categories) | {'all'})
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_bumps(session, previous_transaction):
+    # 仅整个事务回滚时丢弃；bump() 内部的 SAVEPOINT 回滚不影响
+    if not previous_transaction.nested:
+        session.info.pop('catalog_bumped', None)
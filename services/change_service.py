@@ -0,0 +1,179 @@
+from datetime import datetime
+from sqlalchemy import event, insert, select, literal, func, text
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Image, ImageChange
+
+
+class ChangeService:
+    """
+    增量同步的变更日志：
+    写入路径在提交前调用 record()，刷新作品的 updated_at；提交时在 image_change 中为其写入新的变更序号
+    （同一作品同一分类的旧记录被替换，日志大小与作品数同阶）。
+    只记录公开可见性相关的变更：已发布作品的写入记为可见行 (deleted=False)；
+    此前可见、如今被删除 / 撤回审核 / 移出分类的记为移除行 (deleted=True)；
+    从未公开过的作品（待审核上传、编辑未发布作品）不写日志，订阅方不会收到它们的移除。
+    /api/changes 按序号读取，可见行是否仍可见（已发布、分类、敏感过滤）按当前状态判断，
+    因此变为敏感也会作为移除下发。
+    """
+
+    # PostgreSQL 事务级咨询锁的键：写入变更日志的事务在此串行
+    SEQ_LOCK_KEY = 7305001
+
+    @staticmethod
+    def record(image_ids, old_categories=(), deleted=False, batch_size=500):
+        """
+        记录作品变更（随调用方事务一起提交）
+        :param old_categories: 变更前的分类（分类切换时旧分类的订阅方需要收到移除）
+        :param deleted: 作品即将被删除，需在 db.session.delete() 之前调用
+        日志行在提交时由 write_pending() 写入
+        """
+        ids = sorted({int(i) for i in image_ids if i is not None})
+        old_categories = {c or 'gallery' for c in old_categories}
+        now = datetime.now()
+        pending = db.session.info.setdefault('pending_changes', {})
+        recorded = False
+
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            rows = db.session.query(Image.id, Image.category, Image.status).filter(Image.id.in_(chunk)).all()
+            if not rows:
+                continue
+            if not deleted:
+                Image.query.filter(Image.id.in_(chunk)).update({Image.updated_at: now}, synchronize_session=False)
+
+            # 订阅方最后看到的状态：{(作品, 分类): 是否为移除行}，本事务先前的记录优先
+            last_removed = dict(((i, c), d) for i, c, d in db.session.query(
+                ImageChange.image_id, ImageChange.category, ImageChange.deleted
+            ).filter(ImageChange.image_id.in_(chunk)))
+            in_chunk = set(chunk)
+            last_removed.update((key, entry['deleted']) for key, entry in pending.items() if key[0] in in_chunk)
+
+            for image_id, category, status in rows:
+                current = category or 'gallery'
+                for cat in {current} | old_categories:
+                    if not deleted and status == 'approved' and cat == current:
+                        removed = False
+                    elif last_removed.get((image_id, cat)) is False:
+                        removed = True
+                    else:
+                        continue  # 从未公开或已下发过移除
+                    # 同一事务内多次记录同一作品同一分类时以最后一次为准
+                    pending[(image_id, cat)] = {'image_id': image_id, 'category': cat,
+                                                'deleted': removed, 'changed_at': now}
+                    recorded = True
+        if recorded:
+            # 提交后通知本进程的 SSE 订阅者（见 EventStreamService）
+            db.session.info['changes_recorded'] = True
+
+    @staticmethod
+    def write_pending(session, batch_size=500):
+        """
+        提交前写入本事务记录的变更：序号必须按提交顺序分配，否则读取方推进 since 后
+        会跳过序号更小但较晚提交的变更。PostgreSQL 上先取事务级咨询锁（提交 / 回滚时释放），
+        持锁期间才分配序号；SQLite 写事务本身串行，无需加锁。
+        只有这里会写 image_change，持锁时不会再等待其他行锁，不会死锁。
+        """
+        pending = session.info.pop('pending_changes', None)
+        if not pending:
+            return
+        if session.get_bind().dialect.name == 'postgresql':
+            session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ChangeService.SEQ_LOCK_KEY})
+
+        entries = [pending[key] for key in sorted(pending)]
+        by_category = {}
+        for entry in entries:
+            by_category.setdefault(entry['category'], []).append(entry['image_id'])
+        for cat, cat_ids in sorted(by_category.items()):
+            for start in range(0, len(cat_ids), batch_size):
+                session.query(ImageChange) \
+                    .filter(ImageChange.category == cat, ImageChange.image_id.in_(cat_ids[start:start + batch_size])) \
+                    .delete(synchronize_session=False)
+        # 按作品 id 顺序写入，序号由数据库自增生成
+        for start in range(0, len(entries), batch_size):
+            session.execute(insert(ImageChange), entries[start:start + batch_size])
+
+    @staticmethod
+    def backfill():
+        """为变更日志为空时已有的已发布作品写入初始记录（首次 since=0 同步即可拿到全部作品），返回写入条数"""
+        Image.query.filter(Image.updated_at.is_(None)).update(
+            {Image.updated_at: Image.created_at}, synchronize_session=False
+        )
+        if db.session.query(ImageChange.seq).first() is not None:
+            db.session.commit()
+            return 0
+
+        # 只为已发布作品写入可见行，未发布作品在首次发布时才进入日志
+        source = select(
+            Image.id, func.coalesce(Image.category, 'gallery'), literal(False),
+            func.coalesce(Image.updated_at, Image.created_at, func.now())
+        ).where(Image.status == 'approved').order_by(Image.id)
+        result = db.session.execute(
+            insert(ImageChange).from_select(['image_id', 'category', 'deleted', 'changed_at'], source)
+        )
+        db.session.commit()
+        return result.rowcount or 0
+
+    @staticmethod
+    def latest_seq():
+        """当前最大变更序号，日志为空时为 0"""
+        return db.session.query(func.coalesce(func.max(ImageChange.seq), 0)).scalar() or 0
+
+    @staticmethod
+    def changes(since, limit, category=None, show_sensitive=False):
+        """
+        读取 since 之后的变更，按序号升序分页
+        :return: dict(upserted=[Image...], deleted=[id...], next_since=int, has_more=bool,
+                      seqs={id: 该作品在本页的最后序号})
+        """
+        query = ImageChange.query.filter(ImageChange.seq > since)
+        if category:
+            query = query.filter(ImageChange.category == category)
+        rows = query.order_by(ImageChange.seq.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # 同一作品在本页出现多次（多个分类）时以最后一次为准
+        latest = {}
+        for row in rows:
+            latest.pop(row.image_id, None)
+            latest[row.image_id] = row
+
+        candidate_ids = [image_id for image_id, row in latest.items() if not row.deleted]
+        visible = {}
+        if candidate_ids:
+            visible_query = Image.query.filter(Image.id.in_(candidate_ids), Image.status == 'approved')
+            if category:
+                visible_query = visible_query.filter(Image.category == category)
+            if not show_sensitive:
+                visible_query = visible_query.filter(Image.is_sensitive == False)
+            visible = {img.id: img for img in visible_query.all()}
+
+        upserted, removed = [], []
+        for image_id in latest:
+            if image_id in visible:
+                upserted.append(visible[image_id])
+            elif since > 0:
+                # since=0 是首次同步，客户端没有任何作品，不需要移除
+                removed.append(image_id)
+
+        return {
+            'upserted': upserted,
+            'deleted': removed,
+            'next_since': rows[-1].seq if rows else since,
+            'has_more': has_more,
+            'seqs': {image_id: row.seq for image_id, row in latest.items()},
+        }
+
+
+@event.listens_for(Session, 'before_commit')
+def _write_pending_changes(session):
+    # SAVEPOINT 提交也会触发 before_commit，只在最外层事务提交时写入
+    if not session.in_nested_transaction():
+        ChangeService.write_pending(session)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_changes(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('pending_changes', None)
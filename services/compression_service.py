@@ -0,0 +1,139 @@
+import gzip
+import zlib
+from flask import current_app, request, g
+from services.response_cache import ResponseCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressionService:
+    """
+    响应压缩（Content-Encoding 协商）：
+    - 按 Accept-Encoding 选择 br（需安装 brotli）或 gzip
+    - 视图声明了缓存 key（列表 api: / 片段 frag: / 单个作品 item: 等会重复命中的响应）时，
+      压缩结果存入 ResponseCache，key 为该 key 加编码后缀，重复命中直接复用压缩后的字节；
+      其余响应（/api/changes、/api/images?ids= 等一次性查询）只压缩不缓存，不挤占缓存条目
+    - 压缩后的 ETag 加编码后缀（"<etag>-gzip"），条件请求用 etag_matches() 同时识别各编码版本
+    HTML 页面每次渲染都带新的 CSRF token，只做压缩不缓存；流式响应由 apply_stream() 逐块增量压缩，不缓存。
+    """
+
+    COMPRESSIBLE_TYPES = ('text/html', 'application/json', 'application/x-ndjson', 'application/x-msgpack')
+
+    @staticmethod
+    def encodings():
+        """服务端支持的编码，按优先级排列"""
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    @staticmethod
+    def negotiate():
+        """根据 Accept-Encoding 选择编码，不接受压缩时返回 None"""
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in CompressionService.encodings():
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    @staticmethod
+    def compress(data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=current_app.config.get('COMPRESS_BR_QUALITY', 5))
+        # mtime=0：相同内容得到相同字节，便于缓存与 ETag
+        return gzip.compress(data, compresslevel=current_app.config.get('COMPRESS_GZIP_LEVEL', 6), mtime=0)
+
+    @staticmethod
+    def compress_stream(chunks, encoding):
+        """增量压缩：每块压缩后立即 flush，客户端收到一块即可解压，首字节不必等整个响应"""
+        config = current_app.config
+        try:
+            if encoding == 'br':
+                compressor = brotli.Compressor(quality=config.get('COMPRESS_BR_QUALITY', 5))
+                for chunk in chunks:
+                    data = compressor.process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                    yield data + compressor.flush()
+                yield compressor.finish()
+            else:
+                # wbits=31：带 gzip 头与校验尾
+                compressor = zlib.compressobj(config.get('COMPRESS_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+                for chunk in chunks:
+                    data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                    yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield compressor.flush()
+        finally:
+            # 客户端中途断开时关闭内层生成器，释放其请求上下文与数据库连接
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def etag_matches(etag_value):
+        """If-None-Match 是否命中给定 ETag 的任一编码版本"""
+        if not request.if_none_match:
+            return False
+        candidates = [etag_value] + [f'{etag_value}-{e}' for e in CompressionService.encodings()]
+        return any(request.if_none_match.contains(c) for c in candidates)
+
+    @staticmethod
+    def set_cache_key(key):
+        """
+        视图声明本次响应体对应的缓存 key，压缩结果存放在其旁边；
+        未声明或传 None（如未指定 seed 的随机列表）时只压缩不缓存。
+        """
+        g._pm_compress_key = key
+
+    @staticmethod
+    def apply_stream(response):
+        """流式响应的编码协商：替换为增量压缩的生成器（ETag 加编码后缀，与 apply() 一致）"""
+        if not current_app.config.get('COMPRESS_ENABLED', True):
+            return response
+        if response.mimetype not in CompressionService.COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = CompressionService.negotiate()
+        if encoding is None:
+            return response
+
+        response.response = CompressionService.compress_stream(response.response, encoding)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak=weak)
+        return response
+
+    @staticmethod
+    def apply(response):
+        """对可压缩的响应做编码协商与压缩（after_request 中调用）"""
+        if not current_app.config.get('COMPRESS_ENABLED', True):
+            return response
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if response.mimetype not in CompressionService.COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+            return response
+
+        data = response.get_data()
+        if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = CompressionService.negotiate()
+        if encoding is None:
+            return response
+
+        key = getattr(g, '_pm_compress_key', None)
+        if key:
+            compressed = ResponseCache.get_or_fill(f'{key}:{encoding}',
+                                                   lambda: CompressionService.compress(data, encoding))
+        else:
+            compressed = CompressionService.compress(data, encoding)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak=weak)
+        return response
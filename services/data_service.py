@@ -6,6 +6,12 @@ from werkzeug.utils import secure_filename
 from flask import current_app
 from extensions import db
 from models import Image, Tag, ReferenceImage
+from services.search_service import SearchService
+from services.prompt_token_service import PromptTokenService
+from services.image_service import ImageService
+from services.catalog_version_service import CatalogVersionService
+from services.image_count_service import ImageCountService
+from services.change_service import ChangeService
 
 
 class DataService:
@@ -68,8 +74,9 @@ class DataService:
                             file_path=f"/{web_folder}/{safe_name}",
                             thumbnail_path=f"/{web_folder}/{safe_thumb}" if safe_thumb else None,
                             status='pending',  # 导入后默认为待审核，需管理员确认
-                            heat_score=item.get('heat_score', 0)
+                            heat_score=item.get('heat_score') or 0
                         )
+                        SearchService.index_image(img)
                         # ---------------------------------
 
                         # 3. 处理标签
@@ -77,6 +84,7 @@ class DataService:
                             tag = Tag.query.filter_by(name=t).first() or Tag(name=t)
                             db.session.add(tag)
                             img.tags.append(tag)
+                        ImageService.sync_sensitive(img)
 
                         # 4. 处理参考图
                         for ref_path in item.get('refs', []):
@@ -106,6 +114,11 @@ class DataService:
                                         img.refs.append(ref_obj)
 
                         db.session.add(img)
+                        PromptTokenService.index_image(img)
+                        db.session.flush()
+                        ImageCountService.apply_delta({}, ImageCountService.snapshot([img.id]))
+                        ChangeService.record([img.id])
+                        CatalogVersionService.bump(img.category)
                         db.session.commit()
                         stats['processed'] += 1
                         yield "✅ OK\n"
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import db
+from services.change_service import ChangeService
+
+
+class EventStreamService:
+    """
+    /api/stream 的 Server-Sent Events 推送：
+    - 事件来源是 image_change 变更日志（序号单调递增、每个作品每个分类只保留最新一行，大小有界），
+      事件 id 即变更序号，断线重连时浏览器带上 Last-Event-ID 从该序号之后补发
+    - 每个进程只有一个后台线程按 SSE_POLL_INTERVAL 查询最大序号（有订阅者时才查询），
+      订阅者在 Condition 上等待，不各自轮询数据库；本进程提交的变更在 after_commit 中立即唤醒
+    - 同步 worker（gthread）下每个订阅占用一个线程：单连接最长 SSE_MAX_DURATION 秒后结束并由客户端自动重连，
+      每进程同时订阅数不超过 SSE_MAX_CLIENTS，超出时只返回 retry 提示，保证普通请求始终有空闲线程
+    """
+
+    BUSY_RETRY_MS = 10000  # 订阅数已满时建议客户端的重连间隔
+
+    _cond = threading.Condition()
+    _generation = 0
+    _polled_seq = 0
+    _clients = 0
+    _app = None
+    _pid = None
+
+    @staticmethod
+    def _ensure_poller():
+        """每个进程（gunicorn fork 后）懒启动一个轮询线程"""
+        pid = os.getpid()
+        if EventStreamService._pid == pid:
+            return
+        with EventStreamService._cond:
+            if EventStreamService._pid == pid:
+                return
+            EventStreamService._app = current_app._get_current_object()
+            EventStreamService._polled_seq = ChangeService.latest_seq()
+            EventStreamService._clients = 0
+            EventStreamService._pid = pid
+            interval = EventStreamService._app.config.get('SSE_POLL_INTERVAL', 1)
+            thread = threading.Thread(target=EventStreamService._run, args=(interval,),
+                                      name='sse-poll', daemon=True)
+            thread.start()
+
+    @staticmethod
+    def _run(interval):
+        app = EventStreamService._app
+        while True:
+            time.sleep(interval)
+            if not EventStreamService._clients:
+                continue
+            try:
+                with app.app_context():
+                    seq = ChangeService.latest_seq()
+                    db.session.remove()
+            except Exception as e:
+                app.logger.warning(f"SSE poll failed: {e}")
+                continue
+            if seq != EventStreamService._polled_seq:
+                EventStreamService._polled_seq = seq
+                EventStreamService.notify()
+
+    @staticmethod
+    def notify():
+        """变更日志有新内容时唤醒等待中的订阅者（代数加一，订阅者据此判断是否需要重新读取）"""
+        with EventStreamService._cond:
+            EventStreamService._generation += 1
+            EventStreamService._cond.notify_all()
+
+    @staticmethod
+    def generation():
+        with EventStreamService._cond:
+            return EventStreamService._generation
+
+    @staticmethod
+    def acquire():
+        """
+        登记一个订阅者，返回释放函数（重复调用只生效一次）；达到 SSE_MAX_CLIENTS 时返回 None。
+        调用方把释放函数挂到响应关闭时（response.call_on_close）：HEAD 请求、未读取即关闭的响应
+        不会执行事件流生成器，不能依赖生成器的 finally 释放名额
+        """
+        EventStreamService._ensure_poller()
+        limit = current_app.config.get('SSE_MAX_CLIENTS', 24)
+        with EventStreamService._cond:
+            if EventStreamService._clients >= limit:
+                return None
+            EventStreamService._clients += 1
+        released = threading.Event()
+
+        def release():
+            with EventStreamService._cond:
+                if released.is_set():
+                    return
+                released.set()
+                EventStreamService._clients = max(EventStreamService._clients - 1, 0)
+        return release
+
+    @staticmethod
+    def wait(known, timeout):
+        """等待代数超过 known 或超时，返回当前代数"""
+        with EventStreamService._cond:
+            EventStreamService._cond.wait_for(lambda: EventStreamService._generation > known, timeout)
+            return EventStreamService._generation
+
+    @staticmethod
+    def format_event(data=None, event_id=None, event_name=None, retry=None, comment=None):
+        lines = []
+        if comment is not None:
+            lines.append(f': {comment}')
+        if retry is not None:
+            lines.append(f'retry: {int(retry)}')
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+        if event_name:
+            lines.append(f'event: {event_name}')
+        if data is not None:
+            lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str))
+        return '\n'.join(lines) + '\n\n'
+
+    @staticmethod
+    def compact(image):
+        """推送用的精简字段，客户端需要详情时再调用 /api/images/<id>"""
+        return {
+            'id': image.id,
+            'category': image.category or 'gallery',
+            'title': image.title,
+            'thumbnail_path': image.thumbnail_path,
+            'updated_at': image.updated_at.isoformat() if image.updated_at else None,
+        }
+
+    @staticmethod
+    def pending_events(since, category=None, show_sensitive=False, batch_size=200):
+        """since 之后的事件 [(seq, event, data)]，按序号升序"""
+        result = ChangeService.changes(since, batch_size, category=category, show_sensitive=show_sensitive)
+        seqs = result['seqs']
+        events = [(seqs[img.id], 'upsert', EventStreamService.compact(img)) for img in result['upserted']]
+        events.extend((seqs[i], 'delete', {'id': i}) for i in result['deleted'])
+        events.sort(key=lambda e: e[0])
+        return events, result['next_since'], result['has_more']
+
+    @staticmethod
+    def stream(since, category=None, show_sensitive=False):
+        """
+        事件流生成器（调用方已 acquire()，响应关闭时释放名额）
+        :param since: 从该序号之后开始推送；None 表示只推送连接之后的新变更
+        """
+        config = current_app.config
+        max_duration = config.get('SSE_MAX_DURATION', 55)
+        heartbeat = config.get('SSE_HEARTBEAT_INTERVAL', 15)
+        retry_ms = config.get('SSE_RETRY_MS', 3000)
+        deadline = time.monotonic() + max_duration
+
+        try:
+            known = EventStreamService.generation()
+            if since is None:
+                since = ChangeService.latest_seq()
+            db.session.remove()
+            # 首条消息带上重连间隔与当前序号，客户端立即知道连接已建立
+            yield EventStreamService.format_event({'last_event_id': since}, event_id=since,
+                                                  event_name='ready', retry=retry_ms)
+
+            while True:
+                has_more = True
+                while has_more:
+                    events, next_since, has_more = EventStreamService.pending_events(
+                        since, category=category, show_sensitive=show_sensitive
+                    )
+                    db.session.remove()  # 等待期间不占用数据库连接
+                    for seq, name, data in events:
+                        yield EventStreamService.format_event(data, event_id=seq, event_name=name)
+                    since = next_since
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                latest = EventStreamService.wait(known, min(heartbeat, remaining))
+                if latest > known:
+                    known = latest
+                else:
+                    yield EventStreamService.format_event(comment='ping')
+        finally:
+            db.session.remove()
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_subscribers(session):
+    if session.info.pop('changes_recorded', None) and EventStreamService._pid == os.getpid():
+        EventStreamService.notify()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('changes_recorded', None)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Image, ImageCount
+from services.catalog_version_service import CatalogVersionService
+from services.response_cache import ResponseCache
+
+
+class ImageCountService:
+    """
+    列表总数：
+    - 无标签 / 搜索过滤的视图：直接读取按 (状态, 分类, 类型, 敏感) 增量维护的计数表，精确且只需一次小查询
+    - 带过滤的视图：COUNT 结果放入 ResponseCache（带 TTL，写入时随目录版本失效）；
+      PostgreSQL 上先取规划器估算，超过 COUNT_ESTIMATE_THRESHOLD 时直接使用估算值
+    - count=none：不计算总数，分页只给出 has_next
+    计数器统一返回 (total, exact)，供 ListingService.paginate 使用。
+    """
+
+    COUNT_MODES = ('auto', 'none')
+
+    @staticmethod
+    def _key(status, category, type_, sensitive):
+        return status or 'pending', category or 'gallery', type_ or '', bool(sensitive)
+
+    @staticmethod
+    def snapshot(image_ids, batch_size=500):
+        """统计给定作品对计数表的贡献 (status, category, type, sensitive) -> n"""
+        ids = [int(i) for i in image_ids if i is not None]
+        contrib = Counter()
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            rows = db.session.query(Image.status, Image.category, Image.type, Image.is_sensitive) \
+                .filter(Image.id.in_(chunk)).all()
+            for row in rows:
+                contrib[ImageCountService._key(*row)] += 1
+        return contrib
+
+    @staticmethod
+    def apply_delta(before, after):
+        """把 after - before 的差值写入计数表（随调用方事务一起提交）"""
+        delta = Counter(after)
+        delta.subtract(before)
+
+        for (status, category, type_, sensitive), diff in delta.items():
+            if diff == 0:
+                continue
+            key = and_(ImageCount.status == status,
+                       ImageCount.category == category,
+                       ImageCount.type == type_,
+                       ImageCount.is_sensitive == sensitive)
+            updated = db.session.query(ImageCount).filter(key).update(
+                {ImageCount.image_count: ImageCount.image_count + diff},
+                synchronize_session=False
+            )
+            if not updated and diff > 0:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(ImageCount(status=status, category=category, type=type_,
+                                                  is_sensitive=sensitive, image_count=diff))
+                except IntegrityError:
+                    # 其他 worker 抢先插入了同一行，改为累加
+                    db.session.query(ImageCount).filter(key).update(
+                        {ImageCount.image_count: ImageCount.image_count + diff},
+                        synchronize_session=False
+                    )
+            elif diff < 0:
+                db.session.query(ImageCount).filter(key, ImageCount.image_count <= 0) \
+                    .delete(synchronize_session=False)
+
+    @staticmethod
+    @contextmanager
+    def track(image_ids):
+        """
+        用法：
+            with ImageCountService.track([img.id]):
+                ...修改作品状态 / 分类 / 类型 / 标签...
+            db.session.commit()
+        """
+        ids = list(image_ids)
+        before = ImageCountService.snapshot(ids)
+        yield
+        db.session.flush()
+        ImageCountService.apply_delta(before, ImageCountService.snapshot(ids))
+
+    @staticmethod
+    def expected_counts():
+        """从明细表全量计算期望计数"""
+        rows = db.session.query(Image.status, Image.category, Image.type, Image.is_sensitive,
+                                db.func.count(Image.id)) \
+            .group_by(Image.status, Image.category, Image.type, Image.is_sensitive).all()
+        expected = Counter()
+        for status, category, type_, sensitive, count in rows:
+            expected[ImageCountService._key(status, category, type_, sensitive)] += count
+        return expected
+
+    @staticmethod
+    def rebuild():
+        """一致性重建：与明细表比对并修正计数表，返回修正的行数"""
+        expected = ImageCountService.expected_counts()
+        stored = {
+            (row.status, row.category, row.type, row.is_sensitive): row
+            for row in ImageCount.query.all()
+        }
+
+        fixed = 0
+        for key, row in stored.items():
+            if key not in expected:
+                db.session.delete(row)
+                fixed += 1
+            elif row.image_count != expected[key]:
+                row.image_count = expected[key]
+                fixed += 1
+        for key, count in expected.items():
+            if key not in stored:
+                status, category, type_, sensitive = key
+                db.session.add(ImageCount(status=status, category=category, type=type_,
+                                          is_sensitive=sensitive, image_count=count))
+                fixed += 1
+
+        db.session.commit()
+        return fixed
+
+    @staticmethod
+    def total(status=None, category=None, type_filter='', show_sensitive=True):
+        """从计数表汇总精确总数（参数为空表示不限）"""
+        query = db.session.query(db.func.coalesce(db.func.sum(ImageCount.image_count), 0))
+        if status:
+            query = query.filter(ImageCount.status == status)
+        if category:
+            query = query.filter(ImageCount.category == category)
+        if type_filter in ['txt2img', 'img2img']:
+            query = query.filter(ImageCount.type == type_filter)
+        if not show_sensitive:
+            query = query.filter(ImageCount.is_sensitive == False)
+        return int(query.scalar())
+
+    @staticmethod
+    def estimate(query):
+        """PostgreSQL 规划器估算的行数；其他数据库或失败时返回 None"""
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        try:
+            compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+            plan = db.session.connection().exec_driver_sql(
+                'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+            ).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            current_app.logger.warning(f"Count estimate failed: {e}")
+            return None
+
+    @staticmethod
+    def filtered_total(query, category=None):
+        """带过滤条件的总数：优先读缓存；结果集较大时在 PostgreSQL 上用规划器估算代替 COUNT"""
+        compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+        digest = hashlib.md5(json.dumps([str(compiled), compiled.params], sort_keys=True, default=str)
+                             .encode('utf-8')).hexdigest()
+        cache_key = 'count:{}:{}'.format(CatalogVersionService.scope(category), digest)
+
+        def compute():
+            threshold = current_app.config.get('COUNT_ESTIMATE_THRESHOLD', 10000)
+            estimated = ImageCountService.estimate(query)
+            if estimated is not None and threshold and estimated >= threshold:
+                return {'total': estimated, 'exact': False}
+            return {'total': query.order_by(None).count(), 'exact': True}
+
+        result = ResponseCache.get_or_fill_json(cache_key, compute, ttl=current_app.config.get('COUNT_CACHE_TTL', 60))
+        return result['total'], result['exact']
+
+    @staticmethod
+    def counter(category=None, type_filter='', show_sensitive=False, filtered=False, mode='auto', status='approved'):
+        """
+        生成分页用的计数函数 counter(query) -> (total, exact)
+        :param filtered: 是否带有计数表无法表达的过滤条件（标签 / 搜索 / 趋势榜）
+        :param mode: 'auto' 或 'none'（不计算总数）
+        """
+        if mode == 'none':
+            return lambda query: (None, False)
+        if filtered:
+            return lambda query: ImageCountService.filtered_total(query, category)
+        return lambda query: (ImageCountService.total(status, category, type_filter, show_sensitive), True)
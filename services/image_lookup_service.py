@@ -0,0 +1,87 @@
+import hashlib
+import json
+from extensions import db
+from models import Image, get_url_root
+from services.response_cache import ResponseCache
+
+
+class ImageLookupService:
+    """
+    按 id 查询作品（单个 / 批量），查询次数固定：
+    1) 一次查询取回可见作品的版本列 (id, updated_at, created_at, heat_score)，据此计算每个作品的 ETag
+    2) 客户端已持有相同 ETag 的作品直接标记为未变化
+    3) 其余作品先查 ResponseCache 中按 ETag 缓存的序列化结果，未命中的再走批量序列化（作品 / 标签 / 参考图各一次）
+    ETag 由内容版本决定（updated_at 随每次变更刷新，heat_score 覆盖计数变化），缓存条目无需主动失效。
+    """
+
+    @staticmethod
+    def parse_ids(raw, limit):
+        """解析 ids=1,2,3（去重并保持顺序），格式无效或超过上限时抛出 ValueError"""
+        ids = []
+        for part in (raw or '').split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                value = int(part)
+            except ValueError:
+                raise ValueError(f'无效的 id: {part}')
+            if value not in ids:
+                ids.append(value)
+        if not ids:
+            raise ValueError('缺少 ids 参数')
+        if len(ids) > limit:
+            raise ValueError(f'单次最多查询 {limit} 个 id')
+        return ids
+
+    @staticmethod
+    def item_etag(image_id, updated_at, heat_score, fields=None, url_root=''):
+        source = json.dumps([image_id, updated_at, heat_score, fields, url_root], default=str)
+        return hashlib.md5(source.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def visible_versions(ids, show_sensitive=False):
+        """可见作品（已发布，且按权限过滤敏感作品）的版本列 [(id, updated_at, created_at, heat_score)]"""
+        query = db.session.query(Image.id, Image.updated_at, Image.created_at, Image.heat_score) \
+            .filter(Image.id.in_(ids), Image.status == 'approved')
+        if not show_sensitive:
+            query = query.filter(Image.is_sensitive == False)
+        return query.all()
+
+    @staticmethod
+    def lookup(ids, show_sensitive=False, fields=None, is_known=None):
+        """
+        :param is_known: is_known(id, etag) -> bool，客户端已持有该版本时不再返回内容
+        :return: dict(items={id: dict}, etags={id: etag}, not_modified=[id], missing=[id])，均按 ids 顺序
+        """
+        url_root = get_url_root()
+
+        etags = {}
+        for image_id, updated_at, created_at, heat_score in ImageLookupService.visible_versions(ids, show_sensitive):
+            etags[image_id] = ImageLookupService.item_etag(image_id, updated_at or created_at, heat_score,
+                                                           fields, url_root)
+
+        missing = [i for i in ids if i not in etags]
+        not_modified = [i for i in ids if i in etags and is_known and is_known(i, etags[i])]
+        wanted = [i for i in ids if i in etags and i not in not_modified]
+
+        keys = {i: f'item:{etags[i]}' for i in wanted}
+        cached = ResponseCache.get_many(list(keys.values()))
+        items = {i: json.loads(cached[keys[i]]) for i in wanted if keys[i] in cached}
+
+        to_load = [i for i in wanted if i not in items]
+        if to_load:
+            query = Image.query.filter(Image.id.in_(to_load))
+            if fields:
+                query = query.options(Image.load_only_fields(fields))
+            images = query.all()
+            fresh = dict(zip([img.id for img in images], Image.bulk_to_dict(images, fields=fields)))
+            items.update(fresh)
+            ResponseCache.set_many({keys[i]: json.dumps(fresh[i], ensure_ascii=False) for i in fresh})
+
+        return {
+            'items': {i: items[i] for i in wanted if i in items},
+            'etags': {i: etags[i] for i in ids if i in etags},
+            'not_modified': not_modified,
+            'missing': missing,
+        }
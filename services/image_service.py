@@ -1,7 +1,16 @@
 import json
 from flask import current_app
 from extensions import db
-from models import Image, Tag, ReferenceImage
+from sqlalchemy import or_
+from models import Image, Tag, ReferenceImage, image_tags
+from services.search_service import SearchService
+from services.prompt_token_service import PromptTokenService
+from services.tag_count_service import TagCountService
+from services.image_count_service import ImageCountService
+from services.change_service import ChangeService
+from services.catalog_version_service import CatalogVersionService
+from services.trending_service import TrendingService
+from services.related_service import RelatedService
 from utils import process_image, remove_physical_file
 
 
@@ -25,8 +34,10 @@ class ImageService:
                 lqip_data=lqip_data,  # 新增：保存 LQIP 数据
                 status=data.get('status', 'pending')
             )
+            SearchService.index_image(image)
 
             db.session.add(image)
+            PromptTokenService.index_image(image)
 
             if data.get('tags'):
                 ImageService._apply_tags(image, data.get('tags'))
@@ -41,6 +52,11 @@ class ImageService:
                 elif ref_files:
                     ImageService._process_refs(image, ref_files, start_pos=0)
 
+            TagCountService.apply_delta({}, TagCountService.snapshot([image.id]))
+            ImageCountService.apply_delta({}, ImageCountService.snapshot([image.id]))
+            ChangeService.record([image.id])
+            CatalogVersionService.bump(image.category)
+
             db.session.commit()
             return image
 
@@ -62,6 +78,10 @@ class ImageService:
         upload_folder = current_app.config['UPLOAD_FOLDER']
 
         try:
+            tag_counts_before = TagCountService.snapshot([image.id])
+            image_counts_before = ImageCountService.snapshot([image.id])
+            old_category = image.category
+
             # 基础信息
             image.title = data.get('title')
             image.author = data.get('author')
@@ -70,6 +90,8 @@ class ImageService:
             image.type = data.get('type')
             image.category = data.get('category')
             image.status = data.get('status')
+            SearchService.index_image(image)
+            PromptTokenService.index_image(image)
 
             # 替换主图
             if new_main_file and new_main_file.filename:
@@ -106,6 +128,12 @@ class ImageService:
                 if new_ref_files:
                     ImageService._process_refs(image, new_ref_files, start_pos=max_pos + 1)
 
+            db.session.flush()
+            TagCountService.apply_delta(tag_counts_before, TagCountService.snapshot([image.id]))
+            ImageCountService.apply_delta(image_counts_before, ImageCountService.snapshot([image.id]))
+            ChangeService.record([image.id], old_categories=[old_category])
+            CatalogVersionService.bump(old_category, image.category)
+
             db.session.commit()
         except Exception:
             db.session.rollback()
@@ -130,8 +158,17 @@ class ImageService:
                 files_to_remove.append(r.file_path)
 
         tags = list(image.tags)
+        tag_counts_before = TagCountService.snapshot([image.id])
+        image_counts_before = ImageCountService.snapshot([image.id])
+        ChangeService.record([image.id], deleted=True)
+        PromptTokenService.release(image)
+        TrendingService.release([image.id])
+        RelatedService.release([image.id])
 
         db.session.delete(image)
+        TagCountService.apply_delta(tag_counts_before, {})
+        ImageCountService.apply_delta(image_counts_before, {})
+        CatalogVersionService.bump(image.category)
         db.session.commit()
 
         for p in files_to_remove:
@@ -142,14 +179,50 @@ class ImageService:
 
     @staticmethod
     def _apply_tags(image, tags_str):
-        if not tags_str: return
-        tag_names = set(t.strip() for t in tags_str.replace('，', ',').split(',') if t.strip())
-        for name in tag_names:
-            tag = Tag.query.filter_by(name=name).first()
-            if not tag:
-                tag = Tag(name=name)
-                db.session.add(tag)
-            image.tags.append(tag)
+        if tags_str:
+            tag_names = set(t.strip() for t in tags_str.replace('，', ',').split(',') if t.strip())
+            for name in tag_names:
+                tag = Tag.query.filter_by(name=name).first()
+                if not tag:
+                    tag = Tag(name=name)
+                    db.session.add(tag)
+                image.tags.append(tag)
+        ImageService.sync_sensitive(image)
+
+    @staticmethod
+    def sync_sensitive(image):
+        """按已加载的标签刷新单个作品的敏感标记"""
+        image.is_sensitive = any(t.is_sensitive for t in image.tags)
+
+    @staticmethod
+    def refresh_sensitive(image_ids=None, only_missing=False, batch_size=500):
+        """
+        按数据库中的标签关联批量重算敏感标记（标签敏感性变化、合并、一致性重建时使用）
+        :param image_ids: 为空时处理全部作品
+        :param only_missing: 仅回填尚未计算的作品（新增列后的历史数据）
+        :return: 实际变更的条数
+        """
+        flag = db.session.query(image_tags.c.image_id) \
+            .join(Tag, Tag.id == image_tags.c.tag_id) \
+            .filter(image_tags.c.image_id == Image.id, Tag.is_sensitive == True) \
+            .exists()
+
+        def refresh(query):
+            if only_missing:
+                query = query.filter(Image.is_sensitive.is_(None))
+            else:
+                query = query.filter(or_(Image.is_sensitive.is_(None), Image.is_sensitive != flag))
+            return query.update({Image.is_sensitive: flag}, synchronize_session=False)
+
+        db.session.flush()
+        if image_ids is None:
+            return refresh(Image.query)
+
+        ids = [int(i) for i in image_ids]
+        changed = 0
+        for start in range(0, len(ids), batch_size):
+            changed += refresh(Image.query.filter(Image.id.in_(ids[start:start + batch_size])))
+        return changed
 
     @staticmethod
     def _process_refs(image, files, start_pos=0):
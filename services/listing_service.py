@@ -0,0 +1,526 @@
+import base64
+import hashlib
+import json
+import random
+import secrets
+from datetime import datetime
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import and_, or_, func
+from extensions import db
+from models import Image, TrendingRank
+from services.search_service import SearchService
+from services.prompt_token_service import PromptTokenService
+from services.image_count_service import ImageCountService
+from services.catalog_version_service import CatalogVersionService
+from services.stats_service import StatsService
+
+
+class CursorError(ValueError):
+    """游标无效或与当前排序方式不匹配"""
+
+
+class KeysetPagination:
+    """游标分页结果，字段与 Flask-SQLAlchemy Pagination 保持相近，便于模板复用"""
+
+    def __init__(self, items, per_page, has_next, next_cursor=None, cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+        # 游标模式不做 COUNT，也没有页码概念
+        self.page = None
+        self.pages = None
+        self.total = None
+        self.total_exact = None
+        self.has_prev = cursor is not None
+        self.prev_num = None
+        self.next_num = None
+
+    def iter_pages(self, **kwargs):
+        return iter(())
+
+
+class PageSnapshot:
+    """分页结果的可序列化快照（不含查询对象），用于跨进程缓存后还原给模板使用"""
+
+    FIELDS = ('page', 'per_page', 'pages', 'total', 'total_exact', 'has_prev', 'has_next',
+              'prev_num', 'next_num', 'next_cursor', 'cursor')
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_pagination(cls, pagination):
+        return cls(**{name: getattr(pagination, name, None) for name in cls.FIELDS})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def iter_pages(self, **kwargs):
+        if not self.pages or not self.page:
+            return iter(())
+        return Pagination.iter_pages(self, **kwargs)
+
+
+class ListingPagination(Pagination):
+    """
+    列表页码分页：
+    - 多取一条判断 has_next，总数为估算值或未计算时翻页仍然准确
+    - 总数由调用方传入的 counter(query) -> (total, exact) 给出（见 ImageCountService.counter），
+      未传时对查询做精确 COUNT
+    - 估算总数与实际读到的记录矛盾时按实际结果修正；到达末页即可得到精确总数
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.total_exact = True
+        self._has_more = False
+        super().__init__(*args, **kwargs)
+        if self.items:
+            self.total, self.total_exact = self.reconcile(
+                self.total, self.total_exact, self._query_offset + len(self.items), self._has_more
+            )
+
+    @staticmethod
+    def reconcile(total, exact, seen, has_more):
+        """用已读到的位置 seen（offset + 本页条数）修正估算总数"""
+        if total is None or exact:
+            return total, exact
+        if not has_more:
+            return seen, True
+        return max(total, seen + 1), False
+
+    def _fetch(self, limit):
+        return self._query_args['query'].limit(limit).offset(self._query_offset).all()
+
+    def _query_items(self):
+        rows = self._fetch(self.per_page + 1)
+        self._has_more = len(rows) > self.per_page
+        return rows[:self.per_page]
+
+    def _query_count(self):
+        query = self._query_args['query']
+        counter = self._query_args.get('counter')
+        if counter is None:
+            return query.order_by(None).count()
+        total, self.total_exact = counter(query)
+        return total
+
+    @property
+    def has_next(self):
+        return self._has_more
+
+
+class SeededRandomPagination(ListingPagination):
+    """
+    seed 随机排序的页码分页。
+    顺序为 random_key 从 seed 起点开始的环形扫描：先取 random_key >= start，再回绕到 < start，
+    两段都是 (status, category, random_key) 索引上的范围扫描。
+    """
+
+    def _fetch(self, limit):
+        head, tail = ListingService.random_segments(self._query_args['query'], self._query_args['start'])
+        offset = self._query_offset
+        items = head.offset(offset).limit(limit).all()
+        if len(items) == limit:
+            return items
+        if items:
+            # 本页跨越两段：前段已取完，后段从头补齐
+            return items + tail.limit(limit - len(items)).all()
+        # 整页落在后段，需要知道前段长度来换算偏移
+        head_count = head.order_by(None).count()
+        return tail.offset(max(offset - head_count, 0)).limit(limit).all()
+
+
+class StreamingPage:
+    """
+    流式分页：iter_items() 按批从服务端游标读取（yield_per），不把整页装进内存。
+    has_next / next_cursor / total 等字段在迭代结束后才可用，调用方应把 meta 放在响应末尾输出。
+    """
+
+    def __init__(self, query, sort_by, per_page, page=None, cursor=None, q='', seed=None, batch_size=500,
+                 counter=None):
+        self._query = query
+        self._counter = counter
+        self._sort_by = sort_by
+        self._q = q
+        self._seed = seed
+        self._batch_size = batch_size
+        self.per_page = per_page
+        self.cursor = cursor
+        self.page = None if cursor is not None else page
+        self.total = None
+        self.total_exact = True
+        self.pages = None
+        self.has_next = False
+        self.next_num = None
+        self.next_cursor = None
+
+    def iter_items(self):
+        last = None
+        # 多读一条判断 has_next
+        if self.cursor is not None:
+            rows = ListingService.iter_cursor_rows(self._query, self._sort_by, self.cursor, self.per_page + 1,
+                                                   seed=self._seed, batch_size=self._batch_size)
+        else:
+            rows = ListingService.iter_page_rows(self._query, self._sort_by, self.page, self.per_page,
+                                                 q=self._q, seed=self._seed, batch_size=self._batch_size,
+                                                 limit=self.per_page + 1)
+        seen = 0
+        for count, row in enumerate(rows):
+            if count == self.per_page:
+                self.has_next = True
+                break
+            seen += 1
+            last = row
+            yield row
+
+        if self.cursor is None:
+            self._finish_count(seen)
+
+        if self.has_next and last is not None and ListingService.supports_cursor(self._sort_by):
+            self.next_cursor = ListingService.encode_cursor(self._sort_by, last, seed=self._seed)
+
+
+    def _finish_count(self, seen):
+        """页码模式：读完本页后再计算总数（规则同 ListingPagination）"""
+        query = ListingService.apply_sort(self._query, self._sort_by, self._q)
+        if self._counter is None:
+            self.total = query.order_by(None).count()
+        else:
+            self.total, self.total_exact = self._counter(query)
+        if seen:
+            offset = (self.page - 1) * self.per_page
+            self.total, self.total_exact = ListingPagination.reconcile(
+                self.total, self.total_exact, offset + seen, self.has_next
+            )
+        self.pages = -(-self.total // self.per_page) if self.total else 0
+        self.next_num = self.page + 1 if self.has_next else None
+
+
+class ListingService:
+    """画廊 / 模板列表的公共查询逻辑（过滤、排序、游标分页）"""
+
+    # 各排序方式对应的 keyset 键，需与 ensure_query_indexes 中的复合索引一致
+    # date / hot 为降序；random 为 (所在段, random_key, id) 升序；trending 为排行表 rank 升序
+    CURSOR_KEYS = {
+        'date': ('created_at', 'id'),
+        'hot': ('heat_score', 'created_at', 'id'),
+        'random': ('phase', 'random_key', 'id'),
+        'trending': ('rank',),
+    }
+
+    @staticmethod
+    def normalize_type(type_filter):
+        """支持两种写法: txt2img 和 text2img（规范化为 txt2img）"""
+        if type_filter == 'text2img':
+            return 'txt2img'
+        return type_filter
+
+    @staticmethod
+    def resolve_seed(sort_by, seed):
+        """random 排序未指定 seed 时生成一个，并由调用方写回翻页链接，保证翻页稳定"""
+        if sort_by != 'random':
+            return None
+        seed = (seed or '').strip()[:64]
+        return seed or str(secrets.randbelow(10 ** 9))
+
+    @staticmethod
+    def random_start(seed):
+        """seed -> [0, 1) 区间内的环形扫描起点"""
+        digest = hashlib.md5(str(seed).encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) / 2 ** 32
+
+    @staticmethod
+    def build_query(category=None, tag='', q='', type_filter='', show_sensitive=False, token=''):
+        """构建已发布作品的过滤查询（不含排序）"""
+        query = Image.query.filter_by(status='approved')
+
+        if category:
+            query = query.filter_by(category=category)
+
+        if not show_sensitive:
+            # 冗余的 is_sensitive 列可直接走复合索引，不再对每行做 NOT EXISTS 子查询
+            query = query.filter(Image.is_sensitive == False)
+
+        if tag:
+            query = query.filter(Image.tags.any(name=tag))
+
+        if token:
+            # token 为 PromptTokenService.lookup_names() 给出的候选词元名
+            query = PromptTokenService.filter_query(query, token)
+
+        type_filter = ListingService.normalize_type(type_filter)
+        if type_filter in ['txt2img', 'img2img']:
+            query = query.filter_by(type=type_filter)
+
+        if q:
+            query = SearchService.apply(query, q)
+
+        return query
+
+    @staticmethod
+    def counter(category=None, tag='', q='', type_filter='', show_sensitive=False, sort_by='date', mode='auto',
+                token=''):
+        """
+        与 build_query 参数对应的总数计算函数（传给 paginate / stream）：
+        无标签、词元、搜索过滤且非趋势榜时读计数表，否则走缓存 / 估算的 COUNT；mode='none' 不计算总数
+        """
+        return ImageCountService.counter(
+            category=category,
+            type_filter=ListingService.normalize_type(type_filter),
+            show_sensitive=show_sensitive,
+            filtered=bool(tag or token or q or sort_by == 'trending'),
+            mode=mode
+        )
+
+    @staticmethod
+    def apply_sort(query, sort_by, q=''):
+        """排序；id 作为最终决胜键，保证翻页顺序稳定"""
+        if sort_by == 'relevance' and q:
+            rank_order = SearchService.rank_order(q)
+            if rank_order is not None:
+                return query.order_by(rank_order, Image.created_at.desc(), Image.id.desc())
+        if sort_by == 'hot':
+            return query.order_by(Image.heat_score.desc(), Image.created_at.desc(), Image.id.desc())
+        if sort_by == 'random':
+            return query.order_by(Image.random_key.asc(), Image.id.asc())
+        if sort_by == 'trending':
+            # 只列出上榜作品，按排行表 rank 顺序读取
+            return query.join(TrendingRank, TrendingRank.image_id == Image.id).order_by(TrendingRank.rank.asc())
+        return query.order_by(Image.created_at.desc(), Image.id.desc())
+
+    @staticmethod
+    def random_segments(query, start):
+        """seed 环形扫描的两段查询：(random_key >= start, random_key < start)，均按 (random_key, id) 升序"""
+        order = (Image.random_key.asc(), Image.id.asc())
+        head = query.filter(Image.random_key >= start).order_by(*order)
+        tail = query.filter(Image.random_key < start).order_by(*order)
+        return head, tail
+
+    @staticmethod
+    def paginate(query, sort_by, page, per_page, q='', seed=None, error_out=True, counter=None):
+        """
+        页码分页；可用游标时同时给出 next_cursor，方便客户端从第一页起切换到游标模式
+        :param counter: 总数计算函数 counter(query) -> (total, exact)，为空时精确 COUNT
+        """
+        if sort_by == 'random':
+            pagination = SeededRandomPagination(
+                page=page, per_page=per_page, max_per_page=None, error_out=error_out,
+                query=query, start=ListingService.random_start(seed), counter=counter
+            )
+        else:
+            pagination = ListingPagination(
+                page=page, per_page=per_page, max_per_page=None, error_out=error_out,
+                query=ListingService.apply_sort(query, sort_by, q), counter=counter
+            )
+
+        pagination.next_cursor = None
+        if pagination.has_next and pagination.items and ListingService.supports_cursor(sort_by):
+            pagination.next_cursor = ListingService.encode_cursor(sort_by, pagination.items[-1], seed=seed)
+        return pagination
+
+    @staticmethod
+    def supports_cursor(sort_by):
+        return ListingService._cursor_sort(sort_by) in ListingService.CURSOR_KEYS
+
+    @staticmethod
+    def _cursor_sort(sort_by):
+        """未知排序与 apply_sort 一致按 date 处理；relevance 不支持游标"""
+        if sort_by == 'relevance' or sort_by in ListingService.CURSOR_KEYS:
+            return sort_by
+        return 'date'
+
+    @staticmethod
+    def encode_cursor(sort_by, image, seed=None):
+        """根据当前页最后一条记录生成不透明游标"""
+        sort_key = ListingService._cursor_sort(sort_by)
+        data = {'s': sort_key}
+        if sort_key == 'random':
+            phase = 0 if image.random_key >= ListingService.random_start(seed) else 1
+            data['k'] = [phase, image.random_key, image.id]
+            data['seed'] = seed
+        elif sort_key == 'trending':
+            rank = db.session.query(TrendingRank.rank).filter_by(image_id=image.id).scalar()
+            data['k'] = [rank if rank is not None else 0]
+        else:
+            values = []
+            for attr in ListingService.CURSOR_KEYS[sort_key]:
+                value = getattr(image, attr)
+                if attr == 'heat_score' and value is None:
+                    value = 0  # 历史数据由 backfill_heat_scores 回填为 0，与之保持一致
+                if isinstance(value, datetime):
+                    value = value.isoformat()
+                values.append(value)
+            data['k'] = values
+        raw = json.dumps(data, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(token, sort_by):
+        """解析游标，返回 (按 CURSOR_KEYS 顺序排列的键值列表, seed)"""
+        sort_key = ListingService._cursor_sort(sort_by)
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            values = list(data['k'])
+        except Exception:
+            raise CursorError('cursor 参数无效')
+
+        attrs = ListingService.CURSOR_KEYS.get(sort_key)
+        if data.get('s') != sort_key or not attrs or len(values) != len(attrs):
+            raise CursorError('cursor 与当前排序方式不匹配')
+
+        try:
+            for i, attr in enumerate(attrs):
+                if attr == 'created_at':
+                    values[i] = datetime.fromisoformat(values[i])
+                elif attr == 'random_key':
+                    values[i] = float(values[i])
+                else:
+                    values[i] = int(values[i])
+        except (TypeError, ValueError):
+            raise CursorError('cursor 参数无效')
+        return values, data.get('seed')
+
+    @staticmethod
+    def _after_clause(sort_key, values):
+        """生成 (k1, k2, ...) < (v1, v2, ...) 的展开条件，首列额外加 <= 上界以便走索引"""
+        columns = [getattr(Image, attr) for attr in ListingService.CURSOR_KEYS[sort_key]]
+        clause = columns[-1] < values[-1]
+        for col, val in zip(reversed(columns[:-1]), reversed(values[:-1])):
+            clause = or_(col < val, and_(col == val, clause))
+        return and_(columns[0] <= values[0], clause)
+
+    @staticmethod
+    def paginate_cursor(query, sort_by, cursor, per_page, seed=None):
+        """
+        Keyset 分页：WHERE (排序键) < 游标 ORDER BY ... LIMIT per_page + 1
+        不执行 COUNT，多取一条用于判断 has_next
+        """
+        sort_key = ListingService._cursor_sort(sort_by)
+        if cursor:
+            seed = ListingService.decode_cursor(cursor, sort_key)[1] or seed
+
+        rows = list(ListingService.iter_cursor_rows(query, sort_key, cursor, per_page + 1, seed=seed))
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        next_cursor = ListingService.encode_cursor(sort_key, items[-1], seed=seed) if has_next and items else None
+        return KeysetPagination(items, per_page, has_next, next_cursor=next_cursor, cursor=cursor)
+
+    @staticmethod
+    def stream(query, sort_by, per_page, page=1, cursor=None, q='', seed=None, batch_size=500, counter=None):
+        """
+        流式读取一页（大页面 API 使用）。cursor 会先行校验，无效时抛出 CursorError。
+        返回 StreamingPage，迭代 iter_items() 获取记录
+        """
+        if cursor:
+            sort_key = ListingService._cursor_sort(sort_by)
+            seed = ListingService.decode_cursor(cursor, sort_key)[1] or seed
+            return StreamingPage(query, sort_key, per_page, cursor=cursor, seed=seed, batch_size=batch_size)
+        return StreamingPage(query, sort_by, per_page, page=page, q=q, seed=seed, batch_size=batch_size,
+                             counter=counter)
+
+    @staticmethod
+    def _rows(query, batch_size):
+        """batch_size 为空时一次取回，否则按批流式读取（PostgreSQL 上为服务端游标）"""
+        return query.yield_per(batch_size) if batch_size else query
+
+    @staticmethod
+    def iter_page_rows(query, sort_by, page, per_page, q='', seed=None, batch_size=500, limit=None):
+        """按页码顺序逐条产出记录，与 paginate() 的结果一致；limit 默认为 per_page"""
+        offset = (page - 1) * per_page
+        limit = limit or per_page
+        if sort_by != 'random':
+            sorted_query = ListingService.apply_sort(query, sort_by, q).offset(offset).limit(limit)
+            yield from ListingService._rows(sorted_query, batch_size)
+            return
+
+        head, tail = ListingService.random_segments(query, ListingService.random_start(seed))
+        count = 0
+        for row in ListingService._rows(head.offset(offset).limit(limit), batch_size):
+            count += 1
+            yield row
+        if count == limit:
+            return
+        if count:
+            tail = tail.limit(limit - count)
+        else:
+            head_count = head.order_by(None).count()
+            tail = tail.offset(max(offset - head_count, 0)).limit(limit)
+        yield from ListingService._rows(tail, batch_size)
+
+    @staticmethod
+    def iter_cursor_rows(query, sort_by, cursor, limit, seed=None, batch_size=None):
+        """游标之后的最多 limit 条记录（调用方多取一条判断 has_next）"""
+        sort_key = ListingService._cursor_sort(sort_by)
+        values = None
+        if cursor:
+            values, cursor_seed = ListingService.decode_cursor(cursor, sort_key)
+            seed = cursor_seed or seed
+
+        if sort_key == 'random':
+            yield from ListingService._random_after(query, seed, values, limit, batch_size)
+            return
+        if sort_key == 'trending':
+            query = ListingService.apply_sort(query, sort_key)
+            if values:
+                query = query.filter(TrendingRank.rank > values[0])
+            yield from ListingService._rows(query.limit(limit), batch_size)
+            return
+        if values:
+            query = query.filter(ListingService._after_clause(sort_key, values))
+        yield from ListingService._rows(ListingService.apply_sort(query, sort_key).limit(limit), batch_size)
+
+    @staticmethod
+    def _random_after(query, seed, values, limit, batch_size=None):
+        """seed 随机排序的 keyset 读取：前段 random_key >= start，之后回绕到后段"""
+        start = ListingService.random_start(seed)
+        order = (Image.random_key.asc(), Image.id.asc())
+        phase, key, last_id = values if values else (0, None, None)
+
+        def after(q):
+            if key is None:
+                return q
+            return q.filter(Image.random_key >= key,
+                            or_(Image.random_key > key, Image.id > last_id))
+
+        count = 0
+        if phase == 0:
+            head = after(query.filter(Image.random_key >= start))
+            for row in ListingService._rows(head.order_by(*order).limit(limit), batch_size):
+                count += 1
+                yield row
+            key = None  # 进入后段时从头开始
+        if count < limit:
+            tail = after(query.filter(Image.random_key < start))
+            yield from ListingService._rows(tail.order_by(*order).limit(limit - count), batch_size)
+
+    @staticmethod
+    def backfill_heat_scores():
+        """
+        为 heat_score 为 NULL 的历史作品按计数补齐热度（hot 排序与游标依赖该列非空），返回处理条数。
+        NULL 在 ORDER BY 中的位置因数据库而异，也无法写入游标，翻页会中途失败
+        """
+        score = func.coalesce(Image.views_count, 0) * StatsService.VIEW_WEIGHT + \
+            func.coalesce(Image.copies_count, 0) * StatsService.COPY_WEIGHT
+        count = Image.query.filter(Image.heat_score.is_(None)) \
+            .update({Image.heat_score: score}, synchronize_session=False)
+        if count:
+            CatalogVersionService.bump()
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def backfill_random_keys(batch_size=1000):
+        """为缺少 random_key 的历史作品补齐随机键，返回处理条数"""
+        count = 0
+        while True:
+            ids = [i for (i,) in db.session.query(Image.id).filter(Image.random_key.is_(None)).limit(batch_size)]
+            if not ids:
+                break
+            db.session.bulk_update_mappings(Image, [{'id': i, 'random_key': random.random()} for i in ids])
+            db.session.commit()
+            count += len(ids)
+        return count
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from flask import current_app
+from services.related_service import RelatedService
+from services.trending_service import TrendingService
+
+
+class MaintenanceService:
+    """
+    后台维护线程：每个进程一个，按 CHECK_INTERVAL 检查趋势排行重建与相关作品增量刷新。
+    - 与浏览 / 复制计数的刷写线程（StatsService）分开：没有埋点请求的 worker 也会在上传、编辑、删除之后刷新
+    - 线程在进程处理第一个请求时启动（gunicorn fork 之后），命令行进程不会启动
+    - 各任务通过 SystemSetting.claim 抢占执行权，多个 worker 同一时间只有一个执行；
+      TRENDING_REBUILD_INTERVAL / RELATED_REFRESH_INTERVAL <= 0 时关闭对应任务（改由 flask 命令定时执行）
+    """
+
+    CHECK_INTERVAL = 10  # 秒
+
+    _lock = threading.Lock()
+    _app = None
+    _pid = None
+
+    @staticmethod
+    def init_app(app):
+        app.before_request(MaintenanceService.ensure_started)
+
+    @staticmethod
+    def ensure_started():
+        """每个进程懒启动一次维护线程（before_request 中调用，只比较 pid）"""
+        pid = os.getpid()
+        if MaintenanceService._pid == pid:
+            return
+        with MaintenanceService._lock:
+            if MaintenanceService._pid == pid:
+                return
+            MaintenanceService._pid = pid
+            app = current_app._get_current_object()
+            config = app.config
+            if config.get('TRENDING_REBUILD_INTERVAL', 600) <= 0 and config.get('RELATED_REFRESH_INTERVAL', 300) <= 0:
+                return
+            MaintenanceService._app = app
+            thread = threading.Thread(target=MaintenanceService._run, name='maintenance', daemon=True)
+            thread.start()
+
+    @staticmethod
+    def _run():
+        while True:
+            time.sleep(MaintenanceService.CHECK_INTERVAL)
+            MaintenanceService.run_once()
+
+    @staticmethod
+    def run_once():
+        app = MaintenanceService._app
+        try:
+            with app.app_context():
+                TrendingService.maybe_rebuild()
+        except Exception as e:
+            app.logger.warning(f"Trending rebuild failed: {e}")
+        try:
+            with app.app_context():
+                RelatedService.maybe_refresh()
+        except Exception as e:
+            app.logger.warning(f"Related images refresh failed: {e}")
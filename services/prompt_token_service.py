@@ -0,0 +1,187 @@
+import re
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import Image, PromptToken, image_prompt_tokens
+
+_VARIABLE_RE = re.compile(r'\{\{.*?\}\}')  # 模板变量 {{name}}，不是词元
+_NETWORK_RE = re.compile(r'<\s*(lora|lyco|hypernet)\s*:\s*([^:>]+)(?::[^>]*)?>', re.IGNORECASE)
+_NAI_WEIGHT_RE = re.compile(r'-?\d+(?:\.\d+)?::|::')  # NovelAI 4 的 1.2::token:: 写法
+_SPLIT_RE = re.compile(r'[,，\n|]|\bBREAK\b')
+_WEIGHT_RE = re.compile(r':\s*-?\d+(?:\.\d+)?\s*$')
+_BRACKETS = str.maketrans('', '', '()[]{}')
+_SPACES_RE = re.compile(r'\s+')
+
+
+class PromptTokenService:
+    """
+    Prompt 词元索引：
+    SD / NAI 的 Prompt 是逗号分隔的词元列表，写入时解析为规范化词元（去掉 (x:1.2) / [x] / {x} 等权重语法，
+    小写，下划线视同空格），存入 prompt_token 与关联表 image_prompt_tokens。
+    - 列表 API 的 token= 过滤通过关联表的 (token_id, image_id) 索引完成，不再对 prompt 做 LIKE 扫描
+    - prompt_token.image_count 增量维护词元频次，共现统计按关联表自连接计算
+    """
+
+    MAX_LENGTH = 100
+
+    @staticmethod
+    def normalize(raw):
+        """单个词元的规范化形式，无效时返回空字符串"""
+        # 转义的括号是词元本身的一部分，如 ganyu \\(genshin impact\\)
+        text = (raw or '').replace('\\(', '\x01').replace('\\)', '\x02')
+        text = _WEIGHT_RE.sub('', text.translate(_BRACKETS).strip())
+        text = text.replace('\x01', '(').replace('\x02', ')').replace('_', ' ')
+        text = _SPACES_RE.sub(' ', text).strip().lower()
+        if not text or text.replace('.', '').isdigit() or len(text) > PromptTokenService.MAX_LENGTH:
+            return ''
+        return text
+
+    @staticmethod
+    def parse(prompt):
+        """Prompt -> 去重后的规范化词元列表（保持出现顺序）；LoRA 等网络记为 lora:<名称>"""
+        if not prompt:
+            return []
+        text = _VARIABLE_RE.sub(',', prompt)
+        text = _NETWORK_RE.sub(lambda m: f',{m.group(1).lower()}:{m.group(2).strip()},', text)
+        text = _NAI_WEIGHT_RE.sub('', text)
+        tokens = (PromptTokenService.normalize(part) for part in _SPLIT_RE.split(text))
+        return list(dict.fromkeys(t for t in tokens if t))
+
+    @staticmethod
+    def _get_or_create(names):
+        existing = {t.name: t for t in PromptToken.query.filter(PromptToken.name.in_(names))} if names else {}
+        for name in names:
+            if name in existing:
+                continue
+            try:
+                with db.session.begin_nested():
+                    token = PromptToken(name=name, image_count=0)
+                    db.session.add(token)
+            except IntegrityError:
+                # 并发上传抢先插入了同一词元，改为读取对方的行
+                token = PromptToken.query.filter_by(name=name).one()
+            existing[name] = token
+        return [existing[name] for name in names]
+
+    @staticmethod
+    def _adjust(tokens, diff):
+        """原子增减词元的作品数"""
+        ids = [t.id for t in tokens]
+        if ids:
+            PromptToken.query.filter(PromptToken.id.in_(ids)) \
+                .update({PromptToken.image_count: PromptToken.image_count + diff}, synchronize_session=False)
+
+    @staticmethod
+    def index_image(image):
+        """写入路径调用：按当前 prompt 同步作品的词元（随调用方事务提交）"""
+        names = PromptTokenService.parse(image.prompt)
+        current = list(image.prompt_tokens)
+        if {t.name for t in current} == set(names):
+            return
+        tokens = PromptTokenService._get_or_create(names)
+        kept = {t.name for t in current} & set(names)
+        PromptTokenService._adjust([t for t in current if t.name not in kept], -1)
+        PromptTokenService._adjust([t for t in tokens if t.name not in kept], 1)
+        image.prompt_tokens = tokens
+
+    @staticmethod
+    def release(image):
+        """删除作品前调用：扣减其词元的作品数（关联行随作品一起删除）"""
+        PromptTokenService._adjust(list(image.prompt_tokens), -1)
+
+    @staticmethod
+    def lookup_names(raw):
+        """
+        查询参数对应的候选词元名：按 Prompt 语法规范化的结果在前，其次是原样（小写）形式——
+        后者用于直接传入已规范化、本身带括号的词元，如 ganyu (genshin impact)
+        """
+        literal = _SPACES_RE.sub(' ', (raw or '').replace('_', ' ')).strip().lower()
+        names = (PromptTokenService.normalize(raw), literal)
+        return list(dict.fromkeys(n for n in names if n and len(n) <= PromptTokenService.MAX_LENGTH))
+
+    @staticmethod
+    def filter_query(query, names):
+        """列表过滤：prompt 中含有该词元的作品（names 为 lookup_names() 的结果，按词元索引反查作品 id）"""
+        matched = select(image_prompt_tokens.c.image_id) \
+            .join(PromptToken, PromptToken.id == image_prompt_tokens.c.token_id) \
+            .where(PromptToken.name.in_(names))
+        return query.filter(Image.id.in_(matched))
+
+    @staticmethod
+    def reindex(only_missing=False, batch_size=500):
+        """回填 / 重建词元索引，返回处理条数；全量重建时最后校正频次并清理无引用的词元"""
+        query = Image.query
+        if only_missing:
+            query = query.filter(Image.prompt.isnot(None), Image.prompt != '', ~Image.prompt_tokens.any())
+
+        count = 0
+        last_id = 0
+        while True:
+            batch = query.filter(Image.id > last_id).order_by(Image.id).limit(batch_size).all()
+            if not batch:
+                break
+            for image in batch:
+                PromptTokenService.index_image(image)
+            db.session.commit()
+            count += len(batch)
+            last_id = batch[-1].id
+
+        if not only_missing:
+            counts = select(func.count()).where(image_prompt_tokens.c.token_id == PromptToken.id) \
+                .scalar_subquery()
+            PromptToken.query.update({PromptToken.image_count: counts}, synchronize_session=False)
+            PromptToken.query.filter(PromptToken.image_count <= 0).delete(synchronize_session=False)
+            db.session.commit()
+        return count
+
+    @staticmethod
+    def _approved_links(category=None):
+        """已发布作品的 (image_id, token_id) 关联，可按分类过滤"""
+        links = select(image_prompt_tokens.c.image_id, image_prompt_tokens.c.token_id) \
+            .join(Image, Image.id == image_prompt_tokens.c.image_id) \
+            .where(Image.status == 'approved')
+        if category:
+            links = links.where(Image.category == category)
+        return links.subquery()
+
+    @staticmethod
+    def frequency(limit=50, category=None):
+        """词元频次：已发布作品中使用最多的词元 [{'token', 'count'}]"""
+        links = PromptTokenService._approved_links(category)
+        rows = db.session.query(PromptToken.name, func.count(links.c.image_id).label('n')) \
+            .join(links, links.c.token_id == PromptToken.id) \
+            .group_by(PromptToken.id, PromptToken.name) \
+            .order_by(func.count(links.c.image_id).desc(), PromptToken.name) \
+            .limit(limit).all()
+        return [{'token': name, 'count': n} for name, n in rows]
+
+    @staticmethod
+    def cooccurrence(raw_token, limit=50, category=None):
+        """
+        词元共现：dict(token, count=含有该词元的已发布作品数, related=[{'token', 'count', 'ratio'}])
+        related.count 为同时含有两者的作品数，ratio = related.count / count
+        """
+        found = db.session.query(PromptToken.id, PromptToken.name) \
+            .filter(PromptToken.name.in_(PromptTokenService.lookup_names(raw_token))) \
+            .order_by(PromptToken.image_count.desc()).first()
+        if found is None:
+            return {'token': PromptTokenService.normalize(raw_token), 'count': 0, 'related': []}
+        token_id, name = found
+
+        links = PromptTokenService._approved_links(category)
+        other = aliased(image_prompt_tokens)
+        total = db.session.query(func.count()).select_from(links).filter(links.c.token_id == token_id).scalar()
+        rows = db.session.query(PromptToken.name, func.count().label('n')) \
+            .select_from(links) \
+            .join(other, other.c.image_id == links.c.image_id) \
+            .join(PromptToken, PromptToken.id == other.c.token_id) \
+            .filter(links.c.token_id == token_id, other.c.token_id != token_id) \
+            .group_by(PromptToken.id, PromptToken.name) \
+            .order_by(func.count().desc(), PromptToken.name) \
+            .limit(limit).all()
+        return {
+            'token': name,
+            'count': total,
+            'related': [{'token': n, 'count': c, 'ratio': round(c / total, 4) if total else 0} for n, c in rows],
+        }
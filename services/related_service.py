@@ -0,0 +1,283 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from flask import current_app
+from sqlalchemy import func
+from extensions import db
+from models import Image, ImageChange, ImageNeighbor, PromptToken, SystemSetting, image_prompt_tokens, image_tags
+from services.change_service import ChangeService
+
+
+class RelatedService:
+    """
+    相关作品（弹窗中的“相似作品”）：
+    - 相似度 = RELATED_TAG_WEIGHT × 标签 Jaccard + (1 - RELATED_TAG_WEIGHT) × Prompt 词元 TF-IDF 余弦，只在同分类的已发布作品间计算
+    - 向量按稀疏字典表示，通过倒排表（标签 -> 作品、词元 -> (作品, 权重)）累加交集与点积，
+      只访问与当前作品至少共享一个标签或词元的作品；出现在超过 RELATED_MAX_DF 比例作品中的词元视为停用词
+    - 结果写入 image_neighbor（每个作品前 RELATED_TOP_K 个），/api/images/<id>/related 按主键一次读取
+    - 增量刷新：只重算变更日志中上次刷新之后变化过的作品，以及列表中包含它们的作品；
+      其余作品把变化作品的新分数合并进已有列表（相似度对称，不需要重算）。
+      只读取重算作品及其邻域的标签 / 词元（按关联表索引反查），不随作品总数增长；
+      IDF 只在重算时更新，整体漂移可用 flask rebuild-related --full 修正（只有全量重建读取全部作品）
+    """
+
+    SEQ_KEY = 'related_seq'             # 已处理到的变更序号
+    REFRESH_KEY = 'related_refreshed_at'
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def _config():
+        config = current_app.config
+        return (max(int(config.get('RELATED_TOP_K', 12)), 1),
+                min(max(float(config.get('RELATED_TAG_WEIGHT', 0.5)), 0.0), 1.0),
+                float(config.get('RELATED_MAX_DF', 0.3)))
+
+    @staticmethod
+    def _rows(query, column, ids=None):
+        """ids 为 None 时流式读取整个查询，否则分批限定 column IN ids"""
+        if ids is None:
+            yield from query.yield_per(5000)
+            return
+        for chunk in RelatedService._chunks(ids):
+            yield from query.filter(column.in_(chunk))
+
+    @staticmethod
+    def _neighbourhood(seeds, df_limit):
+        """seeds 以及与其共享至少一个标签或（非停用）词元的作品 id"""
+        links = image_prompt_tokens.c
+        tag_ids = {t for (t,) in RelatedService._rows(
+            db.session.query(image_tags.c.tag_id).distinct(), image_tags.c.image_id, seeds)}
+        token_ids = {t for (t,) in RelatedService._rows(
+            db.session.query(links.token_id).join(PromptToken, PromptToken.id == links.token_id)
+            .filter(PromptToken.image_count <= df_limit).distinct(), links.image_id, seeds)}
+
+        members = set(seeds)
+        members.update(i for (i,) in RelatedService._rows(
+            db.session.query(image_tags.c.image_id).distinct(), image_tags.c.tag_id, tag_ids))
+        members.update(i for (i,) in RelatedService._rows(
+            db.session.query(links.image_id).distinct(), links.token_id, token_ids))
+        return members
+
+    @staticmethod
+    def load_corpus(max_df, seeds=None):
+        """
+        构建已发布作品的稀疏向量与倒排表。词元取自 prompt_token（与 token= 过滤相同），
+        文档频率直接用 prompt_token.image_count，不需要扫描全部 Prompt
+        :param seeds: None 时读取全部作品；否则只读取 seeds 及与其共享标签 / 词元的作品，
+                      对 seeds 中的作品 scores() 的结果与读取全部作品时相同
+        :return: dict(category, tags, vectors, tag_postings, term_postings)
+        """
+        total = db.session.query(func.count(Image.id)).scalar() or 0
+        df_limit = max(total * max_df, 2)
+        approved = db.session.query(Image.id, Image.category).filter(Image.status == 'approved')
+
+        members = None
+        if seeds is not None:
+            seeds = {i for i, _ in RelatedService._rows(approved, Image.id, seeds)}
+            members = RelatedService._neighbourhood(seeds, df_limit)
+        category = {i: cat or 'gallery' for i, cat in RelatedService._rows(approved, Image.id, members)}
+
+        tags = defaultdict(set)
+        tag_postings = defaultdict(list)
+        rows = db.session.query(image_tags.c.image_id, image_tags.c.tag_id) \
+            .join(Image, Image.id == image_tags.c.image_id).filter(Image.status == 'approved')
+        for image_id, tag_id in RelatedService._rows(rows, image_tags.c.image_id, members):
+            if tag_id not in tags[image_id]:
+                tags[image_id].add(tag_id)
+                tag_postings[tag_id].append(image_id)
+
+        # 词元在 Prompt 中已去重，权重只取 IDF；出现在超过 max_df 比例作品中的词元视为停用词
+        weights = defaultdict(dict)
+        links = image_prompt_tokens.c
+        rows = db.session.query(links.image_id, links.token_id, PromptToken.image_count) \
+            .join(PromptToken, PromptToken.id == links.token_id) \
+            .filter(PromptToken.image_count <= df_limit)
+        for image_id, token_id, n in RelatedService._rows(rows, links.image_id, members):
+            if image_id in category:
+                weights[image_id][token_id] = math.log((total + 1) / (n + 1)) + 1
+
+        vectors = {}
+        term_postings = defaultdict(list)
+        for image_id in category:
+            vec = weights.get(image_id, {})
+            norm = math.sqrt(sum(w * w for w in vec.values()))
+            if norm:
+                vec = {t: w / norm for t, w in vec.items()}
+                for t, w in vec.items():
+                    term_postings[t].append((image_id, w))
+            vectors[image_id] = vec
+
+        return {'category': category, 'tags': tags, 'vectors': vectors,
+                'tag_postings': tag_postings, 'term_postings': term_postings}
+
+    @staticmethod
+    def scores(image_id, corpus, tag_weight):
+        """image_id 与同分类其他作品的相似度 {id: score}（只含分数大于 0 的作品）"""
+        category = corpus['category']
+        own_tags = corpus['tags'].get(image_id, ())
+        overlap = Counter()
+        for tag_id in own_tags:
+            overlap.update(corpus['tag_postings'][tag_id])
+
+        dots = defaultdict(float)
+        for term, weight in corpus['vectors'].get(image_id, {}).items():
+            for other, other_weight in corpus['term_postings'][term]:
+                dots[other] += weight * other_weight
+
+        own_category = category[image_id]
+        result = {}
+        for other in overlap.keys() | dots.keys():
+            if other == image_id or category[other] != own_category:
+                continue
+            shared = overlap.get(other, 0)
+            jaccard = shared / (len(own_tags) + len(corpus['tags'].get(other, ())) - shared) if shared else 0.0
+            score = tag_weight * jaccard + (1 - tag_weight) * min(dots.get(other, 0.0), 1.0)
+            if score > 0:
+                result[other] = round(score, 4)
+        return result
+
+    @staticmethod
+    def top(scores, k):
+        """分数最高的 k 个 [(id, score)]，同分时 id 大（较新）的在前"""
+        return [(i, s) for s, i in heapq.nlargest(k, ((s, i) for i, s in scores.items()))]
+
+    @staticmethod
+    def _chunks(ids):
+        ids = sorted(ids)
+        for start in range(0, len(ids), RelatedService.BATCH_SIZE):
+            yield ids[start:start + RelatedService.BATCH_SIZE]
+
+    @staticmethod
+    def _stored(ids):
+        """已有列表 {id: {neighbor_id: score}}"""
+        stored = defaultdict(dict)
+        for chunk in RelatedService._chunks(ids):
+            rows = db.session.query(ImageNeighbor.image_id, ImageNeighbor.neighbor_id, ImageNeighbor.score) \
+                .filter(ImageNeighbor.image_id.in_(chunk))
+            for image_id, neighbor_id, score in rows:
+                stored[image_id][neighbor_id] = score
+        return stored
+
+    @staticmethod
+    def _write(lists, removed=()):
+        """替换 lists 中作品的邻居行，并删除 removed 作品的行"""
+        for chunk in RelatedService._chunks(set(lists) | set(removed)):
+            db.session.query(ImageNeighbor).filter(ImageNeighbor.image_id.in_(chunk)) \
+                .delete(synchronize_session=False)
+        rows = [{'image_id': image_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+                for image_id, neighbors in lists.items()
+                for rank, (neighbor_id, score) in enumerate(neighbors, start=1)]
+        for start in range(0, len(rows), 5000):
+            db.session.execute(ImageNeighbor.__table__.insert(), rows[start:start + 5000])
+
+    @staticmethod
+    def release(image_ids):
+        """
+        删除作品前调用：清理其邻居列表以及其他列表中指向它的行（SQLite 不执行外键的 ON DELETE CASCADE，
+        随调用方事务提交）。其他列表因此少一项，直到这些作品下次重算或全量重建
+        """
+        ids = list(image_ids)
+        if not ids:
+            return
+        db.session.query(ImageNeighbor) \
+            .filter(ImageNeighbor.image_id.in_(ids) | ImageNeighbor.neighbor_id.in_(ids)) \
+            .delete(synchronize_session=False)
+
+    @staticmethod
+    def refresh(full=False):
+        """
+        刷新相关作品表（首次运行或 full=True 时全量重建）
+        :return: dict(recomputed=整体重算的作品数, merged=合并更新的作品数, removed=移除的作品数)
+        """
+        k, tag_weight, max_df = RelatedService._config()
+        last_seq = SystemSetting.get_int(RelatedService.SEQ_KEY, -1)
+        # 先读序号再读数据：计算期间的新变更序号更大，留给下一轮
+        seq = ChangeService.latest_seq()
+        full = full or last_seq < 0
+        if not full and seq == last_seq:
+            return {'recomputed': 0, 'merged': 0, 'removed': 0}
+
+        try:
+            if full:
+                corpus = RelatedService.load_corpus(max_df)
+                visible = corpus['category']
+                db.session.query(ImageNeighbor).delete(synchronize_session=False)
+                lists = {i: RelatedService.top(RelatedService.scores(i, corpus, tag_weight), k) for i in visible}
+                RelatedService._write(lists)
+                result = {'recomputed': len(lists), 'merged': 0, 'removed': 0}
+            else:
+                touched = {i for (i,) in db.session.query(ImageChange.image_id)
+                           .filter(ImageChange.seq > last_seq).distinct()}
+                # 列表中含有变化作品的，其排名可能整体变化，直接重算
+                recompute = set(touched)
+                for chunk in RelatedService._chunks(touched):
+                    recompute.update(i for (i,) in db.session.query(ImageNeighbor.image_id)
+                                     .filter(ImageNeighbor.neighbor_id.in_(chunk)).distinct())
+
+                # 只读取需要重算的作品及其邻域，不加载全部作品
+                corpus = RelatedService.load_corpus(max_df, seeds=recompute)
+                visible = corpus['category']
+                removed = touched - visible.keys()
+                recompute &= visible.keys()
+
+                lists, offers = {}, defaultdict(dict)
+                for image_id in recompute:
+                    scores = RelatedService.scores(image_id, corpus, tag_weight)
+                    lists[image_id] = RelatedService.top(scores, k)
+                    if image_id in touched:
+                        for other, score in scores.items():
+                            if other not in recompute:
+                                offers[other][image_id] = score
+
+                # 其余作品：已有列表不含变化作品，只需把变化作品的新分数并入
+                merged = 0
+                stored = RelatedService._stored(offers)
+                for image_id, candidates in offers.items():
+                    current = stored.get(image_id, {})
+                    floor = min(current.values()) if len(current) >= k else 0
+                    if not any(score > floor for score in candidates.values()):
+                        continue
+                    lists[image_id] = RelatedService.top({**current, **candidates}, k)
+                    merged += 1
+
+                RelatedService._write(lists, removed)
+                result = {'recomputed': len(recompute), 'merged': merged, 'removed': len(removed)}
+
+            SystemSetting.set_int(RelatedService.SEQ_KEY, seq)  # 与邻居表一起提交
+        except Exception:
+            db.session.rollback()
+            raise
+        return result
+
+    @staticmethod
+    def maybe_refresh():
+        """
+        后台维护线程（MaintenanceService）调用：有新变更且距上次刷新超过 RELATED_REFRESH_INTERVAL 时增量刷新。
+        RELATED_REFRESH_INTERVAL <= 0 时不在 Web 进程中刷新（改由 flask rebuild-related 定时执行）
+        """
+        interval = current_app.config.get('RELATED_REFRESH_INTERVAL', 300)
+        if interval <= 0:
+            return False
+        if ChangeService.latest_seq() == SystemSetting.get_int(RelatedService.SEQ_KEY, -1):
+            db.session.rollback()
+            return False
+        if not SystemSetting.claim(RelatedService.REFRESH_KEY, interval):
+            return False
+        RelatedService.refresh()
+        return True
+
+    @staticmethod
+    def related(image_id, limit, show_sensitive=False):
+        """读取相关作品（卡片字段 + score），按相似度排序，过滤不可见作品"""
+        query = db.session.query(Image, ImageNeighbor.score) \
+            .join(ImageNeighbor, ImageNeighbor.neighbor_id == Image.id) \
+            .options(*Image.grid_options()) \
+            .filter(ImageNeighbor.image_id == image_id, Image.status == 'approved')
+        if not show_sensitive:
+            query = query.filter(Image.is_sensitive == False)
+        rows = query.order_by(ImageNeighbor.rank).limit(limit).all()
+
+        items = Image.bulk_to_dict([image for image, _ in rows], fields=Image.GRID_FIELDS)
+        for item, (_, score) in zip(items, rows):
+            item['score'] = score
+        return items
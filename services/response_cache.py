@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from flask import current_app
+
+
+class ResponseCache:
+    """
+    跨 worker 共享的结果缓存，存放在本地 SQLite 文件中（WAL 模式，无需外部服务）：
+    - TTL 过期 + LRU 淘汰（条目数超过 RESPONSE_CACHE_MAX_ENTRIES 时按最近访问时间清理）
+    - single-flight：同一 key 未命中时只有一个请求执行计算，其余请求（含其他 worker）等待其结果
+    - 写入路径提交后由 CatalogVersionService 触发 invalidate()，key 本身也带目录版本号，不会读到旧数据
+    缓存不可用时直接回退为实时计算，不影响请求。
+    """
+
+    LOCK_TIMEOUT = 10  # 秒；填充方超过该时间未完成，等待方自行计算
+    POLL_INTERVAL = 0.05
+    EVICT_PROBABILITY = 0.05  # 写入时按概率触发过期 / LRU 清理
+
+    _local = threading.local()
+
+    @staticmethod
+    def enabled():
+        return current_app.config.get('RESPONSE_CACHE_ENABLED', True)
+
+    @staticmethod
+    def _path():
+        return current_app.config.get('RESPONSE_CACHE_PATH') or \
+            os.path.join(current_app.instance_path, 'response_cache.sqlite')
+
+    @staticmethod
+    def _conn():
+        """每个线程一条连接（sqlite3 连接不可跨线程共享）"""
+        path = ResponseCache._path()
+        conns = getattr(ResponseCache._local, 'conns', None)
+        if conns is None:
+            conns = ResponseCache._local.conns = {}
+        conn = conns.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed ON cache_entry (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_fill (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            conns[path] = conn
+        return conn
+
+    @staticmethod
+    def get(key):
+        """命中返回字符串，未命中或已过期返回 None"""
+        conn = ResponseCache._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache_entry WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        if now - row[2] > 1:
+            # 访问时间只需粗粒度，避免每次命中都写库
+            conn.execute("UPDATE cache_entry SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    @staticmethod
+    def get_many(keys, batch_size=500):
+        """批量读取，返回 {key: value}（只含命中的条目）；缓存不可用时返回空字典"""
+        if not ResponseCache.enabled() or not keys:
+            return {}
+        try:
+            conn = ResponseCache._conn()
+            now = time.time()
+            found = {}
+            keys = list(keys)
+            for start in range(0, len(keys), batch_size):
+                chunk = keys[start:start + batch_size]
+                placeholders = ', '.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, value FROM cache_entry WHERE key IN ({placeholders}) AND expires_at > ?",
+                    (*chunk, now)
+                ).fetchall()
+                found.update(rows)
+            return found
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Response cache unavailable: {e}")
+            return {}
+
+    @staticmethod
+    def set_many(items, ttl=None):
+        """批量写入 {key: value}，失败时忽略"""
+        if not ResponseCache.enabled() or not items:
+            return
+        try:
+            conn = ResponseCache._conn()
+            now = time.time()
+            ttl = ttl or current_app.config.get('RESPONSE_CACHE_TTL', 60)
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache_entry (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, value, now + ttl, now) for key, value in items.items()]
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            if random.random() < ResponseCache.EVICT_PROBABILITY:
+                ResponseCache.evict()
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Response cache write failed: {e}")
+
+    @staticmethod
+    def set(key, value, ttl=None):
+        conn = ResponseCache._conn()
+        now = time.time()
+        ttl = ttl or current_app.config.get('RESPONSE_CACHE_TTL', 60)
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl, now)
+        )
+        if random.random() < ResponseCache.EVICT_PROBABILITY:
+            ResponseCache.evict()
+
+    @staticmethod
+    def evict():
+        """清理过期条目，并把条目数压回上限以内（淘汰最久未访问的）"""
+        conn = ResponseCache._conn()
+        max_entries = current_app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 2000)
+        conn.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache_entry WHERE key IN ("
+            "SELECT key FROM cache_entry ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        )
+
+    @staticmethod
+    def invalidate(scopes=None):
+        """按作用域前缀删除条目（key 形如 '<kind>:<scope>:<hash>'）；不传则清空"""
+        if not ResponseCache.enabled():
+            return
+        try:
+            conn = ResponseCache._conn()
+            if scopes is None:
+                conn.execute("DELETE FROM cache_entry")
+                return
+            for scope in scopes:
+                conn.execute("DELETE FROM cache_entry WHERE key LIKE ?", (f'%:{scope}:%',))
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Response cache invalidate failed: {e}")
+
+    @staticmethod
+    def _try_acquire(key):
+        conn = ResponseCache._conn()
+        now = time.time()
+        conn.execute("DELETE FROM cache_fill WHERE key = ? AND expires_at <= ?", (key, now))
+        cur = conn.execute("INSERT OR IGNORE INTO cache_fill (key, expires_at) VALUES (?, ?)",
+                           (key, now + ResponseCache.LOCK_TIMEOUT))
+        return cur.rowcount == 1
+
+    @staticmethod
+    def _release(key):
+        ResponseCache._conn().execute("DELETE FROM cache_fill WHERE key = ?", (key,))
+
+    @staticmethod
+    def _filling(key):
+        row = ResponseCache._conn().execute("SELECT expires_at FROM cache_fill WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    @staticmethod
+    def get_or_fill(key, compute, ttl=None):
+        """
+        读取缓存，未命中时计算并写入。compute() 必须返回字符串（或 bytes，如 MessagePack 响应体）。
+        同一 key 的并发未命中只会有一个请求执行 compute()，其余轮询等待结果。
+        """
+        if not ResponseCache.enabled():
+            return compute()
+
+        try:
+            value = ResponseCache.get(key)
+            if value is not None:
+                return value
+
+            if not ResponseCache._try_acquire(key):
+                deadline = time.time() + ResponseCache.LOCK_TIMEOUT
+                while time.time() < deadline:
+                    time.sleep(ResponseCache.POLL_INTERVAL)
+                    value = ResponseCache.get(key)
+                    if value is not None:
+                        return value
+                    if not ResponseCache._filling(key):
+                        value = ResponseCache.get(key)
+                        if value is not None:
+                            return value
+                        break
+                # 填充方失败或超时：自行计算
+                return compute()
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Response cache unavailable: {e}")
+            return compute()
+
+        try:
+            value = compute()
+            try:
+                ResponseCache.set(key, value, ttl)
+            except sqlite3.Error as e:
+                current_app.logger.warning(f"Response cache write failed: {e}")
+            return value
+        finally:
+            try:
+                ResponseCache._release(key)
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def get_or_fill_json(key, compute, ttl=None):
+        """get_or_fill 的 JSON 版本：compute() 返回可 JSON 序列化的对象"""
+        raw = ResponseCache.get_or_fill(key, lambda: json.dumps(compute(), ensure_ascii=False), ttl)
+        return json.loads(raw)
@@ -0,0 +1,219 @@
+import re
+from flask import current_app
+from sqlalchemy import text, Float, Integer, inspect as sa_inspect
+from extensions import db
+from models import Image, SystemSetting
+from services.catalog_version_service import CatalogVersionService
+
+# 中日韩字符范围：这些文字没有空格分词，按 1-gram + 2-gram 切分
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_WORD_RE = re.compile(r'[^\W_]+')
+_CJK_SPLIT_RE = re.compile(f'([{_CJK_CHARS}]+)')
+_CJK_RUN_RE = re.compile(f'^[{_CJK_CHARS}]+$')
+
+# 搜索子查询别名，relevance 排序通过它引用 rank 列
+HITS_ALIAS = 'search_hits'
+
+# search_text 中标题与正文的分隔符（PostgreSQL 据此给标题加 A 权重）
+_PART_SEP = ' | '
+
+
+class SearchService:
+    """
+    全文检索：
+    - PostgreSQL: image.search_vector (由 search_text 生成的 tsvector 列) + GIN 索引
+    - SQLite: image_fts (FTS5 外部内容表，触发器与 image.search_text 同步)
+    - 其他数据库或 FTS5 不可用时退回 LIKE 匹配
+    分词在 Python 侧完成（拉丁文按词、中日韩文字按单字 + 二元组），两种后端共用同一份 search_text。
+    拉丁词额外索引其后缀（长度 >= 2），查询词做前缀匹配即可命中词中任意位置，
+    与原先 LIKE '%q%' 一致：girl 命中 1girl，aster 命中 masterpiece。
+    """
+
+    DOCUMENT_VERSION = 2                    # search_text 格式版本，变化时 init-db 全量重建
+    DOCUMENT_VERSION_KEY = 'search_document_version'
+    MAX_SUFFIX_WORD = 32                    # 更长的词（多为哈希、URL 片段）不展开后缀
+
+    @staticmethod
+    def tokenize(value):
+        """文档分词：拉丁文按词切分，CJK 连续片段输出单字和相邻二元组"""
+        tokens = []
+        if not value:
+            return tokens
+        for word in _WORD_RE.findall(value.lower()):
+            for part in _CJK_SPLIT_RE.split(word):
+                if not part:
+                    continue
+                if _CJK_RUN_RE.match(part):
+                    tokens.extend(part)
+                    tokens.extend(part[i:i + 2] for i in range(len(part) - 1))
+                else:
+                    tokens.append(part)
+        return tokens
+
+    @staticmethod
+    def document_tokens(value):
+        """索引分词：tokenize() 的结果加上拉丁词的后缀（去重），使前缀查询覆盖词中子串"""
+        tokens = SearchService.tokenize(value)
+        suffixes = dict.fromkeys(
+            token[i:] for token in tokens
+            if len(token) <= SearchService.MAX_SUFFIX_WORD and not _CJK_RUN_RE.match(token)
+            for i in range(1, len(token) - 1)
+        )
+        words = set(tokens)
+        return tokens + [suffix for suffix in suffixes if suffix not in words]
+
+    @staticmethod
+    def query_terms(q):
+        """
+        查询分词，返回 (term, is_prefix) 列表。
+        CJK 片段长度 >= 2 时只用二元组（全部命中即可覆盖原串），拉丁词做前缀匹配（配合索引中的后缀即子串匹配）。
+        """
+        terms = []
+        for word in _WORD_RE.findall((q or '').lower()):
+            for part in _CJK_SPLIT_RE.split(word):
+                if not part:
+                    continue
+                if _CJK_RUN_RE.match(part):
+                    if len(part) == 1:
+                        terms.append((part, False))
+                    else:
+                        terms.extend((part[i:i + 2], False) for i in range(len(part) - 1))
+                else:
+                    terms.append((part, True))
+        return list(dict.fromkeys(terms))
+
+    @staticmethod
+    def build_document(image):
+        """search_text 格式: '<标题词元> | <作者与 Prompt 词元>'"""
+        title_tokens = ' '.join(SearchService.document_tokens(image.title))
+        body_tokens = ' '.join(SearchService.document_tokens(' '.join(v for v in (image.author, image.prompt) if v)))
+        return f"{title_tokens}{_PART_SEP}{body_tokens}"
+
+    @staticmethod
+    def index_image(image):
+        """写入路径调用：刷新 search_text（索引由数据库侧生成列 / 触发器维护）"""
+        image.search_text = SearchService.build_document(image)
+
+    @staticmethod
+    def backend():
+        return current_app.config.get('SEARCH_BACKEND', 'like')
+
+    @staticmethod
+    def ensure_search_index(app):
+        """按数据库类型创建检索结构，并记录到 app.config['SEARCH_BACKEND']"""
+        app.config['SEARCH_BACKEND'] = 'like'
+        try:
+            if not sa_inspect(db.engine).has_table('image'):
+                return
+            dialect = db.engine.dialect.name
+
+            if dialect == 'postgresql':
+                with db.engine.begin() as conn:
+                    # 词元已在 Python 侧切好，直接 array_to_tsvector，避免依赖数据库 locale 的 CJK 解析
+                    part = "array_to_tsvector(array_remove(string_to_array(split_part(coalesce(search_text, ''), " \
+                           "' | ', {n}), ' '), ''))"
+                    conn.execute(text(
+                        "ALTER TABLE image ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                        f"GENERATED ALWAYS AS (setweight({part.format(n=1)}, 'A') || {part.format(n=2)}) STORED"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_image_search_vector ON image USING GIN (search_vector)"
+                    ))
+                app.config['SEARCH_BACKEND'] = 'postgres'
+
+            elif dialect == 'sqlite':
+                with db.engine.begin() as conn:
+                    existed = conn.execute(text(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_fts'"
+                    )).first() is not None
+                    conn.execute(text(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS image_fts USING fts5("
+                        "search_text, content='image', content_rowid='id', tokenize='unicode61')"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS image_fts_ai AFTER INSERT ON image BEGIN "
+                        "INSERT INTO image_fts(rowid, search_text) VALUES (new.id, new.search_text); END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS image_fts_ad AFTER DELETE ON image BEGIN "
+                        "INSERT INTO image_fts(image_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS image_fts_au AFTER UPDATE OF search_text ON image BEGIN "
+                        "INSERT INTO image_fts(image_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+                        "INSERT INTO image_fts(rowid, search_text) VALUES (new.id, new.search_text); END"
+                    ))
+                    if not existed:
+                        # 首次创建时把已有 search_text 灌入索引
+                        conn.execute(text("INSERT INTO image_fts(image_fts) VALUES ('rebuild')"))
+                app.config['SEARCH_BACKEND'] = 'fts5'
+        except Exception as e:
+            app.logger.warning(f"Full-text search index unavailable, falling back to LIKE: {e}")
+
+    @staticmethod
+    def _hits_subquery(terms):
+        """命中子查询：(image_id, rank)，rank 越大越相关"""
+        backend = SearchService.backend()
+        if backend == 'postgres':
+            tsquery = ' & '.join(f"'{t}':*" if prefix else f"'{t}'" for t, prefix in terms)
+            stmt = text(
+                "SELECT id AS image_id, ts_rank(search_vector, CAST(:tsq AS tsquery)) AS rank "
+                "FROM image WHERE search_vector @@ CAST(:tsq AS tsquery)"
+            ).bindparams(tsq=tsquery)
+        else:
+            match = ' '.join(f'"{t}"*' if prefix else f'"{t}"' for t, prefix in terms)
+            # bm25 越小越相关，取负值统一为越大越相关
+            stmt = text(
+                "SELECT rowid AS image_id, -bm25(image_fts) AS rank "
+                "FROM image_fts WHERE image_fts MATCH :match"
+            ).bindparams(match=match)
+        return stmt.columns(image_id=Integer, rank=Float).subquery(HITS_ALIAS)
+
+    @staticmethod
+    def apply(query, q):
+        """对 Image 查询附加关键词过滤"""
+        terms = SearchService.query_terms(q)
+        if SearchService.backend() == 'like' or not terms:
+            return query.filter(
+                Image.title.contains(q) |
+                Image.prompt.contains(q) |
+                Image.author.contains(q)
+            )
+        hits = SearchService._hits_subquery(terms)
+        return query.join(hits, hits.c.image_id == Image.id)
+
+    @staticmethod
+    def rank_order(q):
+        """relevance 排序表达式；无法使用全文索引时返回 None"""
+        if SearchService.backend() == 'like' or not SearchService.query_terms(q):
+            return None
+        return text(f'{HITS_ALIAS}.rank DESC')
+
+    @staticmethod
+    def reindex(only_missing=False, batch_size=500):
+        """回填 / 重建 search_text，返回处理条数；已有文档格式落后于 DOCUMENT_VERSION 时总是全量重建"""
+        if SystemSetting.get_int(SearchService.DOCUMENT_VERSION_KEY) < SearchService.DOCUMENT_VERSION:
+            only_missing = False
+        query = Image.query
+        if only_missing:
+            query = query.filter(Image.search_text.is_(None))
+
+        count = 0
+        last_id = 0
+        while True:
+            batch = query.filter(Image.id > last_id).order_by(Image.id).limit(batch_size).all()
+            if not batch:
+                break
+            for image in batch:
+                SearchService.index_image(image)
+            db.session.commit()
+            count += len(batch)
+            last_id = batch[-1].id
+
+        if not only_missing:
+            if SearchService.backend() == 'fts5':
+                db.session.execute(text("INSERT INTO image_fts(image_fts) VALUES ('rebuild')"))
+            # 搜索结果可能变化，缓存的列表响应一并失效（set_int 随之提交）
+            CatalogVersionService.bump()
+            SystemSetting.set_int(SearchService.DOCUMENT_VERSION_KEY, SearchService.DOCUMENT_VERSION)
+        return count
@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from extensions import db
+from models import Image
+from services.change_service import ChangeService
+
+
+class SnapshotService:
+    """
+    公开目录的静态 JSON 快照（flask build-snapshot）：
+    - 已发布、非敏感的作品按 id 区间分片（每片 SNAPSHOT_SHARD_SIZE 个 id），每片写成
+      <分类>-<片号>.<内容哈希>.json 及预压缩的 .json.gz，文件名随内容变化，可被静态服务器长期缓存
+    - manifest.json 列出全部分片（按 id 倒序），客户端先取清单再并发拉取分片，全程不经过 Python
+    - 增量生成：一次 GROUP BY 查询得到每片的指纹（作品数、id 之和、最大 updated_at），
+      与上一次清单相同的分片直接沿用，只重新序列化变化的分片
+    heat_score 随浏览计数频繁变化，不写入快照（需要时走列表 API）。
+    """
+
+    FIELDS = tuple(f for f in Image.API_FIELDS if f != 'heat_score')
+    MANIFEST = 'manifest.json'
+
+    @staticmethod
+    def output_dir():
+        path = current_app.config.get('SNAPSHOT_DIR') or 'static/snapshot'
+        if not os.path.isabs(path):
+            path = os.path.join(current_app.root_path, path)
+        return path
+
+    @staticmethod
+    def _visible_query():
+        return Image.query.filter(Image.status == 'approved', Image.is_sensitive == False)
+
+    @staticmethod
+    def fingerprints(shard_size):
+        """每个分片的指纹 {(分类, 片号): [作品数, id 之和, 最大 updated_at]}"""
+        shard = (Image.id // shard_size).label('shard')
+        category = func.coalesce(Image.category, 'gallery').label('category')
+        rows = db.session.query(
+            category, shard, func.count(Image.id), func.sum(Image.id),
+            func.max(func.coalesce(Image.updated_at, Image.created_at))
+        ).filter(Image.status == 'approved', Image.is_sensitive == False) \
+            .group_by(category, shard).all()
+        return {
+            (cat, int(shard_no)): [count, int(id_sum), str(latest)]
+            for cat, shard_no, count, id_sum, latest in rows
+        }
+
+    @staticmethod
+    def load_manifest(directory):
+        try:
+            with open(os.path.join(directory, SnapshotService.MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, data):
+        """先写临时文件再原子替换，静态服务器不会读到半个文件"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _write_pair(directory, name, body):
+        """写入 name 与预压缩的 name.gz（nginx gzip_static 直接使用）"""
+        SnapshotService._write(os.path.join(directory, name), body)
+        SnapshotService._write(os.path.join(directory, name + '.gz'), gzip.compress(body, compresslevel=9, mtime=0))
+
+    @staticmethod
+    def _render_shard(category, shard_no, shard_size, url_root):
+        images = SnapshotService._visible_query() \
+            .filter(func.coalesce(Image.category, 'gallery') == category,
+                    Image.id >= shard_no * shard_size, Image.id < (shard_no + 1) * shard_size) \
+            .order_by(Image.created_at.desc(), Image.id.desc()).all()
+        items = Image.bulk_to_dict(images, fields=SnapshotService.FIELDS, url_root=url_root)
+        db.session.expunge_all()
+        return json.dumps(items, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), len(items)
+
+    @staticmethod
+    def build(force=False):
+        """
+        生成 / 增量更新快照
+        :param force: 忽略上一次的清单，全部分片重新生成
+        :return: dict(shards=分片总数, written=重新生成的分片数, removed=清理的旧文件数, total=作品总数)
+        """
+        config = current_app.config
+        shard_size = config.get('SNAPSHOT_SHARD_SIZE', 1000)
+        url_root = (config.get('SNAPSHOT_URL_ROOT') or '').rstrip('/')
+        directory = SnapshotService.output_dir()
+        os.makedirs(directory, exist_ok=True)
+
+        previous = SnapshotService.load_manifest(directory) or {}
+        reusable = {}
+        if not force and previous.get('shard_size') == shard_size and previous.get('url_root') == url_root \
+                and previous.get('fields') == list(SnapshotService.FIELDS):
+            for entry in previous.get('shards', []):
+                if os.path.exists(os.path.join(directory, entry['file'])):
+                    reusable[(entry['category'], entry['shard'])] = entry
+
+        seq = ChangeService.latest_seq()
+        shards, written = [], 0
+        for (category, shard_no), fingerprint in SnapshotService.fingerprints(shard_size).items():
+            entry = reusable.get((category, shard_no))
+            if entry is None or entry['fingerprint'] != fingerprint:
+                body, count = SnapshotService._render_shard(category, shard_no, shard_size, url_root)
+                digest = hashlib.sha256(body).hexdigest()[:16]
+                name = f'{category}-{shard_no}.{digest}.json'
+                if not os.path.exists(os.path.join(directory, name)):
+                    SnapshotService._write_pair(directory, name, body)
+                    written += 1
+                entry = {
+                    'category': category, 'shard': shard_no, 'file': name, 'count': count,
+                    'hash': digest, 'bytes': len(body), 'fingerprint': fingerprint,
+                }
+            shards.append(entry)
+        shards.sort(key=lambda e: (e['shard'], e['category']), reverse=True)
+
+        manifest = {
+            'generated_at': datetime.now().isoformat(),
+            'change_seq': seq,
+            'shard_size': shard_size,
+            'url_root': url_root,
+            'fields': list(SnapshotService.FIELDS),
+            'total': sum(e['count'] for e in shards),
+            'categories': {
+                cat: sum(e['count'] for e in shards if e['category'] == cat)
+                for cat in sorted({e['category'] for e in shards})
+            },
+            'shards': shards,
+        }
+        SnapshotService._write_pair(directory, SnapshotService.MANIFEST,
+                                    json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+        # 上一版清单引用的文件保留一轮，正在按旧清单下载的客户端不会遇到 404
+        keep = {e['file'] for e in shards} | {e['file'] for e in previous.get('shards', [])}
+        removed = 0
+        for name in os.listdir(directory):
+            base = name[:-3] if name.endswith('.gz') else name
+            if base == SnapshotService.MANIFEST or base in keep or not base.endswith('.json'):
+                continue
+            os.remove(os.path.join(directory, name))
+            removed += 1
+
+        return {'shards': len(shards), 'written': written, 'removed': removed, 'total': manifest['total']}
+
+    @staticmethod
+    def watch(interval, log=print):
+        """后台模式：变更日志序号变化时增量重建（可由进程管理器常驻运行）"""
+        last_seq = None
+        while True:
+            try:
+                seq = ChangeService.latest_seq()
+                if seq != last_seq:
+                    result = SnapshotService.build()
+                    last_seq = seq
+                    if result['written'] or result['removed']:
+                        log(f"[OK] Snapshot updated: {result['written']} shards written, "
+                            f"{result['removed']} files removed, {result['total']} images")
+            except Exception as e:
+                db.session.rollback()
+                log(f"[WARN] Snapshot build failed: {e}")
+            db.session.remove()
+            time.sleep(interval)
@@ -0,0 +1,179 @@
+import atexit
+import os
+import time
+import threading
+from collections import Counter
+from flask import current_app
+from sqlalchemy import bindparam, func
+from extensions import db
+from models import Image
+from services.catalog_version_service import CatalogVersionService
+from services.trending_service import TrendingService
+
+
+class StatsService:
+    """
+    浏览 / 复制计数聚合器：
+    埋点请求只在内存中累加，后台线程每 STATS_FLUSH_INTERVAL 秒把增量合并成一次批量
+    UPDATE ... SET views_count = views_count + n（原子累加，不做读-改-写，多 worker 并发不丢计数）。
+    进程退出时（atexit）会再刷写一次；刷写失败的增量放回缓冲区，下次重试。
+    同一事务内按小时分桶累加（趋势排行的数据源）；排行重建与相关作品刷新在 MaintenanceService 的线程中执行。
+    """
+
+    VIEW_WEIGHT = 1
+    COPY_WEIGHT = 10
+    MAX_PENDING = 5000  # 缓冲的作品数超过该值时立即刷写
+
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _views = Counter()
+    _copies = Counter()
+    _app = None
+    _pid = None
+    _stop = None
+
+    _metrics = {
+        'flushes': 0,
+        'flushed_rows': 0,
+        'flushed_views': 0,
+        'flushed_copies': 0,
+        'errors': 0,
+        'last_flush_at': None,
+        'last_flush_ms': None,
+        'last_error': None,
+    }
+
+    @staticmethod
+    def record_view(image_id):
+        StatsService._record(image_id, views=1)
+
+    @staticmethod
+    def record_copy(image_id):
+        StatsService._record(image_id, copies=1)
+
+    @staticmethod
+    def _record(image_id, views=0, copies=0):
+        StatsService._ensure_worker()
+        with StatsService._lock:
+            if views:
+                StatsService._views[image_id] += views
+            if copies:
+                StatsService._copies[image_id] += copies
+            pending = len(StatsService._views.keys() | StatsService._copies.keys())
+        if pending >= StatsService.MAX_PENDING:
+            StatsService.flush()
+
+    @staticmethod
+    def _ensure_worker():
+        """每个进程（gunicorn fork 后）懒启动一个刷写线程"""
+        pid = os.getpid()
+        if StatsService._pid == pid:
+            return
+        with StatsService._lock:
+            if StatsService._pid == pid:
+                return
+            # fork 继承来的缓冲属于父进程，子进程从空开始
+            StatsService._views = Counter()
+            StatsService._copies = Counter()
+            StatsService._app = current_app._get_current_object()
+            StatsService._stop = threading.Event()
+            StatsService._pid = pid
+            interval = StatsService._app.config.get('STATS_FLUSH_INTERVAL', 5)
+            thread = threading.Thread(target=StatsService._run, args=(interval, StatsService._stop),
+                                      name='stats-flush', daemon=True)
+            thread.start()
+            atexit.register(StatsService.shutdown)
+
+    @staticmethod
+    def _run(interval, stop):
+        while not stop.wait(interval):
+            StatsService.flush()
+
+    @staticmethod
+    def shutdown():
+        """进程退出前停止后台线程并刷写剩余增量"""
+        if StatsService._stop is not None:
+            StatsService._stop.set()
+        StatsService.flush()
+
+    @staticmethod
+    def flush():
+        """把缓冲的增量写入数据库，返回写入的作品数"""
+        app = StatsService._app
+        if app is None:
+            return 0
+
+        with StatsService._flush_lock:
+            with StatsService._lock:
+                views, copies = StatsService._views, StatsService._copies
+                StatsService._views, StatsService._copies = Counter(), Counter()
+            ids = sorted(views.keys() | copies.keys())
+            if not ids:
+                return 0
+
+            started = time.monotonic()
+            try:
+                with app.app_context():
+                    StatsService._apply(ids, views, copies)
+            except Exception as e:
+                # 放回缓冲区，下次刷写重试
+                with StatsService._lock:
+                    StatsService._views.update(views)
+                    StatsService._copies.update(copies)
+                StatsService._metrics['errors'] += 1
+                StatsService._metrics['last_error'] = str(e)
+                app.logger.warning(f"Stats flush failed, {len(ids)} images re-queued: {e}")
+                return 0
+
+            metrics = StatsService._metrics
+            metrics['flushes'] += 1
+            metrics['flushed_rows'] += len(ids)
+            metrics['flushed_views'] += sum(views.values())
+            metrics['flushed_copies'] += sum(copies.values())
+            metrics['last_flush_at'] = int(time.time())
+            metrics['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+            return len(ids)
+
+    @staticmethod
+    def _apply(ids, views, copies):
+        table = Image.__table__
+        dv, dc = bindparam('dv'), bindparam('dc')
+        views_count = func.coalesce(table.c.views_count, 0) + dv
+        copies_count = func.coalesce(table.c.copies_count, 0) + dc
+        stmt = table.update().where(table.c.id == bindparam('image_id')).values(
+            views_count=views_count,
+            copies_count=copies_count,
+            heat_score=views_count * StatsService.VIEW_WEIGHT + copies_count * StatsService.COPY_WEIGHT,
+        )
+        try:
+            db.session.execute(stmt, [
+                {'image_id': i, 'dv': views.get(i, 0), 'dc': copies.get(i, 0)} for i in ids
+            ])
+            # 只为仍存在的作品分桶（外键约束），并按分类通知缓存（heat_score 出现在列表响应中）
+            existing = db.session.query(Image.id, Image.category).filter(Image.id.in_(ids)).all()
+            TrendingService.record_buckets([
+                {'image_id': i, 'views': views.get(i, 0), 'copies': copies.get(i, 0)} for i, _ in existing
+            ])
+            for category in {c for _, c in existing}:
+                CatalogVersionService.bump_stats(category)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def metrics():
+        """当前进程的缓冲与刷写统计"""
+        with StatsService._lock:
+            pending_views = sum(StatsService._views.values())
+            pending_copies = sum(StatsService._copies.values())
+            pending_rows = len(StatsService._views.keys() | StatsService._copies.keys())
+        data = dict(StatsService._metrics)
+        data.update({
+            'pid': os.getpid(),
+            'pending_rows': pending_rows,
+            'pending_views': pending_views,
+            'pending_copies': pending_copies,
+            'flush_interval': current_app.config.get('STATS_FLUSH_INTERVAL', 5),
+        })
+        return data
@@ -0,0 +1,181 @@
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Image, Tag, TagFacetCount, image_tags
+
+
+class TagCountService:
+    """
+    标签计数物化表维护：
+    写入路径在修改前后各取一次受影响作品的贡献快照 (tag, category, sensitive) -> n，
+    只把差值原子地累加到 tag_facet_count，避免每次访问画廊都对全表 GROUP BY。
+    """
+
+    CACHE_TTL = 30  # 秒；本进程写入时会立即失效，其他 worker 依赖 TTL 过期
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    @staticmethod
+    def snapshot(image_ids, batch_size=500):
+        """统计给定作品（仅已发布）对标签计数的贡献"""
+        ids = [int(i) for i in image_ids if i is not None]
+        contrib = Counter()
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            rows = db.session.query(Image.id, Image.category, Tag.id, Tag.is_sensitive) \
+                .join(image_tags, image_tags.c.image_id == Image.id) \
+                .join(Tag, Tag.id == image_tags.c.tag_id) \
+                .filter(Image.id.in_(chunk), Image.status == 'approved') \
+                .all()
+
+            per_image = {}
+            for image_id, category, tag_id, tag_sensitive in rows:
+                entry = per_image.setdefault(image_id, {'category': category, 'tags': set(), 'sensitive': False})
+                entry['tags'].add(tag_id)
+                entry['sensitive'] = entry['sensitive'] or bool(tag_sensitive)
+
+            for entry in per_image.values():
+                for tag_id in entry['tags']:
+                    contrib[(tag_id, entry['category'] or 'gallery', entry['sensitive'])] += 1
+        return contrib
+
+    @staticmethod
+    def apply_delta(before, after):
+        """把 after - before 的差值写入计数表（随调用方事务一起提交）"""
+        delta = Counter(after)
+        delta.subtract(before)
+        changed = False
+
+        for (tag_id, category, sensitive), diff in delta.items():
+            if diff == 0:
+                continue
+            changed = True
+            # 提交后由 TagSuggestService 增量更新补全索引的热度
+            db.session.info.setdefault('tag_count_deltas', Counter())[tag_id] += diff
+            key = and_(TagFacetCount.tag_id == tag_id,
+                       TagFacetCount.category == category,
+                       TagFacetCount.is_sensitive == sensitive)
+            updated = db.session.query(TagFacetCount).filter(key).update(
+                {TagFacetCount.image_count: TagFacetCount.image_count + diff},
+                synchronize_session=False
+            )
+            if not updated and diff > 0:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(TagFacetCount(tag_id=tag_id, category=category,
+                                                     is_sensitive=sensitive, image_count=diff))
+                except IntegrityError:
+                    # 其他 worker 抢先插入了同一行，改为累加
+                    db.session.query(TagFacetCount).filter(key).update(
+                        {TagFacetCount.image_count: TagFacetCount.image_count + diff},
+                        synchronize_session=False
+                    )
+            elif diff < 0:
+                db.session.query(TagFacetCount).filter(key, TagFacetCount.image_count <= 0) \
+                    .delete(synchronize_session=False)
+
+        if changed:
+            TagCountService.invalidate()
+
+    @staticmethod
+    @contextmanager
+    def track(image_ids):
+        """
+        用法：
+            with TagCountService.track([img.id]):
+                ...修改作品状态 / 分类 / 标签...
+            db.session.commit()
+        """
+        ids = list(image_ids)
+        before = TagCountService.snapshot(ids)
+        yield
+        db.session.flush()
+        TagCountService.apply_delta(before, TagCountService.snapshot(ids))
+
+    @staticmethod
+    def expected_counts():
+        """从明细表全量计算期望计数"""
+        rows = db.session.query(Image.id, Image.category, Tag.id, Tag.is_sensitive) \
+            .join(image_tags, image_tags.c.image_id == Image.id) \
+            .join(Tag, Tag.id == image_tags.c.tag_id) \
+            .filter(Image.status == 'approved') \
+            .yield_per(1000)
+
+        per_image = {}
+        for image_id, category, tag_id, tag_sensitive in rows:
+            entry = per_image.setdefault(image_id, [category or 'gallery', set(), False])
+            entry[1].add(tag_id)
+            entry[2] = entry[2] or bool(tag_sensitive)
+
+        expected = Counter()
+        for category, tag_ids, sensitive in per_image.values():
+            for tag_id in tag_ids:
+                expected[(tag_id, category, sensitive)] += 1
+        return expected
+
+    @staticmethod
+    def rebuild():
+        """一致性重建：与明细表比对并修正计数表，返回修正的行数"""
+        expected = TagCountService.expected_counts()
+        stored = {
+            (row.tag_id, row.category, row.is_sensitive): row
+            for row in TagFacetCount.query.all()
+        }
+
+        fixed = 0
+        for key, row in stored.items():
+            if key not in expected:
+                db.session.delete(row)
+                fixed += 1
+            elif row.image_count != expected[key]:
+                row.image_count = expected[key]
+                fixed += 1
+        for key, count in expected.items():
+            if key not in stored:
+                tag_id, category, sensitive = key
+                db.session.add(TagFacetCount(tag_id=tag_id, category=category,
+                                             is_sensitive=sensitive, image_count=count))
+                fixed += 1
+
+        if fixed:
+            db.session.info['tag_index_rebuild'] = True  # 补全索引的热度随之整体重建
+        db.session.commit()
+        TagCountService.invalidate()
+        return fixed
+
+    @staticmethod
+    def invalidate():
+        with TagCountService._cache_lock:
+            TagCountService._cache.clear()
+
+    @staticmethod
+    def facet_list(category=None, show_sensitive=False):
+        """
+        标签筛选列表 [{'id', 'name', 'count'}]，按名称排序。
+        不可查看敏感内容时只统计非敏感作品（与列表页的过滤口径一致）。
+        """
+        cache_key = (category, bool(show_sensitive))
+        now = time.monotonic()
+        with TagCountService._cache_lock:
+            cached = TagCountService._cache.get(cache_key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        total = db.func.sum(TagFacetCount.image_count)
+        query = db.session.query(Tag.id, Tag.name, total.label('image_count')) \
+            .join(TagFacetCount, TagFacetCount.tag_id == Tag.id)
+        if category:
+            query = query.filter(TagFacetCount.category == category)
+        if not show_sensitive:
+            query = query.filter(TagFacetCount.is_sensitive == False)
+
+        rows = query.group_by(Tag.id, Tag.name).having(total > 0).order_by(Tag.name).all()
+        result = [{'id': tag_id, 'name': name, 'count': int(count)} for tag_id, name, count in rows]
+
+        with TagCountService._cache_lock:
+            TagCountService._cache[cache_key] = (now + TagCountService.CACHE_TTL, result)
+        return result
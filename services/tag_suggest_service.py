@@ -0,0 +1,234 @@
+import bisect
+import os
+import re
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Tag, TagFacetCount
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+
+class TagSuggestService:
+    """
+    标签自动补全（/api/tags/suggest）：
+    - 每个进程在内存中维护一个有序数组 [(检索键, 标签 id)]，前缀查询用 bisect 定位后顺序扫描，不查数据库
+    - 检索键：小写全名、按空格 / 下划线 / 连字符切分的各个词；
+      安装 pypinyin 时另加全拼与首字母（"风景" -> fengjing / fj），未安装时中文标签按汉字前缀匹配
+    - 结果按作品数（已发布作品，tag_facet_count 汇总）降序，同数量时短名优先
+    - 本进程提交的标签新增 / 改名 / 删除（含合并、孤儿清理）与计数变化在 after_commit 中增量更新；
+      同时刷新 instance 目录下的标记文件，其他 worker 发现标记变化后整体重建一次
+    """
+
+    SCAN_LIMIT = 2000  # 单次前缀查询最多扫描的检索键数
+    SPLIT_RE = re.compile(r'[\s_\-/]+')
+
+    _lock = threading.RLock()
+    _keys = []     # 有序检索键
+    _entries = []  # 与 _keys 对应的标签 id
+    _tags = {}     # id -> {'name', 'count', 'sensitive'}
+    _popular = None
+    _stamp = None
+    _pid = None
+
+    @staticmethod
+    def _stamp_path():
+        return os.path.join(current_app.instance_path, 'tag_index.stamp')
+
+    @staticmethod
+    def _read_stamp():
+        try:
+            st = os.stat(TagSuggestService._stamp_path())
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    @staticmethod
+    def _touch_stamp():
+        """通知其他 worker：标签索引已变化"""
+        path = TagSuggestService._stamp_path()
+        try:
+            with open(path, 'a'):
+                pass
+            os.utime(path, ns=(time.time_ns(), time.time_ns()))
+            return TagSuggestService._read_stamp()
+        except OSError as e:
+            current_app.logger.warning(f"Tag index stamp update failed: {e}")
+            return None
+
+    @staticmethod
+    def search_keys(name):
+        """标签的全部检索键"""
+        lowered = name.strip().lower()
+        if not lowered:
+            return set()
+        keys = {lowered}
+        keys.update(part for part in TagSuggestService.SPLIT_RE.split(lowered) if part)
+        if lazy_pinyin is not None and any('一' <= ch <= '鿿' for ch in lowered):
+            syllables = [s for s in lazy_pinyin(lowered) if s.strip()]
+            keys.add(''.join(syllables).replace(' ', ''))
+            initials = lazy_pinyin(lowered, style=Style.FIRST_LETTER)
+            keys.add(''.join(i for i in initials if i.strip()))
+        return keys
+
+    @staticmethod
+    def rebuild():
+        """从数据库整体重建本进程的索引"""
+        stamp = TagSuggestService._read_stamp()
+        counts = dict(db.session.query(TagFacetCount.tag_id, db.func.sum(TagFacetCount.image_count))
+                      .group_by(TagFacetCount.tag_id).all())
+        tags = {
+            tag_id: {'name': name, 'count': int(counts.get(tag_id) or 0), 'sensitive': bool(sensitive)}
+            for tag_id, name, sensitive in db.session.query(Tag.id, Tag.name, Tag.is_sensitive).all()
+        }
+        pairs = sorted((key, tag_id) for tag_id, info in tags.items()
+                       for key in TagSuggestService.search_keys(info['name']))
+        with TagSuggestService._lock:
+            TagSuggestService._tags = tags
+            TagSuggestService._keys = [k for k, _ in pairs]
+            TagSuggestService._entries = [i for _, i in pairs]
+            TagSuggestService._popular = None
+            TagSuggestService._stamp = stamp
+            TagSuggestService._pid = os.getpid()
+        return len(tags)
+
+    @staticmethod
+    def _ensure_fresh():
+        """首次使用、fork 后或其他 worker 修改过标签时重建（只做一次 stat，不查询数据库）"""
+        if TagSuggestService._pid != os.getpid() or TagSuggestService._stamp != TagSuggestService._read_stamp():
+            TagSuggestService.rebuild()
+
+    @staticmethod
+    def _insert(tag_id, name):
+        for key in TagSuggestService.search_keys(name):
+            index = bisect.bisect_left(TagSuggestService._keys, key)
+            while index < len(TagSuggestService._keys) and TagSuggestService._keys[index] == key \
+                    and TagSuggestService._entries[index] < tag_id:
+                index += 1
+            TagSuggestService._keys.insert(index, key)
+            TagSuggestService._entries.insert(index, tag_id)
+
+    @staticmethod
+    def _remove(tag_id, name):
+        for key in TagSuggestService.search_keys(name):
+            index = bisect.bisect_left(TagSuggestService._keys, key)
+            while index < len(TagSuggestService._keys) and TagSuggestService._keys[index] == key:
+                if TagSuggestService._entries[index] == tag_id:
+                    del TagSuggestService._keys[index]
+                    del TagSuggestService._entries[index]
+                    break
+                index += 1
+
+    @staticmethod
+    def apply_changes(upserts=(), deletes=(), count_deltas=None):
+        """
+        增量更新本进程的索引
+        :param upserts: [(id, name, sensitive)] 新增或改名 / 改敏感标记的标签
+        :param deletes: [id] 已删除的标签
+        :param count_deltas: {id: 作品数变化}
+        """
+        if TagSuggestService._pid != os.getpid():
+            return
+        with TagSuggestService._lock:
+            tags = TagSuggestService._tags
+            for tag_id in deletes:
+                info = tags.pop(tag_id, None)
+                if info:
+                    TagSuggestService._remove(tag_id, info['name'])
+            for tag_id, name, sensitive in upserts:
+                info = tags.get(tag_id)
+                if info is None:
+                    info = tags[tag_id] = {'name': name, 'count': 0, 'sensitive': bool(sensitive)}
+                    TagSuggestService._insert(tag_id, name)
+                elif info['name'] != name:
+                    TagSuggestService._remove(tag_id, info['name'])
+                    info['name'] = name
+                    TagSuggestService._insert(tag_id, name)
+                info['sensitive'] = bool(sensitive)
+            for tag_id, diff in (count_deltas or {}).items():
+                if tag_id in tags:
+                    tags[tag_id]['count'] = max(tags[tag_id]['count'] + diff, 0)
+            TagSuggestService._popular = None
+
+    @staticmethod
+    def _rank(tag_id):
+        info = TagSuggestService._tags[tag_id]
+        return -info['count'], len(info['name']), info['name']
+
+    @staticmethod
+    def suggest(prefix, limit=10, show_sensitive=False):
+        """前缀补全，返回 [{'name', 'count'}]；prefix 为空时返回最常用的标签"""
+        TagSuggestService._ensure_fresh()
+        prefix = (prefix or '').strip().lower()
+
+        with TagSuggestService._lock:
+            tags = TagSuggestService._tags
+            if not prefix:
+                if TagSuggestService._popular is None:
+                    TagSuggestService._popular = sorted(tags, key=TagSuggestService._rank)
+                candidates = TagSuggestService._popular
+            else:
+                keys, entries = TagSuggestService._keys, TagSuggestService._entries
+                found = set()
+                index = bisect.bisect_left(keys, prefix)
+                end = min(index + TagSuggestService.SCAN_LIMIT, len(keys))
+                while index < end and keys[index].startswith(prefix):
+                    found.add(entries[index])
+                    index += 1
+                candidates = sorted(found, key=TagSuggestService._rank)
+
+            result = []
+            for tag_id in candidates:
+                info = tags[tag_id]
+                if info['sensitive'] and not show_sensitive:
+                    continue
+                result.append({'name': info['name'], 'count': info['count']})
+                if len(result) >= limit:
+                    break
+        return result
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tag_changes(session, flush_context):
+    """记录本次事务中新增 / 修改 / 删除的标签（此时已分配 id，且 new / dirty / deleted 仍为 flush 前的集合）"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Tag):
+            continue
+        changes = session.info.setdefault('tag_index_changes', {})
+        if obj in session.deleted:
+            changes[obj.id] = None
+        elif obj in session.new or session.is_modified(obj, include_collections=False):
+            changes[obj.id] = (obj.name, obj.is_sensitive)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_tag_index(session):
+    """提交后增量更新本进程的索引，并通知其他 worker 重建"""
+    changes = session.info.pop('tag_index_changes', None)
+    deltas = session.info.pop('tag_count_deltas', None)
+    full_rebuild = session.info.pop('tag_index_rebuild', False)
+    if not (changes or deltas or full_rebuild) or not has_app_context():
+        return
+
+    changes = changes or {}
+    upserts = [(tag_id, value[0], value[1]) for tag_id, value in changes.items() if value is not None]
+    deletes = [tag_id for tag_id, value in changes.items() if value is None]
+    TagSuggestService.apply_changes(upserts, deletes, deltas)
+
+    stamp = TagSuggestService._touch_stamp()
+    if TagSuggestService._pid == os.getpid():
+        # 本进程已增量更新，无需因自己刷新的标记而重建；计数整体重建时则下次查询重新加载
+        TagSuggestService._stamp = None if full_rebuild else stamp
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_tag_changes(session, previous_transaction):
+    if not previous_transaction.nested:
+        for key in ('tag_index_changes', 'tag_count_deltas', 'tag_index_rebuild'):
+            session.info.pop(key, None)
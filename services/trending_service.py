@@ -0,0 +1,129 @@
+import math
+import time
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Image, ImageStatBucket, TrendingRank, SystemSetting
+from services.catalog_version_service import CatalogVersionService
+
+
+class TrendingService:
+    """
+    趋势排行：
+    StatsService 刷写计数时同时按小时分桶累加 (image_stat_bucket)；
+    rebuild() 对窗口内的分桶做指数衰减加权 (浏览 1 + 复制 10)，整表重写 trending_rank。
+    sort=trending 直接按 rank 顺序读取，与作品总量无关。
+    """
+
+    BUCKET_SECONDS = 3600
+    REBUILD_KEY = 'trending_rebuilt_at'
+
+    @staticmethod
+    def bucket_of(timestamp=None):
+        return int((timestamp or time.time()) // TrendingService.BUCKET_SECONDS)
+
+    @staticmethod
+    def record_buckets(rows):
+        """
+        累加分桶计数（随调用方事务提交）
+        :param rows: [{'image_id', 'views', 'copies'}]，计入当前小时桶
+        """
+        if not rows:
+            return
+        bucket = TrendingService.bucket_of()
+        values = [dict(r, bucket=bucket) for r in rows]
+        dialect = db.engine.dialect.name
+        table = ImageStatBucket.__table__
+
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.image_id, table.c.bucket],
+                set_={'views': table.c.views + stmt.excluded.views,
+                      'copies': table.c.copies + stmt.excluded.copies}
+            )
+            db.session.execute(stmt, values)
+            return
+
+        for v in values:
+            key = (table.c.image_id == v['image_id']) & (table.c.bucket == bucket)
+            updated = db.session.execute(table.update().where(key).values(
+                views=table.c.views + v['views'], copies=table.c.copies + v['copies']
+            )).rowcount
+            if not updated:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(table.insert().values(**v))
+                except IntegrityError:
+                    db.session.execute(table.update().where(key).values(
+                        views=table.c.views + v['views'], copies=table.c.copies + v['copies']
+                    ))
+
+    @staticmethod
+    def rebuild(now=None):
+        """按衰减分重建排行表，并清理窗口外的分桶；返回上榜作品数"""
+        from services.stats_service import StatsService
+
+        now = now or time.time()
+        half_life = current_app.config.get('TRENDING_HALF_LIFE_HOURS', 72) * 3600
+        window = current_app.config.get('TRENDING_WINDOW_DAYS', 14) * 86400
+        current = TrendingService.bucket_of(now)
+        oldest = TrendingService.bucket_of(now - window)
+
+        scores = defaultdict(float)
+        rows = db.session.query(ImageStatBucket.image_id, ImageStatBucket.bucket,
+                                ImageStatBucket.views, ImageStatBucket.copies) \
+            .join(Image, Image.id == ImageStatBucket.image_id) \
+            .filter(ImageStatBucket.bucket >= oldest, Image.status == 'approved') \
+            .yield_per(1000)
+        for image_id, bucket, views, copies in rows:
+            age = (current - bucket) * TrendingService.BUCKET_SECONDS
+            weight = math.pow(0.5, age / half_life)
+            scores[image_id] += (views * StatsService.VIEW_WEIGHT + copies * StatsService.COPY_WEIGHT) * weight
+
+        ranked = sorted(((s, i) for i, s in scores.items() if s > 0), key=lambda x: (-x[0], -x[1]))
+        try:
+            db.session.query(TrendingRank).delete(synchronize_session=False)
+            if ranked:
+                db.session.execute(TrendingRank.__table__.insert(), [
+                    {'image_id': image_id, 'rank': pos, 'score': round(score, 4)}
+                    for pos, (score, image_id) in enumerate(ranked, start=1)
+                ])
+            db.session.query(ImageStatBucket).filter(ImageStatBucket.bucket < oldest) \
+                .delete(synchronize_session=False)
+            # 排行变化会改变 sort=trending 的列表结果
+            CatalogVersionService.bump()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(ranked)
+
+    @staticmethod
+    def release(image_ids):
+        """删除作品前调用：清理其分桶与排行行（SQLite 不执行外键的 ON DELETE CASCADE，随调用方事务提交）"""
+        ids = list(image_ids)
+        if not ids:
+            return
+        ImageStatBucket.query.filter(ImageStatBucket.image_id.in_(ids)).delete(synchronize_session=False)
+        TrendingRank.query.filter(TrendingRank.image_id.in_(ids)).delete(synchronize_session=False)
+
+    @staticmethod
+    def maybe_rebuild():
+        """
+        距上次重建超过 TRENDING_REBUILD_INTERVAL 时重建一次。
+        通过 SystemSetting.claim 抢占 system_setting 中的时间戳，多个 worker 同一时间只有一个执行。
+        TRENDING_REBUILD_INTERVAL <= 0 时不在 Web 进程中重建（改由 flask rebuild-trending 定时执行）
+        """
+        interval = current_app.config.get('TRENDING_REBUILD_INTERVAL', 600)
+        if interval <= 0:
+            return False
+        if not SystemSetting.claim(TrendingService.REBUILD_KEY, interval):
+            return False
+        TrendingService.rebuild()
+        return True
@@ -0,0 +1,191 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from flask import current_app, request
+
+try:
+    import fcntl
+except ImportError:  # Windows：轮换时不加文件锁
+    fcntl = None
+
+
+class ViewDedupeService:
+    """
+    浏览去重窗口：同一客户端（IP + User-Agent 指纹）在 VIEW_DEDUPE_WINDOW 秒内重复浏览同一作品只计一次。
+    - 数据结构是按时间分片轮换的 Bloom 过滤器：VIEW_DEDUPE_SLICES 个位图分片，每片覆盖 窗口/分片数 秒，
+      最旧的分片被清空后复用，内存固定为 分片数 × VIEW_DEDUPE_SLICE_KB，不随访问量增长
+    - 位图放在 instance 目录下的文件中并 mmap 映射，多个 gunicorn worker 共享同一份数据；
+      置位不加锁（并发竞争最多漏记一次重复，等同于多计一次浏览），只有分片轮换时加文件锁
+    - 判断为重复的浏览直接返回，不进入计数缓冲，也不会产生数据库写入
+    Bloom 过滤器存在少量误判（把新浏览当作重复）：默认每片 1 MiB、每片 10 万次浏览时约为 0.002%，对计数影响可忽略。
+    """
+
+    MAGIC = b'PMVD'
+    HASHES = 4
+    HEADER = struct.Struct('<4sII')
+
+    _lock = threading.Lock()
+    _maps = {}  # (pid, path) -> (mmap, slices, slice_bytes, data_offset)
+    _metrics = {'checked': 0, 'duplicates': 0, 'rotations': 0, 'errors': 0}
+
+    @staticmethod
+    def enabled():
+        return current_app.config.get('VIEW_DEDUPE_ENABLED', True)
+
+    @staticmethod
+    def _path():
+        return current_app.config.get('VIEW_DEDUPE_PATH') or \
+            os.path.join(current_app.instance_path, 'view_dedupe.bin')
+
+    @staticmethod
+    def _layout():
+        slices = max(int(current_app.config.get('VIEW_DEDUPE_SLICES', 4)), 2)
+        slice_bytes = max(int(current_app.config.get('VIEW_DEDUPE_SLICE_KB', 1024)), 1) * 1024
+        # 头部 + 每个分片当前所属的时间桶编号，数据区按 64 字节对齐
+        data_offset = (ViewDedupeService.HEADER.size + 8 * slices + 63) // 64 * 64
+        return slices, slice_bytes, data_offset
+
+    @staticmethod
+    def _map():
+        """每个进程（fork 后）打开并映射一次共享文件；格式与配置不符时重建"""
+        path = ViewDedupeService._path()
+        key = (os.getpid(), path)
+        cached = ViewDedupeService._maps.get(key)
+        if cached is not None:
+            return cached
+
+        with ViewDedupeService._lock:
+            cached = ViewDedupeService._maps.get(key)
+            if cached is not None:
+                return cached
+            slices, slice_bytes, data_offset = ViewDedupeService._layout()
+            size = data_offset + slices * slice_bytes
+            header = ViewDedupeService.HEADER.pack(ViewDedupeService.MAGIC, slices, slice_bytes)
+
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                ViewDedupeService._flock(fd, True)
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    current = os.read(fd, len(header))
+                    if current != header or os.fstat(fd).st_size != size:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, size)
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        os.write(fd, header)
+                finally:
+                    ViewDedupeService._flock(fd, False)
+                mapped = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+            cached = (mapped, slices, slice_bytes, data_offset)
+            ViewDedupeService._maps[key] = cached
+            return cached
+
+    @staticmethod
+    def _flock(fd, acquire):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if acquire else fcntl.LOCK_UN)
+
+    @staticmethod
+    def _bucket_of(mapped, slot):
+        offset = ViewDedupeService.HEADER.size + 8 * slot
+        return struct.unpack_from('<q', mapped, offset)[0]
+
+    @staticmethod
+    def _rotate(mapped, slot, bucket, slice_bytes, data_offset):
+        """把分片 slot 清空并分配给时间桶 bucket（多个 worker 同时轮换时只执行一次）"""
+        fd = os.open(ViewDedupeService._path(), os.O_RDWR)
+        try:
+            ViewDedupeService._flock(fd, True)
+            try:
+                if ViewDedupeService._bucket_of(mapped, slot) == bucket:
+                    return
+                start = data_offset + slot * slice_bytes
+                mapped[start:start + slice_bytes] = bytes(slice_bytes)
+                struct.pack_into('<q', mapped, ViewDedupeService.HEADER.size + 8 * slot, bucket)
+                ViewDedupeService._metrics['rotations'] += 1
+            finally:
+                ViewDedupeService._flock(fd, False)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _positions(key, bits):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % bits for i in range(ViewDedupeService.HASHES)]
+
+    @staticmethod
+    def fingerprint():
+        """客户端指纹：来源 IP（经反向代理时取 X-Forwarded-For 首个地址）+ User-Agent"""
+        address = request.access_route[0] if request.access_route else (request.remote_addr or '')
+        return f"{address}|{request.headers.get('User-Agent', '')}"
+
+    @staticmethod
+    def seen(image_id, fingerprint=None):
+        """
+        记录一次浏览并判断是否重复：窗口内已出现过返回 True，否则写入当前分片并返回 False
+        去重不可用（关闭或出错）时返回 False，浏览照常计数
+        """
+        if not ViewDedupeService.enabled():
+            return False
+        try:
+            mapped, slices, slice_bytes, data_offset = ViewDedupeService._map()
+            window = max(float(current_app.config.get('VIEW_DEDUPE_WINDOW', 1800)), 1.0)
+            bucket = int(time.time() // (window / slices))
+            bits = slice_bytes * 8
+            positions = ViewDedupeService._positions(f'{fingerprint or ViewDedupeService.fingerprint()}#{image_id}',
+                                                     bits)
+            ViewDedupeService._metrics['checked'] += 1
+
+            # 窗口内仍有效的分片：所属时间桶在 (bucket - slices, bucket] 之间
+            for b in range(bucket, bucket - slices, -1):
+                slot = b % slices
+                if ViewDedupeService._bucket_of(mapped, slot) != b:
+                    continue
+                base = data_offset + slot * slice_bytes
+                if all(mapped[base + p // 8] & (1 << (p % 8)) for p in positions):
+                    ViewDedupeService._metrics['duplicates'] += 1
+                    return True
+
+            slot = bucket % slices
+            if ViewDedupeService._bucket_of(mapped, slot) != bucket:
+                ViewDedupeService._rotate(mapped, slot, bucket, slice_bytes, data_offset)
+            base = data_offset + slot * slice_bytes
+            for p in positions:
+                index = base + p // 8
+                mapped[index] = mapped[index] | (1 << (p % 8))
+            return False
+        except Exception as e:
+            ViewDedupeService._metrics['errors'] += 1
+            current_app.logger.warning(f"View dedupe unavailable: {e}")
+            return False
+
+    @staticmethod
+    def metrics():
+        """去重命中统计（当前进程）与共享位图的内存占用 / 当前分片填充率"""
+        data = dict(ViewDedupeService._metrics)
+        data['enabled'] = ViewDedupeService.enabled()
+        data['window'] = current_app.config.get('VIEW_DEDUPE_WINDOW', 1800)
+        if not data['enabled']:
+            return data
+        try:
+            mapped, slices, slice_bytes, data_offset = ViewDedupeService._map()
+            window = max(float(data['window']), 1.0)
+            slot = int(time.time() // (window / slices)) % slices
+            start = data_offset + slot * slice_bytes
+            filled = int.from_bytes(mapped[start:start + slice_bytes], 'little').bit_count()
+            data.update({
+                'slices': slices,
+                'memory_bytes': len(mapped),
+                'current_slice_fill': round(filled / (slice_bytes * 8), 6),
+            })
+        except Exception as e:
+            data['last_error'] = str(e)
+        return data
@@ -7,21 +7,54 @@
 window.currentVars = {};
 window.rawPrompt = "";
 window.currentImgId = null;
+window.detailReady = null;
 
 // --- Detail Modal Logic ---
 
+// 卡片只内嵌 prompt 前缀；完整 prompt / 描述 / 参考图在打开弹窗时从 /api/images/<id> 获取并缓存
+const DETAIL_FIELDS = 'id,prompt,description,refs';
+const detailCache = new Map();
+
+function fetchDetail(id) {
+    if (!detailCache.has(id)) {
+        const request = fetch(`/api/images/${id}?fields=${DETAIL_FIELDS}`, {headers: {'Accept': 'application/json'}})
+            .then(res => {
+                if (!res.ok) throw new Error(`HTTP ${res.status}`);
+                return res.json();
+            })
+            .then(body => body.data)
+            .catch(err => {
+                detailCache.delete(id);  // 失败不缓存，下次打开重试
+                throw err;
+            });
+        detailCache.set(id, request);
+    }
+    return detailCache.get(id);
+}
+
 window.showDetail = function(el) {
     try {
         const scriptTag = el.querySelector('.img-data');
         if (!scriptTag) return;
         const data = JSON.parse(scriptTag.textContent);
+        // LQIP 背景沿用卡片缩略图的内联样式（不在 JSON 中重复内嵌）
+        const cardImg = el.querySelector('img');
+        openDetail(data, cardImg ? cardImg.style.backgroundImage : '');
+    } catch(e) {
+        console.error("Detail Error:", e);
+    }
+}
 
+/**
+ * 打开（或在已打开的弹窗中切换到）某个作品：data 为卡片字段，lqip 为 CSS background-image 值
+ */
+function openDetail(data, lqip) {
+    try {
         // 1. 基础信息渲染
         const modalImg = document.getElementById('modalImg');
         modalImg.src = data.file_path;
-        // 添加 LQIP 背景（如果有的话）
-        if (data.lqip_data) {
-            modalImg.style.backgroundImage = `url('${data.lqip_data}')`;
+        modalImg.style.backgroundImage = lqip || '';
+        if (lqip) {
             modalImg.style.backgroundSize = 'cover';
             modalImg.style.backgroundPosition = 'center';
         }
@@ -29,79 +62,9 @@ window.showDetail = function(el) {
         document.getElementById('modalAuthor').innerText = data.author ? 'by ' + data.author : '';
 
         window.currentImgId = data.id;
-        window.rawPrompt = data.prompt || "";
-        window.currentVars = {};
-
-        // 2. Prompt 解析与变量生成
-        const promptContainer = document.getElementById('modalPrompt');
-        const varsSection = document.getElementById('modalVarsSection');
-        const varsContainer = document.getElementById('modalVarsContainer');
-
-        // 正则匹配 {{variable}}
-        const regex = /\{\{(.*?)\}\}/g;
-        const matches = [...window.rawPrompt.matchAll(regex)];
-
-        if (matches.length > 0) {
-            // A. 安全构建高亮 Prompt（避免 innerHTML 注入）
-            promptContainer.innerHTML = '';
-            varsContainer.innerHTML = '';
-            const uniqueVars = new Set();
-            let cursor = 0;
-
-            matches.forEach(match => {
-                const start = match.index || 0;
-                const fullMatch = match[0] || '';
-                const varName = match[1].trim();
-
-                if (start > cursor) {
-                    promptContainer.appendChild(document.createTextNode(window.rawPrompt.slice(cursor, start)));
-                }
 
-                const span = document.createElement('span');
-                span.className = 'prompt-var-highlight';
-                span.setAttribute('data-original', varName);
-                span.textContent = `{{${varName}}}`;
-                promptContainer.appendChild(span);
-                cursor = start + fullMatch.length;
-
-                // 去重：如果同一个变量出现多次，只生成一个输入框
-                if (!uniqueVars.has(varName)) {
-                    uniqueVars.add(varName);
-                    window.currentVars[varName] = ""; // 初始化值
-
-                    const div = document.createElement('div');
-                    div.className = 'var-input-row animate-up'; // 使用 style.css 中定义的 iOS 风格样式
-
-                    const label = document.createElement('div');
-                    label.className = 'var-label';
-                    label.title = varName;
-                    label.textContent = varName;
-
-                    const input = document.createElement('input');
-                    input.type = 'text';
-                    input.className = 'var-input';
-                    input.placeholder = 'Value';
-                    input.autocomplete = 'off';
-                    input.addEventListener('input', function() {
-                        window.updateVar(varName, input.value);
-                    });
-
-                    div.appendChild(label);
-                    div.appendChild(input);
-                    varsContainer.appendChild(div);
-                }
-            });
-
-            if (cursor < window.rawPrompt.length) {
-                promptContainer.appendChild(document.createTextNode(window.rawPrompt.slice(cursor)));
-            }
-
-            varsSection.classList.remove('d-none');
-        } else {
-            // 没有变量：直接显示纯文本，隐藏输入区
-            promptContainer.innerText = window.rawPrompt;
-            varsSection.classList.add('d-none');
-        }
+        // 2. 先用前缀渲染 Prompt，完整内容到达后替换
+        renderPrompt(data.prompt_preview || "");
 
         // 3. 重置复制按钮状态 (防止上次的 "Copied" 状态残留)
         const btn = document.getElementById('btnCopyPrompt');
@@ -111,21 +74,112 @@ window.showDetail = function(el) {
             btn.className = 'btn btn-sm text-secondary p-0 fw-bold d-flex align-items-center transition-colors';
         }
 
-        // 4. 渲染其他详情 (描述、标签、参考图、管理按钮)
+        // 4. 渲染标签等已有信息，打点并绑定管理按钮，加载相似作品
         renderOtherDetails(data);
+        bindDetailActions(data);
+        renderRelated(data.id);
 
         // 5. 显示模态框
         if (typeof bootstrap !== 'undefined') {
-            new bootstrap.Modal(document.getElementById('detailModal')).show();
+            bootstrap.Modal.getOrCreateInstance(document.getElementById('detailModal')).show();
         }
+
+        // 6. 按需加载完整详情（弹窗已切换到其他作品时丢弃）
+        window.detailReady = fetchDetail(data.id)
+            .then(detail => {
+                if (window.currentImgId !== data.id) return;
+                const full = Object.assign({}, data, detail);
+                renderPrompt(full.prompt || "");
+                renderOtherDetails(full);
+            })
+            .catch(err => console.error("Detail Error:", err));
     } catch(e) {
         console.error("Detail Error:", e);
     }
 }
 
 /**
- * 辅助函数：渲染除 Prompt 外的其他信息
- * 将杂项逻辑分离，保持主函数整洁
+ * 渲染 Prompt：解析 {{变量}} 并生成变量输入框
+ */
+function renderPrompt(prompt) {
+    window.rawPrompt = prompt;
+    window.currentVars = {};
+
+    // Prompt 解析与变量生成
+    const promptContainer = document.getElementById('modalPrompt');
+    const varsSection = document.getElementById('modalVarsSection');
+    const varsContainer = document.getElementById('modalVarsContainer');
+
+    // 正则匹配 {{variable}}
+    const regex = /\{\{(.*?)\}\}/g;
+    const matches = [...window.rawPrompt.matchAll(regex)];
+
+    if (matches.length > 0) {
+        // A. 安全构建高亮 Prompt（避免 innerHTML 注入）
+        promptContainer.innerHTML = '';
+        varsContainer.innerHTML = '';
+        const uniqueVars = new Set();
+        let cursor = 0;
+
+        matches.forEach(match => {
+            const start = match.index || 0;
+            const fullMatch = match[0] || '';
+            const varName = match[1].trim();
+
+            if (start > cursor) {
+                promptContainer.appendChild(document.createTextNode(window.rawPrompt.slice(cursor, start)));
+            }
+
+            const span = document.createElement('span');
+            span.className = 'prompt-var-highlight';
+            span.setAttribute('data-original', varName);
+            span.textContent = `{{${varName}}}`;
+            promptContainer.appendChild(span);
+            cursor = start + fullMatch.length;
+
+            // 去重：如果同一个变量出现多次，只生成一个输入框
+            if (!uniqueVars.has(varName)) {
+                uniqueVars.add(varName);
+                window.currentVars[varName] = ""; // 初始化值
+
+                const div = document.createElement('div');
+                div.className = 'var-input-row animate-up'; // 使用 style.css 中定义的 iOS 风格样式
+
+                const label = document.createElement('div');
+                label.className = 'var-label';
+                label.title = varName;
+                label.textContent = varName;
+
+                const input = document.createElement('input');
+                input.type = 'text';
+                input.className = 'var-input';
+                input.placeholder = 'Value';
+                input.autocomplete = 'off';
+                input.addEventListener('input', function() {
+                    window.updateVar(varName, input.value);
+                });
+
+                div.appendChild(label);
+                div.appendChild(input);
+                varsContainer.appendChild(div);
+            }
+        });
+
+        if (cursor < window.rawPrompt.length) {
+            promptContainer.appendChild(document.createTextNode(window.rawPrompt.slice(cursor)));
+        }
+
+        varsSection.classList.remove('d-none');
+    } else {
+        // 没有变量：直接显示纯文本，隐藏输入区
+        promptContainer.innerText = window.rawPrompt;
+        varsSection.classList.add('d-none');
+    }
+}
+
+/**
+ * 辅助函数：渲染除 Prompt 外的其他信息（描述、标签、参考图）
+ * 将杂项逻辑分离，保持主函数整洁；完整详情到达后会再次调用
  */
 function renderOtherDetails(data) {
     // Description
@@ -190,7 +244,51 @@ function renderOtherDetails(data) {
     } else {
         refsSection.classList.add('d-none');
     }
+}
+
+// 相似作品：读取后台预先计算的 /api/images/<id>/related，点击在弹窗内切换
+const RELATED_LIMIT = 8;
+const relatedCache = new Map();
+
+function renderRelated(id) {
+    const section = document.getElementById('modalRelatedSection');
+    const container = document.getElementById('modalRelated');
+    if (!section || !container) return;
+    container.innerHTML = '';
+    section.classList.add('d-none');
+
+    if (!relatedCache.has(id)) {
+        relatedCache.set(id, fetch(`/api/images/${id}/related?limit=${RELATED_LIMIT}`, {headers: {'Accept': 'application/json'}})
+            .then(res => res.ok ? res.json() : {data: []})
+            .then(body => body.data || [])
+            .catch(() => {
+                relatedCache.delete(id);
+                return [];
+            }));
+    }
+    relatedCache.get(id).then(items => {
+        if (window.currentImgId !== id || !items.length) return;
+        items.forEach(item => {
+            const lqip = item.lqip_data ? `url("${item.lqip_data}")` : '';
+            const img = document.createElement('img');
+            img.src = item.thumbnail_path || item.file_path;
+            img.alt = item.title || '';
+            img.title = item.title || '';
+            img.loading = 'lazy';
+            img.className = 'rounded border cursor-pointer flex-shrink-0';
+            img.style.cssText = 'width:72px;height:72px;object-fit:cover;background-size:cover;';
+            img.style.backgroundImage = lqip;
+            img.onclick = () => openDetail(item, lqip);
+            container.appendChild(img);
+        });
+        section.classList.remove('d-none');
+    });
+}
 
+/**
+ * 辅助函数：浏览量打点与管理按钮（每次打开弹窗只执行一次）
+ */
+function bindDetailActions(data) {
     // Stats View (浏览量打点)
     const csrfToken = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content');
     if (navigator.sendBeacon && csrfToken) {
@@ -244,6 +342,11 @@ window.updateVar = function(name, value) {
 // --- Copy Logic ---
 
 window.copyModalPrompt = function() {
+    // 完整 Prompt 尚未到达时等待加载完成（加载失败则复制前缀）
+    Promise.resolve(window.detailReady).then(copyPrompt);
+}
+
+function copyPrompt() {
     let textToCopy = window.rawPrompt;
 
     // 执行最终替换：将 {{key}} 替换为用户输入的值
@@ -320,3 +423,54 @@ function fallbackCopy(text, parentBtn, callback) {
         alert("复制失败，请手动复制 Prompt");
     }
 }
+
+// --- Infinite Scroll ---
+
+/**
+ * 无限滚动：哨兵元素进入视口时请求下一页卡片片段 (/fragments/*) 并追加到网格，
+ * 下一页地址来自响应头 X-Next-URL；浏览器不支持 IntersectionObserver 时保留翻页条
+ */
+(function() {
+    const sentinel = document.getElementById('gallery-sentinel');
+    const grid = document.querySelector('.gallery-masonry');
+    if (!sentinel || !grid || !('IntersectionObserver' in window)) return;
+
+    const pagers = document.querySelectorAll('.pagination-container');
+    pagers.forEach(el => el.classList.add('d-none'));
+
+    let loading = false;
+    const observer = new IntersectionObserver(entries => {
+        if (loading || !entries.some(entry => entry.isIntersecting)) return;
+        const url = sentinel.dataset.nextUrl;
+        if (!url) return;
+
+        loading = true;
+        fetch(url, {headers: {'Accept': 'text/html'}})
+            .then(res => {
+                if (!res.ok) throw new Error(`HTTP ${res.status}`);
+                return res.text().then(html => ({html, next: res.headers.get('X-Next-URL')}));
+            })
+            .then(({html, next}) => {
+                grid.insertAdjacentHTML('beforeend', html);
+                if (next) {
+                    sentinel.dataset.nextUrl = next;
+                    // 重新观察：哨兵仍在视口内时会立即再次触发
+                    observer.unobserve(sentinel);
+                    observer.observe(sentinel);
+                } else {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            })
+            .catch(err => {
+                // 加载失败时恢复翻页条
+                console.error("Load more failed:", err);
+                observer.disconnect();
+                sentinel.remove();
+                pagers.forEach(el => el.classList.remove('d-none'));
+            })
+            .finally(() => { loading = false; });
+    }, {rootMargin: '800px 0px'});
+
+    observer.observe(sentinel);
+})();
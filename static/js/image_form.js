@@ -349,6 +349,33 @@ document.addEventListener('DOMContentLoaded', function() {
              const val = this.value.replace(/,|，/g, '').trim();
              if (val && !tags.includes(val)) { tags.push(val); renderTags(); this.value = ''; }
         });
+
+        // 已有标签补全（支持拼音 / 首字母），优先复用已有标签，减少近似重复
+        const suggestList = document.getElementById('tagSuggestions');
+        const suggestUrl = tagInput.getAttribute('data-suggest-url');
+        let suggestTimer = null;
+        if (suggestList && suggestUrl) {
+            tagInput.addEventListener('input', function() {
+                clearTimeout(suggestTimer);
+                const prefix = this.value.replace(/,|，/g, '').trim();
+                if (!prefix) { suggestList.innerHTML = ''; return; }
+                suggestTimer = setTimeout(() => {
+                    fetch(`${suggestUrl}?prefix=${encodeURIComponent(prefix)}&limit=8`)
+                        .then(res => res.ok ? res.json() : null)
+                        .then(body => {
+                            if (!body || tagInput.value.trim() !== prefix) return;
+                            suggestList.innerHTML = '';
+                            body.data.filter(item => !tags.includes(item.name)).forEach(item => {
+                                const option = document.createElement('option');
+                                option.value = item.name;
+                                option.label = `${item.count}`;
+                                suggestList.appendChild(option);
+                            });
+                        })
+                        .catch(() => {});
+                }, 150);
+            });
+        }
     }
 
     // Form Submission
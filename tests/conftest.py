@@ -0,0 +1,98 @@
+import io
+import os
+import tempfile
+
+import pytest
+from PIL import Image as PilImage
+from werkzeug.datastructures import FileStorage
+
+# 配置在导入 app 时读取环境变量，先指向临时目录，避免碰到本地数据库
+_TMP = tempfile.mkdtemp(prefix='prompt-manager-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TMP, 'test.db')
+os.environ['RESPONSE_CACHE_PATH'] = os.path.join(_TMP, 'response_cache.sqlite')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_TMP, 'uploads')
+os.environ['USE_LOCAL_RESOURCES'] = 'False'
+# 后台维护任务由用例按需开启，避免与用例并发写同一个 SQLite 库
+os.environ['TRENDING_REBUILD_INTERVAL'] = '0'
+os.environ['RELATED_REFRESH_INTERVAL'] = '0'
+
+from app import app, ensure_query_indexes, ensure_search_index  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def database():
+    """整个测试会话共用一个临时库；用例只断言自己写入的数据，不依赖库中作品总数"""
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        ensure_query_indexes(app)
+        ensure_search_index(app)
+        db.session.add(User(username='admin', password_hash=''))
+        db.session.commit()
+    return db
+
+
+@pytest.fixture
+def client(database):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(database):
+    """已登录的管理员客户端"""
+    client = app.test_client()
+    with app.app_context():
+        user_id = User.query.filter_by(username='admin').first().id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def _png():
+    buffer = io.BytesIO()
+    PilImage.new('RGB', (8, 8), (200, 120, 40)).save(buffer, 'PNG')
+    buffer.seek(0)
+    return FileStorage(buffer, filename='test.png', content_type='image/png')
+
+
+@pytest.fixture
+def make_image(database):
+    """走上传路径 ImageService.create_image 创建作品（维护计数、变更日志与版本号），返回作品 id"""
+    from services.image_service import ImageService
+
+    def make(**data):
+        data = {'title': 'test image', 'author': 'tester', 'prompt': '', 'type': 'txt2img',
+                'category': 'gallery', 'status': 'approved', **data}
+        with app.app_context():
+            return ImageService.create_image(_png(), data).id
+    return make
+
+
+@pytest.fixture
+def edit_image(database):
+    """走编辑路径 ImageService.update_image 修改作品的部分字段，其余字段保持原值"""
+    from services.image_service import ImageService
+    from models import Image
+
+    def edit(image_id, **changes):
+        with app.app_context():
+            image = db.session.get(Image, image_id)
+            data = {'title': image.title, 'author': image.author, 'prompt': image.prompt,
+                    'description': image.description, 'type': image.type, 'category': image.category,
+                    'status': image.status, 'tags': ','.join(t.name for t in image.tags), **changes}
+            ImageService.update_image(image_id, data)
+    return edit
+
+
+@pytest.fixture
+def delete_image(database):
+    from services.image_service import ImageService
+
+    def delete(image_id):
+        with app.app_context():
+            return ImageService.delete_image(image_id)
+    return delete
@@ -0,0 +1,108 @@
+import pytest
+
+from app import app
+from services.change_service import ChangeService
+
+
+@pytest.fixture
+def latest_seq(database):
+    def latest():
+        with app.app_context():
+            return ChangeService.latest_seq()
+    return latest
+
+
+def _sync(client, since, category='gallery'):
+    """按 next_since 翻页拉取全部变更，返回 (upserted ids, deleted ids, 新的 since)"""
+    upserted, deleted = set(), set()
+    while True:
+        payload = client.get('/api/changes', query_string={'since': since, 'category': category, 'limit': 2}).get_json()
+        for item in payload['data']['upserted']:
+            upserted.add(item['id'])
+            deleted.discard(item['id'])
+        for image_id in payload['data']['deleted']:
+            upserted.discard(image_id)
+            deleted.add(image_id)
+        since = payload['meta']['next_since']
+        if not payload['meta']['has_more']:
+            return upserted, deleted, since
+
+
+def test_unpublished_images_stay_out_of_the_feed(client, make_image, edit_image, delete_image, latest_seq):
+    since = latest_seq()
+    pending = make_image(title='awaiting review', status='pending')
+    edit_image(pending, title='still awaiting review')
+    rejected = make_image(title='to be rejected', status='pending')
+    delete_image(rejected)
+
+    assert latest_seq() == since
+    upserted, deleted, _ = _sync(client, since)
+    assert pending not in upserted | deleted
+    assert rejected not in upserted | deleted
+
+
+def test_visibility_changes_and_tombstones(client, make_image, edit_image, delete_image, latest_seq):
+    since = latest_seq()
+    image_id = make_image(title='moderated', status='pending')
+
+    edit_image(image_id, status='approved')
+    upserted, deleted, since = _sync(client, since)
+    assert image_id in upserted and image_id not in deleted
+
+    edit_image(image_id, status='pending')
+    upserted, deleted, since = _sync(client, since)
+    assert image_id in deleted and image_id not in upserted
+
+    # 已下发过移除的作品，再编辑 / 删除不会重复出现
+    edit_image(image_id, title='edited while hidden')
+    delete_image(image_id)
+    upserted, deleted, _ = _sync(client, since)
+    assert image_id not in upserted | deleted
+
+    published = make_image(title='published then deleted')
+    checkpoint = latest_seq()
+    delete_image(published)
+    upserted, deleted, _ = _sync(client, checkpoint)
+    assert published in deleted
+
+
+def test_category_switch_removes_from_old_category(client, make_image, edit_image, latest_seq):
+    image_id = make_image(title='moving')
+    since = latest_seq()
+    edit_image(image_id, category='template')
+
+    _, gallery_deleted, _ = _sync(client, since, 'gallery')
+    template_upserted, _, _ = _sync(client, since, 'template')
+    assert image_id in gallery_deleted
+    assert image_id in template_upserted
+
+
+def test_initial_sync_has_no_deletions(client, make_image, delete_image):
+    delete_image(make_image(title='gone before first sync'))
+    _, deleted, _ = _sync(client, 0)
+    assert deleted == set()
+
+
+def test_seqs_increase_in_commit_order(client, make_image, edit_image, latest_seq):
+    since = latest_seq()
+    first = make_image(title='first')
+    second = make_image(title='second')
+    edit_image(first, title='first, edited')
+
+    payload = client.get('/api/changes', query_string={'since': since}).get_json()
+    assert [item['id'] for item in payload['data']['upserted']] == [second, first]
+    assert payload['meta']['next_since'] == latest_seq() > since
+
+
+def test_latest_change_wins_within_window(client, make_image, edit_image, delete_image, latest_seq):
+    since = latest_seq()
+    edited = make_image(title='edited twice')
+    edit_image(edited, title='edited twice, again')
+    short_lived = make_image(title='created then deleted')
+    delete_image(short_lived)
+
+    payload = client.get('/api/changes', query_string={'since': since}).get_json()
+    upserted = [item['id'] for item in payload['data']['upserted']]
+    assert upserted == [edited]
+    assert payload['data']['upserted'][0]['title'] == 'edited twice, again'
+    assert payload['data']['deleted'] == [short_lived]
@@ -0,0 +1,84 @@
+import gzip
+import json
+import zlib
+
+import brotli
+import pytest
+
+
+def _stream_ids(body, ndjson=False):
+    if ndjson:
+        lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        return {item['id'] for item in lines[:-1]}, lines[-1]
+    payload = json.loads(body)
+    return {item['id'] for item in payload['data']}, payload
+
+
+@pytest.mark.parametrize('encoding, decompress', [('gzip', gzip.decompress), ('br', brotli.decompress)])
+def test_streamed_list_is_compressed(client, make_image, encoding, decompress):
+    created = {make_image(title=f'stream {encoding} {i}', prompt='a long prompt, ' * 20) for i in range(5)}
+
+    response = client.get('/api/gallery?per_page=-1', headers={'Accept-Encoding': encoding})
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].endswith(f'-{encoding}"')
+
+    ids, payload = _stream_ids(decompress(response.get_data()))
+    assert created <= ids
+    assert payload['code'] == 200
+
+
+def test_streamed_ndjson_decompresses_incrementally(client, make_image):
+    created = {make_image(title=f'ndjson {i}') for i in range(3)}
+
+    response = client.get('/api/gallery?format=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    # 每块都已 flush：逐块喂给解压器也能得到完整内容
+    decompressor = zlib.decompressobj(wbits=31)
+    body = b''.join(decompressor.decompress(chunk) for chunk in response.response) + decompressor.flush()
+    ids, meta = _stream_ids(body, ndjson=True)
+    assert created <= ids
+    assert 'meta' in meta
+
+
+def test_streamed_list_without_accept_encoding_is_plain(client, make_image):
+    make_image(title='plain')
+    response = client.get('/api/gallery?stream=1', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data())['code'] == 200
+
+
+@pytest.fixture
+def cached_keys(monkeypatch):
+    """记录写入 ResponseCache 的压缩结果 key"""
+    from services.response_cache import ResponseCache
+    keys = []
+    original = ResponseCache.get_or_fill
+
+    def recording(key, compute, ttl=None):
+        keys.append(key)
+        return original(key, compute, ttl)
+    monkeypatch.setattr(ResponseCache, 'get_or_fill', staticmethod(recording))
+    return keys
+
+
+def test_one_off_responses_are_compressed_but_not_cached(client, make_image, cached_keys):
+    ids = [make_image(title=f'one-off {i}', prompt='detailed prompt text, ' * 10) for i in range(4)]
+
+    changes = client.get('/api/changes?since=0', headers={'Accept-Encoding': 'gzip'})
+    lookup = client.get('/api/images', query_string={'ids': ','.join(map(str, ids))},
+                        headers={'Accept-Encoding': 'gzip'})
+    for response in (changes, lookup):
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.get_data()))['code'] == 200
+    assert not [key for key in cached_keys if key.endswith(':gzip')]
+
+
+def test_keyed_responses_reuse_cached_compression(client, make_image, cached_keys):
+    make_image(title='keyed', prompt='detailed prompt text, ' * 10)
+    for _ in range(2):
+        response = client.get('/api/gallery?per_page=50', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+    compressed = [key for key in cached_keys if key.endswith(':gzip')]
+    assert len(compressed) == 2 and compressed[0] == compressed[1] and compressed[0].startswith('api:')
@@ -0,0 +1,58 @@
+from app import app
+from extensions import db
+from models import Tag, TagFacetCount
+from services.image_count_service import ImageCountService
+from services.tag_count_service import TagCountService
+
+
+def _rebuild():
+    """执行 rebuild-tag-counts / rebuild-image-counts，返回两者修正的行数"""
+    runner = app.test_cli_runner()
+    outputs = [runner.invoke(args=[command]).output for command in ('rebuild-tag-counts', 'rebuild-image-counts')]
+    assert all('[OK]' in output for output in outputs), outputs
+    return outputs
+
+
+def _tag_ids(*names):
+    with app.app_context():
+        return [tag.id for tag in Tag.query.filter(Tag.name.in_(names))]
+
+
+def test_incremental_counts_match_rebuild(client, admin_client, make_image, edit_image, delete_image):
+    _rebuild()  # 先对齐其他用例留下的数据，下面只检查本用例写入的增量
+
+    kept = make_image(title='counted', tags='count-a,count-b')
+    pending = make_image(title='counted pending', tags='count-a', status='pending')
+    removed = make_image(title='counted removed', tags='count-b,count-c')
+    batch = [make_image(title=f'counted batch {i}', tags='count-c') for i in range(2)]
+
+    edit_image(kept, tags='count-b,count-c', type='img2img')
+    edit_image(removed, status='pending')
+    responses = [
+        admin_client.post(f'/admin/approve/{pending}'),
+        admin_client.post(f'/admin/toggle-category/{kept}/template'),
+        admin_client.post('/admin/batch/tags', json={'image_ids': batch, 'tag_ids': _tag_ids('count-a'),
+                                                     'action': 'add'}),
+        admin_client.post('/admin/batch/tags', json={'image_ids': batch[:1], 'tag_ids': _tag_ids('count-c'),
+                                                     'action': 'remove'}),
+        admin_client.post('/admin/tag/update', json={'tag_id': _tag_ids('count-c')[0], 'is_sensitive': True}),
+    ]
+    delete_image(removed)
+    responses.append(admin_client.post('/admin/batch/delete', json={'image_ids': batch[1:]}))
+    assert all(response.status_code < 400 for response in responses)
+
+    assert _rebuild() == ['[OK] Tag counts checked, 0 rows corrected\n',
+                          '[OK] Image counts checked, 0 rows corrected\n']
+
+
+def test_rebuild_repairs_drifted_counts(database, make_image):
+    make_image(title='drifted', tags='count-drift')
+    tag_id = _tag_ids('count-drift')[0]
+    with app.app_context():
+        TagFacetCount.query.filter_by(tag_id=tag_id).update({'image_count': TagFacetCount.image_count + 5})
+        db.session.commit()
+
+        assert TagCountService.rebuild() == 1
+        assert [row.image_count for row in TagFacetCount.query.filter_by(tag_id=tag_id)] == [1]
+        assert TagCountService.rebuild() == 0
+        assert ImageCountService.rebuild() == 0
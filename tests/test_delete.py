@@ -0,0 +1,42 @@
+from app import app
+from extensions import db
+from models import ImageNeighbor, ImageStatBucket, TrendingRank
+
+
+def _attach_rows(image_id, other_id):
+    """给作品写入分桶、排行与双向邻居行（排行名次取大数，避免与其他用例冲突）"""
+    with app.app_context():
+        db.session.add(ImageStatBucket(image_id=image_id, bucket=1, views=3, copies=1))
+        db.session.add(TrendingRank(image_id=image_id, rank=1_000_000 + image_id, score=1.0))
+        db.session.add(ImageNeighbor(image_id=image_id, rank=1, neighbor_id=other_id, score=0.5))
+        db.session.add(ImageNeighbor(image_id=other_id, rank=1, neighbor_id=image_id, score=0.5))
+        db.session.commit()
+
+
+def _leftover_rows(image_id):
+    with app.app_context():
+        return (ImageStatBucket.query.filter_by(image_id=image_id).count()
+                + TrendingRank.query.filter_by(image_id=image_id).count()
+                + ImageNeighbor.query.filter((ImageNeighbor.image_id == image_id)
+                                             | (ImageNeighbor.neighbor_id == image_id)).count())
+
+
+def test_delete_removes_trending_and_neighbour_rows(make_image, delete_image):
+    image_id, other_id = make_image(title='to delete'), make_image(title='neighbour')
+    _attach_rows(image_id, other_id)
+    assert _leftover_rows(image_id) == 4
+
+    assert delete_image(image_id)
+    assert _leftover_rows(image_id) == 0
+    # 另一作品邻居列表中指向被删作品的行也一并删除
+    with app.app_context():
+        assert ImageNeighbor.query.filter_by(image_id=other_id).count() == 0
+
+
+def test_batch_delete_removes_trending_and_neighbour_rows(admin_client, make_image):
+    first, second = make_image(title='batch one'), make_image(title='batch two')
+    _attach_rows(first, second)
+
+    response = admin_client.post('/admin/batch/delete', json={'image_ids': [first, second]})
+    assert response.get_json()['deleted'] == 2
+    assert _leftover_rows(first) == _leftover_rows(second) == 0
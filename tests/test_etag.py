@@ -0,0 +1,53 @@
+def _get(client, url, etag=None, **query):
+    headers = {'If-None-Match': etag} if etag else {}
+    return client.get(url, query_string=query, headers=headers)
+
+
+def _titles(response):
+    return {item['id']: item['title'] for item in response.get_json()['data']}
+
+
+def test_list_revalidates_and_refreshes_after_write(client, make_image, edit_image, delete_image):
+    tag = 'etag-list'
+    image_id = make_image(title='before edit', tags=tag)
+
+    first = _get(client, '/api/gallery', tag=tag)
+    etag = first.headers['ETag']
+    assert _titles(first) == {image_id: 'before edit'}
+    assert _get(client, '/api/gallery', etag, tag=tag).status_code == 304
+
+    # 写入后目录版本号变化：旧 ETag 不再命中，缓存的响应体也不会被复用
+    edit_image(image_id, title='after edit')
+    second = _get(client, '/api/gallery', etag, tag=tag)
+    assert second.status_code == 200 and second.headers['ETag'] != etag
+    assert _titles(second) == {image_id: 'after edit'}
+    assert _get(client, '/api/gallery', second.headers['ETag'], tag=tag).status_code == 304
+
+    delete_image(image_id)
+    third = _get(client, '/api/gallery', second.headers['ETag'], tag=tag)
+    assert third.status_code == 200 and _titles(third) == {}
+
+
+def test_other_category_keeps_its_etag(client, make_image):
+    template = _get(client, '/api/templates')
+    make_image(title='gallery only write')
+    assert _get(client, '/api/templates', template.headers['ETag']).status_code == 304
+
+
+def test_detail_revalidates_and_refreshes_after_write(client, make_image, edit_image):
+    image_id = make_image(title='detail before')
+    url = f'/api/images/{image_id}'
+
+    first = _get(client, url)
+    etag = first.headers['ETag']
+    assert first.get_json()['data']['title'] == 'detail before'
+    assert _get(client, url, etag).status_code == 304
+
+    edit_image(image_id, title='detail after')
+    second = _get(client, url, etag)
+    assert second.status_code == 200
+    assert second.get_json()['data']['title'] == 'detail after'
+
+    # 隐藏后不再可见
+    edit_image(image_id, status='pending')
+    assert _get(client, url, second.headers['ETag']).status_code == 404
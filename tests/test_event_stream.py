@@ -0,0 +1,47 @@
+from app import app
+
+
+def _is_streaming(response):
+    """/api/stream 正常建立连接时首条消息是 ready 事件，名额已满时只有 busy 注释"""
+    first = next(iter(response.response))
+    return b'event: ready' in first
+
+
+def test_slots_are_released_when_response_closes_unread(client):
+    limit = app.config['SSE_MAX_CLIENTS']
+
+    # HEAD 请求与未读取即关闭的响应都不会执行事件流生成器
+    for _ in range(limit + 1):
+        client.head('/api/stream').close()
+    for _ in range(limit + 1):
+        client.get('/api/stream').close()
+
+    response = client.get('/api/stream')
+    try:
+        assert _is_streaming(response)
+    finally:
+        response.close()
+
+
+def _close_all(responses):
+    # 同一线程中同时打开的流各自压入了请求上下文，需按后进先出的顺序关闭
+    for response in reversed(responses):
+        response.close()
+
+
+def test_open_streams_hold_slots_until_closed(client):
+    limit = app.config['SSE_MAX_CLIENTS']
+    held = [client.get('/api/stream') for _ in range(limit)]
+
+    busy = client.get('/api/stream')
+    assert not _is_streaming(busy)
+    busy.close()
+
+    _close_all(held)
+    _close_all(held)  # 重复关闭不会多归还名额
+
+    streams = [client.get('/api/stream') for _ in range(limit + 1)]
+    try:
+        assert [_is_streaming(r) for r in streams] == [True] * limit + [False]
+    finally:
+        _close_all(streams)
@@ -0,0 +1,26 @@
+import threading
+
+from app import app
+from services.maintenance_service import MaintenanceService
+
+
+def test_related_refreshes_without_view_beacons(client, make_image, monkeypatch):
+    monkeypatch.setitem(app.config, 'RELATED_REFRESH_INTERVAL', 300)
+    monkeypatch.setattr(MaintenanceService, '_pid', None)
+    first = make_image(title='castle a', prompt='ancient castle, moonlit lake', tags='castle')
+    second = make_image(title='castle b', prompt='ancient castle, moonlit lake', tags='castle')
+
+    # 任意请求即启动本进程的维护线程，不依赖浏览 / 复制埋点启动的计数刷写线程
+    client.get('/api/gallery')
+    assert any(t.name == 'maintenance' for t in threading.enumerate())
+
+    MaintenanceService.run_once()  # 不等 CHECK_INTERVAL，直接执行一轮
+    related = client.get(f'/api/images/{first}/related').get_json()['data']
+    assert second in [item['id'] for item in related]
+
+
+def test_no_thread_when_all_jobs_disabled(client, monkeypatch):
+    monkeypatch.setattr(MaintenanceService, '_pid', None)
+    monkeypatch.setattr(MaintenanceService, '_app', None)
+    client.get('/api/gallery')
+    assert MaintenanceService._app is None
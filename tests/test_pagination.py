@@ -0,0 +1,52 @@
+import pytest
+
+
+def _ids(payload):
+    return [item['id'] for item in payload['data']]
+
+
+def _walk(client, query):
+    """从第一页的 meta.next_cursor 起按游标翻页到底，返回全部 id"""
+    payload = client.get('/api/gallery', query_string=dict(query, per_page=2)).get_json()
+    ids = _ids(payload)
+    while payload['meta']['has_next']:
+        payload = client.get('/api/gallery', query_string=dict(query, per_page=2,
+                                                               cursor=payload['meta']['next_cursor'])).get_json()
+        assert payload['code'] == 200
+        ids += _ids(payload)
+    return ids
+
+
+@pytest.mark.parametrize('sort', ['date', 'hot', 'random'])
+def test_cursor_walk_matches_single_page(client, make_image, sort):
+    tag = f'cursor-{sort}'
+    created = {make_image(title=f'{tag} {i}', tags=tag) for i in range(7)}
+    query = {'tag': tag, 'sort': sort, 'seed': 42}
+
+    walked = _walk(client, query)
+    single = _ids(client.get('/api/gallery', query_string=dict(query, per_page=50)).get_json())
+    assert walked == single
+    assert set(walked) == created
+
+
+def test_cursor_is_stable_across_inserts(client, make_image):
+    tag = 'cursor-stable'
+    older = [make_image(title=f'{tag} {i}', tags=tag) for i in range(4)]
+    first = client.get('/api/gallery', query_string={'tag': tag, 'per_page': 2}).get_json()
+    assert _ids(first) == older[:1:-1]
+
+    # 新作品排在最前，不影响已发出的游标之后的结果
+    make_image(title=f'{tag} newer', tags=tag)
+    second = client.get('/api/gallery', query_string={'tag': tag, 'per_page': 2,
+                                                      'cursor': first['meta']['next_cursor']}).get_json()
+    assert _ids(second) == older[1::-1]
+    assert not second['meta']['has_next'] and second['meta']['next_cursor'] is None
+
+
+def test_invalid_cursor_is_rejected(client, make_image):
+    make_image(title='cursor-invalid 1')
+    make_image(title='cursor-invalid 2')
+    assert client.get('/api/gallery?cursor=not-a-cursor').status_code == 400
+    date_cursor = client.get('/api/gallery?per_page=1').get_json()['meta']['next_cursor']
+    assert client.get('/api/gallery', query_string={'cursor': date_cursor, 'sort': 'hot'}).status_code == 400
+    assert client.get('/api/gallery?cursor=x&sort=relevance&q=a').status_code == 400
@@ -0,0 +1,51 @@
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def search_ids(client):
+    def search(q):
+        response = client.get('/api/gallery', query_string={'q': q, 'per_page': 100})
+        return {item['id'] for item in response.get_json()['data']}
+    return search
+
+
+def test_full_text_backend_is_active(database):
+    assert app.config['SEARCH_BACKEND'] == 'fts5'
+
+
+def test_latin_terms_match_inside_words(make_image, search_ids):
+    image_id = make_image(title='Lighthouse keeper', prompt='1girl, masterpiece, solo')
+
+    # 与原先 LIKE '%q%' 一致：复合词的后半段、词中片段、前缀都能命中
+    for q in ('girl', '1girl', 'aster', 'house', 'light', 'MASTERPIECE', 'girl aster'):
+        assert image_id in search_ids(q), q
+    assert image_id not in search_ids('girls')
+
+
+def test_cjk_terms_still_match(make_image, search_ids):
+    image_id = make_image(title='夜晚的城市', prompt='霓虹灯, city lights')
+    assert image_id in search_ids('城市')
+    assert image_id in search_ids('霓虹')
+    assert image_id not in search_ids('城堡')
+
+
+def test_outdated_documents_are_rebuilt(make_image, search_ids):
+    from extensions import db
+    from models import Image, SystemSetting
+    from services.search_service import SearchService
+
+    image_id = make_image(title='compound', prompt='1boy, outdoors')
+    with app.app_context():
+        # 模拟升级前写入的文档：只有整词，没有后缀
+        image = db.session.get(Image, image_id)
+        image.search_text = ' '.join(SearchService.tokenize(image.title)) + ' | ' + \
+            ' '.join(SearchService.tokenize(image.prompt))
+        SystemSetting.set_int(SearchService.DOCUMENT_VERSION_KEY, 1)
+    assert image_id not in search_ids('boy')
+
+    with app.app_context():
+        SearchService.reindex(only_missing=True)
+        assert SystemSetting.get_int(SearchService.DOCUMENT_VERSION_KEY) == SearchService.DOCUMENT_VERSION
+    assert image_id in search_ids('boy')